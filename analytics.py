@@ -0,0 +1,202 @@
+import datetime
+import math
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+from coa_data import SECTIONS, data_hash
+from coa_settings import VAR_DIR
+from compliance import evaluate, parse_number, FAIL
+
+DEFAULT_DB_PATH = os.path.join(VAR_DIR, "analytics.sqlite3")
+
+# Bucket that holds the all-time aggregate next to the per-day buckets
+ALL_TIME = "*"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS issued_coas (
+    data_hash TEXT PRIMARY KEY,
+    product_code TEXT NOT NULL,
+    issued_on TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS analyte_stats (
+    product_code TEXT NOT NULL,
+    analyte TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    m2 REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    out_of_spec INTEGER NOT NULL,
+    censored INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (product_code, analyte, bucket)
+);
+"""
+
+# Columns added after the first release, with their definitions, for stores created before
+ADDED_COLUMNS = {
+    "censored": "INTEGER NOT NULL DEFAULT 0",
+}
+
+# Results reported against a limit rather than measured: "<10 cfu/g", "> 95%", "NMT 2 ppm"
+_CENSORED_RE = re.compile(
+    r"^(?:<|>|≤|≥|less\s+than|below|more\s+than|greater\s+than|above|nmt|nlt|not\s+(?:more|less)\s+than)",
+    re.IGNORECASE,
+)
+
+
+def analyte_results(data):
+    """(analyte, specification, result) for every filled-in spec row of a data dict.
+
+    Base analytes are named by their key prefix ("moisture" for moisture_result),
+    extra rows by their parameter label.
+    """
+    rows = []
+    for _, extra_key, base_rows in SECTIONS:
+        for _, prefix in base_rows:
+            spec = data.get(f"{prefix}_spec")
+            result = data.get(f"{prefix}_result")
+            if spec and result and data.get(f"{prefix}_method"):
+                rows.append((prefix, spec, result))
+        for row in data.get(extra_key, []):
+            if row and row[0]:
+                rows.append((str(row[0]), row[1], row[2]))
+    return rows
+
+
+def is_censored(result):
+    """True for a result that only bounds the value, such as "<10" or "> 95%"."""
+    return bool(_CENSORED_RE.match(str(result).strip()))
+
+
+class Aggregate:
+    """Running count/mean/variance (Welford), min/max and out-of-spec count for one analyte.
+
+    count, mean, min and max cover measured numeric results only; censored results
+    ("<10", a detection limit rather than a value) are counted apart, and out_of_spec
+    counts every result judged FAIL, numeric or not.
+    """
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, min=math.inf, max=-math.inf, out_of_spec=0, censored=0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.min = min
+        self.max = max
+        self.out_of_spec = out_of_spec
+        self.censored = censored
+
+    def add(self, value, failed, censored=False):
+        """Fold in one result; a non-numeric one (NaN, e.g. "Present") only counts towards
+        out_of_spec, a censored one towards censored and out_of_spec."""
+        self.out_of_spec += int(failed)
+        if censored:
+            self.censored += 1
+            return
+        if math.isnan(value):
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+class AnalyticsStore:
+    """Per-product, per-analyte aggregates, updated once as each COA is issued.
+
+    Trend queries read the stored aggregates only; certificates are never rescanned.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(analyte_stats)")}
+            for column, definition in ADDED_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE analyte_stats ADD COLUMN {column} {definition}")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def record_issue(self, data, issued_on=None):
+        """Fold one issued COA into the aggregates. Returns False if this exact data was already recorded."""
+        product_code = (data.get("product_code") or "").strip()
+        issued_on = (issued_on or datetime.date.today()).isoformat()
+        rows = analyte_results(data)
+        values = [parse_number(str(result)) for _, _, result in rows]
+        censored = [is_censored(result) for _, _, result in rows]
+        statuses = evaluate([spec for _, spec, _ in rows], [result for _, _, result in rows])
+
+        with self._lock, self._connect() as conn:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO issued_coas (data_hash, product_code, issued_on) VALUES (?, ?, ?)",
+                (data_hash(data), product_code, issued_on),
+            ).rowcount
+            if not inserted:
+                return False
+            for (analyte, _, _), value, is_bound, status in zip(rows, values, censored, statuses):
+                if np.isnan(value) and status != FAIL:
+                    continue  # nothing to fold in
+                for bucket in (ALL_TIME, issued_on):
+                    agg = self._load(conn, product_code, analyte, bucket)
+                    agg.add(value, status == FAIL, is_bound)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO analyte_stats (product_code, analyte, bucket, count, mean, m2,"
+                        " min, max, out_of_spec, censored) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (product_code, analyte, bucket, agg.count, agg.mean, agg.m2, agg.min, agg.max,
+                         agg.out_of_spec, agg.censored),
+                    )
+        return True
+
+    def _load(self, conn, product_code, analyte, bucket):
+        row = conn.execute(
+            "SELECT count, mean, m2, min, max, out_of_spec, censored FROM analyte_stats "
+            "WHERE product_code = ? AND analyte = ? AND bucket = ?",
+            (product_code, analyte, bucket),
+        ).fetchone()
+        return Aggregate(*row) if row else Aggregate()
+
+    # ------------------------------------------------------------------
+    # Trend queries
+    # ------------------------------------------------------------------
+    def products(self):
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute(
+                "SELECT DISTINCT product_code FROM analyte_stats ORDER BY product_code")]
+
+    def analytes(self, product_code):
+        with self._connect() as conn:
+            return [r[0] for r in conn.execute(
+                "SELECT analyte FROM analyte_stats WHERE product_code = ? AND bucket = ? ORDER BY analyte",
+                (product_code, ALL_TIME))]
+
+    def summary(self, product_code, analyte):
+        with self._connect() as conn:
+            return self._load(conn, product_code, analyte, ALL_TIME)
+
+    def trend(self, product_code, analyte):
+        """[(day, Aggregate), ...] in date order, one entry per day with issued COAs."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT bucket, count, mean, m2, min, max, out_of_spec, censored FROM analyte_stats "
+                "WHERE product_code = ? AND analyte = ? AND bucket != ? ORDER BY bucket",
+                (product_code, analyte, ALL_TIME),
+            ).fetchall()
+        return [(row[0], Aggregate(*row[1:])) for row in rows]
@@ -1,20 +1,26 @@
 import os
 from typing import Container
 import streamlit as st
-
-# ReportLab imports
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.platypus import (
-    SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer,
-    KeepInFrame
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from render_queue import RenderQueue, DONE, FAILED, INTERACTIVE
+from renderers import BACKENDS, DEFAULT_BACKEND
+from pdf_optimize import OptimizedPdf
+from coa_data import spec_sections
+from compliance import evaluate_sections, FAIL
+from analytics import AnalyticsStore
+from coa_archive import CoaArchive
+from coa_search import CoaSearchIndex
+from coa_html import preview_html
+from coa_validate import validate
+from row_grid import (
+    rows_to_frame, frame_to_rows, parse_pasted_rows,
+    SPEC_ROW_COLUMNS, PRODUCT_ROW_COLUMNS, ORDER_COLUMN, GRID_ROWS_THRESHOLD,
 )
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER
-
-import io
-import fitz  # PyMuPDF
-import configparser
+from session_memory import SessionMemory, DEFAULT_CAP_MB, DEFAULT_IDLE_MINUTES, DEFAULT_SPILL_DIR
+from coa_outbox import Outbox, OutboxDispatcher, SmtpPool
+from coa_settings import get_settings, ALLERGEN_STATEMENTS
+import pandas as pd
 
 # -----------------------------
 # INITIALIZE SESSION STATE
@@ -34,330 +40,193 @@ if "MicrobiologicalProfile_rows" not in st.session_state:
 if "Product_rows" not in st.session_state:
     st.session_state["Product_rows"] = []
 
-# Initialize the configparser
-config = configparser.ConfigParser()
-config.read('.streamlit/config.toml')
-theme = config.get('settings', 'theme', fallback='default')
+# Parsed once per process and re-read only when the file changes (see coa_settings)
+settings = get_settings()
+theme = settings.get('theme', 'default')
+session_cap_mb = float(settings.get('session_memory_cap_mb', DEFAULT_CAP_MB))
+session_idle_minutes = float(settings.get('session_idle_minutes', DEFAULT_IDLE_MINUTES))
+admin_key = str(settings.get('admin_key', ''))
+smtp_host = settings.get('smtp_host', '')
+smtp_port = int(settings.get('smtp_port', 25))
+smtp_user = settings.get('smtp_user', '')
+smtp_sender = settings.get('smtp_sender', '')
+smtp_starttls = bool(settings.get('smtp_starttls', False))
 
 st.set_page_config(page_title="Tru Herb COA PDF Generator", layout="wide")
 
 
-def header_footer(canvas, doc):
-    canvas.saveState()
-    logo_path = os.path.join(os.getcwd(), "images", "tru_herb_logo.png")
-    footer_path = os.path.join(os.getcwd(), "images", "footer.png")
+# ----------------------------------------------------------------------------
+# HELPER to initialize a session_state key if not present
+# ----------------------------------------------------------------------------
+def init_ss(key, default):
+    if key not in st.session_state:
+        st.session_state[key] = default
 
-    if os.path.exists(logo_path):
-        canvas.drawImage(logo_path, x=250, y=A4[1] - 55, width=100, height=50)
-    if os.path.exists(footer_path):
-        canvas.drawImage(footer_path, x=50, y=5, width=500, height=80)
-    canvas.restoreState()
+# ----------------------------------------------------------------------------
+# GRID EDITOR for the extra rows of a section
+#
+# One st.data_editor replaces a panel's per-row text inputs and Delete buttons:
+# rows are pasted, deleted (select + delete) and reordered (Order column) in
+# the grid, and the edited frame is written back to the rows list in one go.
+# ----------------------------------------------------------------------------
+def grid_mode(rows_key):
+    return st.toggle(
+        "Edit as grid",
+        value=len(st.session_state[rows_key]) > GRID_ROWS_THRESHOLD,
+        key=f"{rows_key}_grid_mode",
+    )
 
 
-def generate_pdf(data):
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=A4,
-        topMargin=50,
-        bottomMargin=80
-    )
-    styles = getSampleStyleSheet()
-
-    title_style = ParagraphStyle(
-        'title_style',
-        fontSize=12,
-        spaceAfter=1,
-        alignment=1,
-        fontName='Times-Bold'
-    )
-    title_style1 = ParagraphStyle(
-        'title_style1',
-        fontSize=10,
-        spaceAfter=0,
-        alignment=1,
-        fontName='Times-Bold'
-    )
-    normal_style = styles['BodyText']
-    normal_style.fontName = 'Times-Roman'
-    normal_style.alignment = 0  # left aligned
-
-    # NEW: Define a style for the Method column that center aligns the text.
-    method_style = ParagraphStyle('method_style', parent=normal_style, alignment=1)
-    
-    style_for_sections = styles["Normal"]
-
-    elements = []
-    elements.append(Spacer(1, 3))
-    elements.append(Paragraph("CERTIFICATE OF ANALYSIS", title_style))
-    elements.append(Paragraph(data.get('product_name', '').upper(), title_style))
-    elements.append(Spacer(1, 3))
-
-    # ----------------------------------------------------------------
-    # Build Product Info table, skipping truly empty fields
-    # ----------------------------------------------------------------
-    product_info = []
-
-    def maybe_add_product_row(label, value, italic=False, bold=False):
-        text_str = value.strip() if value else ""
-        if text_str:
-            if italic:
-                text_str = f"<i>{text_str}</i>"
-            if bold:
-                text_str = f"<b>{text_str}</b>"
-            product_info.append([Paragraph(f"<b>{label}</b>"), Paragraph(text_str, normal_style)])
-
-    maybe_add_product_row("Product Name", data.get('product_name', ''), bold=True)
-    maybe_add_product_row("Product Code", data.get('product_code', ''))
-    maybe_add_product_row("Batch No.", data.get('batch_no', ''))
-    maybe_add_product_row("Date of Manufacturing", data.get('manufacturing_date', ''))
-    maybe_add_product_row("Date of Reanalysis", data.get('reanalysis_date', ''))
-    maybe_add_product_row("Botanical Name", data.get('botanical_name', ''), italic=True)
-    maybe_add_product_row("Extraction Ratio", data.get('extraction_ratio', ''))
-    maybe_add_product_row("Extraction Solvents", data.get('solvent', ''))
-    maybe_add_product_row("Plant Parts", data.get('plant_part', ''))
-    maybe_add_product_row("CAS No.", data.get('cas_no', ''))
-    maybe_add_product_row("Chemical Name", data.get('chemical_name', ''))
-    maybe_add_product_row("Quantity", data.get('quantity', ''))
-    # Add dynamic additional product info rows (if any)
-    for row in data.get("product_additional_rows", []):
-        maybe_add_product_row(row[0], row[1])
-    maybe_add_product_row("Country of Origin", data.get('origin', ''))
-
-    if product_info:
-        product_table = Table(product_info, colWidths=[140, 360])
-        product_table.setStyle(TableStyle([
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-            ('FONTNAME', (0, 0), (-1, -1), 'Times-Roman'),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('WORDWRAP', (0, 0), (-1, -1), 'LTR'),
-        ]))
-        elements.append(product_table)
-        elements.append(Spacer(1, 0))
-
-    # ----------------------------------------------------------------
-    # SPECIFICATIONS TABLE
-    # ----------------------------------------------------------------
-    
-    header_style = ParagraphStyle(
-        'header_style',
-        parent=styles['Normal'],
-        alignment=1,  # center aligned
-        fontName='Helvetica-Bold',
-        fontSize=10
-    )
-    
-    spec_headers = [
-        Paragraph("Parameter", header_style),
-        Paragraph("Specification", header_style),
-        Paragraph("Result", header_style),
-        Paragraph("Method", header_style)
-    ]
-    spec_data = [spec_headers]
-    heading_rows = []
-    current_row_index = 1
-
-    def combine_section(section_key, base_rows):
-        extra_rows = data.get(section_key, [])
-        return [row for row in base_rows if row] + [r for r in extra_rows if r]
-
-    physical_base = [
-        ("Description", data['description_spec'], data['description_result'], data['description_method'])
-            if data['description_spec'] and data['description_result'] and data['description_method'] else None,
-        ("Identification", data['identification_spec'], data['identification_result'], data['identification_method'])
-            if data['identification_spec'] and data['identification_result'] and data['identification_method'] else None,
-        ("Loss on Drying", data['loss_on_drying_spec'], data['loss_on_drying_result'], data['loss_on_drying_method'])
-            if data['loss_on_drying_spec'] and data['loss_on_drying_result'] and data['loss_on_drying_method'] else None,
-        ("Moisture", data['moisture_spec'], data['moisture_result'], data['moisture_method'])
-            if data['moisture_spec'] and data['moisture_result'] and data['moisture_method'] else None,
-        ("Particle Size", data['particle_size_spec'], data['particle_size_result'], data['particle_size_method'])
-            if data['particle_size_spec'] and data['particle_size_result'] and data['particle_size_method'] else None,
-        ("Ash Contents", data['ash_contents_spec'], data['ash_contents_result'], data['ash_contents_method'])
-            if data['ash_contents_spec'] and data['ash_contents_result'] and data['ash_contents_method'] else None,
-        ("Residue on Ignition", data['residue_on_ignition_spec'], data['residue_on_ignition_result'],
-         data['residue_on_ignition_method'])
-            if data['residue_on_ignition_spec'] and data['residue_on_ignition_result'] and data['residue_on_ignition_method'] else None,
-        ("Bulk Density", data['bulk_density_spec'], data['bulk_density_result'], data['bulk_density_method'])
-            if data['bulk_density_spec'] and data['bulk_density_result'] and data['bulk_density_method'] else None,
-        ("Tapped Density", data['tapped_density_spec'], data['tapped_density_result'], data['tapped_density_method'])
-            if data['tapped_density_spec'] and data['tapped_density_result'] and data['tapped_density_method'] else None,
-        ("Solubility", data['solubility_spec'], data['solubility_result'], data['solubility_method'])
-            if data['solubility_spec'] and data['solubility_result'] and data['solubility_method'] else None,
-        ("pH", data['ph_spec'], data['ph_result'], data['ph_method'])
-            if data['ph_spec'] and data['ph_result'] and data['ph_method'] else None,
-        ("Chlorides of NaCl", data['chlorides_nacl_spec'], data['chlorides_nacl_result'], data['chlorides_nacl_method'])
-            if data['chlorides_nacl_spec'] and data['chlorides_nacl_result'] and data['chlorides_nacl_method'] else None,
-        ("Sulphates", data['sulphates_spec'], data['sulphates_result'], data['sulphates_method'])
-            if data['sulphates_spec'] and data['sulphates_result'] and data['sulphates_method'] else None,
-        ("Fats", data['fats_spec'], data['fats_result'], data['fats_method'])
-            if data['fats_spec'] and data['fats_result'] and data['fats_method'] else None,
-        ("Protein", data['protein_spec'], data['protein_result'], data['protein_method'])
-            if data['protein_spec'] and data['protein_result'] and data['protein_method'] else None,
-        ("Total IgG", data['total_ig_g_spec'], data['total_ig_g_result'], data['total_ig_g_method'])
-            if data['total_ig_g_spec'] and data['total_ig_g_result'] and data['total_ig_g_method'] else None,
-        ("Sodium", data['sodium_spec'], data['sodium_result'], data['sodium_method'])
-            if data['sodium_spec'] and data['sodium_result'] and data['sodium_method'] else None,
-        ("Gluten", data['gluten_spec'], data['gluten_result'], data['gluten_method'])
-            if data['gluten_spec'] and data['gluten_result'] and data['gluten_method'] else None,
-    ]
-    others_base = [
-        ("Lead", data['lead_spec'], data['lead_result'], data['lead_method'])
-            if data['lead_spec'] and data['lead_result'] and data['lead_method'] else None,
-        ("Cadmium", data['cadmium_spec'], data['cadmium_result'], data['cadmium_method'])
-            if data['cadmium_spec'] and data['cadmium_result'] and data['cadmium_method'] else None,
-        ("Arsenic", data['arsenic_spec'], data['arsenic_result'], data['arsenic_method'])
-            if data['arsenic_spec'] and data['arsenic_result'] and data['arsenic_method'] else None,
-        ("Mercury", data['mercury_spec'], data['mercury_result'], data['mercury_method'])
-            if data['mercury_spec'] and data['mercury_result'] and data['mercury_method'] else None,
-    ]
-    assays_base = [
-        ("Assays", data['assays_spec'], data['assays_result'], data['assays_method'])
-            if data['assays_spec'] and data['assays_result'] and data['assays_method'] else None,
-    ]
-    pesticides_base = [
-        ("Pesticide", data['pesticide_spec'], data['pesticide_result'], data['pesticide_method'])
-            if data['pesticide_spec'] and data['pesticide_result'] and data['pesticide_method'] else None,
-    ]
-    residual_solvent_base = [
-        ("Residual Solvent", data['residual_solvent_spec'], data['residual_solvent_result'], data['residual_solvent_method'])
-            if data['residual_solvent_spec'] and data['residual_solvent_result'] and data['residual_solvent_method'] else None,
-    ]
-    microbio_base = [
-        ("Total Plate Count", data['total_plate_count_spec'], data['total_plate_count_result'], data['total_plate_count_method'])
-            if data['total_plate_count_spec'] and data['total_plate_count_result'] and data['total_plate_count_method'] else None,
-        ("Yeasts & Mould Count", data['yeasts_mould_spec'], data['yeasts_mould_result'], data['yeasts_mould_method'])
-            if data['yeasts_mould_spec'] and data['yeasts_mould_result'] and data['yeasts_mould_method'] else None,
-        ("Salmonella", data['salmonella_spec'], data['salmonella_result'], data['salmonella_method'])
-            if data['salmonella_spec'] and data['salmonella_result'] and data['salmonella_method'] else None,
-        ("Escherichia coli", data['e_coli_spec'], data['e_coli_result'], data['e_coli_method'])
-            if data['e_coli_spec'] and data['e_coli_result'] and data['e_coli_method'] else None,
-        ("Coliforms", data['coliforms_spec'], data['coliforms_result'], data['coliforms_method'])
-            if data['coliforms_spec'] and data['coliforms_result'] and data['coliforms_method'] else None,
-    ]
+def drop_grid(rows_key):
+    # The editor keeps its edits relative to the frame it was created from; a new
+    # frame needs a new widget key
+    if st.session_state.pop(f"{rows_key}_grid_base", None) is not None:
+        st.session_state[f"{rows_key}_grid_version"] = st.session_state.get(f"{rows_key}_grid_version", 0) + 1
 
-    sections = {
-        "Physical": combine_section("physical_extra_rows", physical_base),
-        "Others": combine_section("others_extra_rows", others_base),
-        "Assays": combine_section("assays_extra_rows", assays_base),
-        "Pesticides": combine_section("pesticides_extra_rows", pesticides_base),
-        "Residual Solvent": combine_section("residual_solvent_extra_rows", residual_solvent_base),
-        "Microbiological Profile": combine_section("microbio_extra_rows", microbio_base),
-    }
 
-    for section_name, rows in sections.items():
-        if rows:
-            spec_data.append([Paragraph(f"<b>{section_name}</b>", style_for_sections), "", "", ""])
-            heading_rows.append(len(spec_data) - 1)
-            for param_tuple in rows:
-                # Use method_style (center aligned) for column 3, normal_style for others
-                row_cells = [
-                    Paragraph(str(cell), method_style) if idx == 3 else Paragraph(str(cell), normal_style)
-                    for idx, cell in enumerate(param_tuple)
-                ]
-                spec_data.append(row_cells)
-
-    # Remarks
-    remarks_text = ("Since the product is derived from natural origin, there is likely to be minor color "
-                    "variation because of the geographical and seasonal variations of the raw material")
-    end_text = "REMARKS: COMPLIES WITH IN HOUSE SPECIFICATIONS"
-    spec_data.append([Paragraph(remarks_text, normal_style), "", "", ""])
-    last_remarks_row = len(spec_data) - 1
-    spec_data.append([Paragraph(end_text, ParagraphStyle('bold_center',
-                                                         parent=styles['Normal'],
-                                                         fontName='Helvetica-Bold',
-                                                         alignment=1)),
-                      "", "", ""])
-    final_remark_row = len(spec_data) - 1
-
-    total_width = 500
-    col_widths = [total_width * 0.23,
-                  total_width * 0.39,
-                  total_width * 0.18,
-                  total_width * 0.20]
-    
-    spec_table = Table(spec_data, colWidths=col_widths)
-
-    spec_table_style = [
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-        ('FONTNAME', (0, 0), (-1, -1), 'Times-Roman'),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('WORDWRAP', (0, 0), (-1, -1), 'LTR'),
-    ]
-    # (The table style alignment for column 3 below is now optional since our Paragraph style takes precedence.)
-    spec_table_style.append(('ALIGN', (3, 0), (3, -1), 'CENTER'))
-    
-    for heading_row in heading_rows:
-        spec_table_style.append(('SPAN', (0, heading_row), (-1, heading_row)))
-    spec_table_style.append(('SPAN', (0, last_remarks_row), (-1, last_remarks_row)))
-    spec_table_style.append(('SPAN', (0, final_remark_row), (-1, final_remark_row)))
-
-    spec_table.setStyle(TableStyle(spec_table_style))
-    elements.append(spec_table)
-    elements.append(Spacer(1, 2))
+def append_pasted_rows(rows_key, columns):
+    pasted = parse_pasted_rows(st.session_state.get(f"{rows_key}_paste", ""), columns)
+    st.session_state[rows_key] = st.session_state[rows_key] + pasted
+    st.session_state[f"{rows_key}_paste"] = ""
+    drop_grid(rows_key)
 
-    # Declaration
-    elements.append(Paragraph("Declaration", title_style1))
-    declaration_data = [
-        [
-            "GMO Status:",
-            Paragraph("Free from GMO", normal_style),
-            "",
-            "Allergen statement:",
-            Paragraph(f"{data.get('allergen_statement','Free from allergen')}", normal_style)
-        ],
-        [
-            "Irradiation status:",
-            Paragraph("Non – Irradiated", normal_style),
-            "",
-            "Storage condition:",
-            Paragraph("At room temperature", normal_style)
-        ],
-        [
-            "Prepared by",
-            Paragraph("Executive – QC", normal_style),
-            "",
-            "Approved by",
-            Paragraph("Head-QC/QA", normal_style)
-        ]
-    ]
-    declaration_table = Table(declaration_data, colWidths=[80, 150, 75, 100, 95])
-    declaration_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('ALIGN', (0, 0), (1, -1), 'LEFT'),
-        ('ALIGN', (3, 0), (4, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('WORDWRAP', (0, 0), (-1, -1), 'LTR'),
-        ('LEFTPADDING', (0, 0), (-1, -1), 0),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 0),
-        ('TOPPADDING', (0, 0), (-1, -1), 0),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
-        ('SPAN', (2, 0), (2, 2)),
-    ]))
-    elements.append(declaration_table)
-    elements.append(Spacer(1, 3))
-
-    # Force single page
-    kiframe = KeepInFrame(
-        maxWidth=A4[0] - doc.leftMargin - doc.rightMargin,
-        maxHeight=A4[1] - doc.topMargin - doc.bottomMargin,
-        content=elements,
-        mode='shrink'
+
+def clear_rows(rows_key):
+    st.session_state[rows_key] = []
+    drop_grid(rows_key)
+
+
+def row_grid_editor(rows_key, columns):
+    base_key = f"{rows_key}_grid_base"
+    if base_key not in st.session_state:
+        st.session_state[base_key] = rows_to_frame(st.session_state[rows_key], columns)
+    edited = st.data_editor(
+        st.session_state[base_key],
+        key=f"{rows_key}_grid_{st.session_state.get(f'{rows_key}_grid_version', 0)}",
+        num_rows="dynamic",
+        hide_index=True,
+        use_container_width=True,
+        column_config={ORDER_COLUMN: st.column_config.NumberColumn(
+            ORDER_COLUMN, width="small", step=1,
+            help="Printed order; to move a row after row n, set it to n",
+        )},
     )
-    elements = [kiframe]
+    st.session_state[rows_key] = frame_to_rows(edited, columns)
 
-    doc.build(elements, onFirstPage=header_footer, onLaterPages=header_footer)
-    buffer.seek(0)
-    return buffer
+    st.text_area(
+        "Paste rows (tab or comma separated, one per line)",
+        key=f"{rows_key}_paste",
+        height=68,
+    )
+    paste_col, order_col, clear_col = st.columns(3)
+    paste_col.button("Append pasted rows", key=f"{rows_key}_paste_rows",
+                     on_click=append_pasted_rows, args=(rows_key, columns))
+    order_col.button("Apply order", key=f"{rows_key}_renumber", on_click=drop_grid, args=(rows_key,),
+                     help="Renumber the rows in their printed order")
+    clear_col.button("Delete all rows", key=f"{rows_key}_clear", on_click=clear_rows, args=(rows_key,))
 
 # ----------------------------------------------------------------------------
-# HELPER to initialize a session_state key if not present
+# BACKGROUND RENDERING
 # ----------------------------------------------------------------------------
-def init_ss(key, default):
-    if key not in st.session_state:
-        st.session_state[key] = default
+@st.cache_resource
+def get_render_queue():
+    # One queue per server process, shared by every session
+    return RenderQueue(spill_dir=DEFAULT_SPILL_DIR)
+
+render_queue = get_render_queue()
+
+
+@st.cache_resource
+def get_session_memory():
+    return SessionMemory(render_queue, cap_mb=session_cap_mb, idle_minutes=session_idle_minutes)
+
+session_memory = get_session_memory()
+
+
+@st.cache_resource
+def get_analytics_store():
+    return AnalyticsStore()
+
+analytics_store = get_analytics_store()
+
+
+@st.cache_resource
+def get_coa_archive():
+    return CoaArchive()
+
+coa_archive = get_coa_archive()
+
+
+@st.cache_resource
+def get_search_index():
+    index = CoaSearchIndex(coa_archive)
+    index.refresh()
+    return index
+
+search_index = get_search_index()
+
+
+@st.cache_resource
+def get_outbox():
+    return Outbox()
+
+outbox = get_outbox()
+
+
+@st.cache_resource
+def get_outbox_dispatcher():
+    # Without an SMTP server configured, queued emails wait for `python coa_outbox.py send`
+    if not smtp_host:
+        return None
+    pool = SmtpPool(smtp_host, smtp_port, smtp_user or None, os.environ.get("COA_SMTP_PASSWORD"), smtp_starttls)
+    return OutboxDispatcher(outbox, pool, default_sender=smtp_sender).start()
+
+get_outbox_dispatcher()
+
+
+def session_owner():
+    # Renders are shared fairly between browser sessions
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+
+def get_job(state_key):
+    job_id = st.session_state.get(state_key)
+    if not job_id:
+        return None
+    job = render_queue.get(job_id)
+    if job is None:
+        # Dropped from the finished history; the user has to submit again
+        st.session_state.pop(state_key, None)
+    return job
+
+
+def job_status_fragment(state_key, on_done):
+    job = get_job(state_key)
+    if job is None:
+        return
+    polling = not job.finished
+
+    # Only a pending job polls; the full rerun after it finishes switches polling off again
+    @st.fragment(run_every=0.5 if polling else None)
+    def _status():
+        job = get_job(state_key)
+        if job is None:
+            return
+        if job.finished and polling:
+            st.rerun()
+        if job.state == DONE:
+            on_done(job.result)
+        elif job.state == FAILED:
+            st.error(f"Rendering failed: {job.error}")
+        else:
+            position = render_queue.queue_position(job.job_id)
+            if position:
+                st.info(f"Queued behind {position} other render(s)...")
+            else:
+                st.info(f"Rendering... {job.elapsed():.1f}s")
+
+    _status()
 
 # ----------------------------------------------------------------------------
 # STREAMLIT UI
@@ -394,25 +263,29 @@ with col1:
     quantity = row6_col2.text_input("Quantity", placeholder="X")
 
     st.markdown("#### Add Additional Product Info Rows")
-    for i, row_data in enumerate(st.session_state["Product_rows"]):
-        col_label, col_value, col_del = st.columns([3, 7, 2])
-        st.session_state["Product_rows"][i]["label"] = col_label.text_input(
-            f"Additional Label {i+1}",
-            row_data.get("label", ""),
-            key=f"ProductLabel_{i}"
-        )
-        st.session_state["Product_rows"][i]["value"] = col_value.text_input(
-            f"Additional Value {i+1}",
-            row_data.get("value", ""),
-            key=f"ProductValue_{i}"
-        )
-        if col_del.button("Delete", key=f"del_product_{i}"):
-            st.session_state["Product_rows"].pop(i)
-            st.rerun()
+    if grid_mode("Product_rows"):
+        row_grid_editor("Product_rows", PRODUCT_ROW_COLUMNS)
+    else:
+        drop_grid("Product_rows")
+        for i, row_data in enumerate(st.session_state["Product_rows"]):
+            col_label, col_value, col_del = st.columns([3, 7, 2])
+            st.session_state["Product_rows"][i]["label"] = col_label.text_input(
+                f"Additional Label {i+1}",
+                row_data.get("label", ""),
+                key=f"ProductLabel_{i}"
+            )
+            st.session_state["Product_rows"][i]["value"] = col_value.text_input(
+                f"Additional Value {i+1}",
+                row_data.get("value", ""),
+                key=f"ProductValue_{i}"
+            )
+            if col_del.button("Delete", key=f"del_product_{i}"):
+                st.session_state["Product_rows"].pop(i)
+                st.rerun()
 
-    if st.button("Add New Additional Product Info Row"):
-        st.session_state["Product_rows"].append({"label": "", "value": ""})
-        st.rerun()
+        if st.button("Add New Additional Product Info Row"):
+            st.session_state["Product_rows"].append({"label": "", "value": ""})
+            st.rerun()
 
     origin = st.text_input("Country of Origin", value="India")
 
@@ -735,27 +608,31 @@ with col1:
         st.rerun()
 
     st.markdown("#### Add Additional Physical Rows")
-    for i, row_data in enumerate(st.session_state["Physical_rows"]):
-        c1, c2, c3, c4, del_col = st.columns([3, 2.5, 2.5, 2.5, 2])
-        st.session_state["Physical_rows"][i]["param"] = c1.text_input(
-            f"Physical Parameter {i+1}", row_data["param"], key=f"PhysicalParam_{i}"
-        )
-        st.session_state["Physical_rows"][i]["spec"] = c2.text_input(
-            f"Physical Spec {i+1}", row_data["spec"], key=f"PhysicalSpec_{i}"
-        )
-        st.session_state["Physical_rows"][i]["result"] = c3.text_input(
-            f"Physical Result {i+1}", row_data["result"], key=f"PhysicalResult_{i}"
-        )
-        st.session_state["Physical_rows"][i]["method"] = c4.text_input(
-            f"Physical Method {i+1}", row_data["method"], key=f"PhysicalMethod_{i}"
-        )
-        if del_col.button("Delete", key=f"del_physical_{i}"):
-            st.session_state["Physical_rows"].pop(i)
-            st.rerun()
+    if grid_mode("Physical_rows"):
+        row_grid_editor("Physical_rows", SPEC_ROW_COLUMNS)
+    else:
+        drop_grid("Physical_rows")
+        for i, row_data in enumerate(st.session_state["Physical_rows"]):
+            c1, c2, c3, c4, del_col = st.columns([3, 2.5, 2.5, 2.5, 2])
+            st.session_state["Physical_rows"][i]["param"] = c1.text_input(
+                f"Physical Parameter {i+1}", row_data["param"], key=f"PhysicalParam_{i}"
+            )
+            st.session_state["Physical_rows"][i]["spec"] = c2.text_input(
+                f"Physical Spec {i+1}", row_data["spec"], key=f"PhysicalSpec_{i}"
+            )
+            st.session_state["Physical_rows"][i]["result"] = c3.text_input(
+                f"Physical Result {i+1}", row_data["result"], key=f"PhysicalResult_{i}"
+            )
+            st.session_state["Physical_rows"][i]["method"] = c4.text_input(
+                f"Physical Method {i+1}", row_data["method"], key=f"PhysicalMethod_{i}"
+            )
+            if del_col.button("Delete", key=f"del_physical_{i}"):
+                st.session_state["Physical_rows"].pop(i)
+                st.rerun()
 
-    if st.button("Add New Physical Row"):
-        st.session_state["Physical_rows"].append({"param": "", "spec": "", "result": "", "method": ""})
-        st.rerun()
+        if st.button("Add New Physical Row"):
+            st.session_state["Physical_rows"].append({"param": "", "spec": "", "result": "", "method": ""})
+            st.rerun()
 
     # ----------------------------------------------------------------------
     # OTHERS
@@ -818,27 +695,31 @@ with col1:
         st.rerun()
 
     st.markdown("#### Add Additional Others Rows")
-    for i, row_data in enumerate(st.session_state["Others_rows"]):
-        c1, c2, c3, c4, del_col = st.columns([3, 2.5, 2.5, 2.5, 2])
-        st.session_state["Others_rows"][i]["param"] = c1.text_input(
-            f"Others Parameter {i+1}", row_data.get("param",""), key=f"OthersParam_{i}"
-        )
-        st.session_state["Others_rows"][i]["spec"] = c2.text_input(
-            f"Others Spec {i+1}", row_data.get("spec",""), key=f"OthersSpec_{i}"
-        )
-        st.session_state["Others_rows"][i]["result"] = c3.text_input(
-            f"Others Result {i+1}", row_data.get("result",""), key=f"OthersResult_{i}"
-        )
-        st.session_state["Others_rows"][i]["method"] = c4.text_input(
-            f"Others Method {i+1}", row_data.get("method",""), key=f"OthersMethod_{i}"
-        )
-        if del_col.button("Delete", key=f"del_others_{i}"):
-            st.session_state["Others_rows"].pop(i)
-            st.rerun()
+    if grid_mode("Others_rows"):
+        row_grid_editor("Others_rows", SPEC_ROW_COLUMNS)
+    else:
+        drop_grid("Others_rows")
+        for i, row_data in enumerate(st.session_state["Others_rows"]):
+            c1, c2, c3, c4, del_col = st.columns([3, 2.5, 2.5, 2.5, 2])
+            st.session_state["Others_rows"][i]["param"] = c1.text_input(
+                f"Others Parameter {i+1}", row_data.get("param",""), key=f"OthersParam_{i}"
+            )
+            st.session_state["Others_rows"][i]["spec"] = c2.text_input(
+                f"Others Spec {i+1}", row_data.get("spec",""), key=f"OthersSpec_{i}"
+            )
+            st.session_state["Others_rows"][i]["result"] = c3.text_input(
+                f"Others Result {i+1}", row_data.get("result",""), key=f"OthersResult_{i}"
+            )
+            st.session_state["Others_rows"][i]["method"] = c4.text_input(
+                f"Others Method {i+1}", row_data.get("method",""), key=f"OthersMethod_{i}"
+            )
+            if del_col.button("Delete", key=f"del_others_{i}"):
+                st.session_state["Others_rows"].pop(i)
+                st.rerun()
 
-    if st.button("Add New Others Row"):
-        st.session_state["Others_rows"].append({"param": "", "spec": "", "result": "", "method": ""})
-        st.rerun()
+        if st.button("Add New Others Row"):
+            st.session_state["Others_rows"].append({"param": "", "spec": "", "result": "", "method": ""})
+            st.rerun()
 
     # ASSAYS
     st.subheader("Assays")
@@ -877,35 +758,39 @@ with col1:
         st.rerun()
 
     st.markdown("#### Add Additional Assays Rows")
-    for i, row_data in enumerate(st.session_state["Assays_rows"]):
-        c1, c2, c3, c4, del_col = st.columns([3, 3, 2.5, 2.5, 2])
-        st.session_state["Assays_rows"][i]["param"] = c1.text_input(
-            f"Assays Parameter {i+1}",
-            row_data.get("param", ""),
-            key=f"AssaysParam_{i}"
-        )
-        st.session_state["Assays_rows"][i]["spec"] = c2.text_input(
-            f"Assays Spec {i+1}",
-            row_data.get("spec", ""),
-            key=f"AssaysSpec_{i}"
-        )
-        st.session_state["Assays_rows"][i]["result"] = c3.text_input(
-            f"Assays Result {i+1}",
-            row_data.get("result", ""),
-            key=f"AssaysResult_{i}"
-        )
-        st.session_state["Assays_rows"][i]["method"] = c4.text_input(
-            f"Assays Method {i+1}",
-            row_data.get("method", ""),
-            key=f"AssaysMethod_{i}"
-        )
-        if del_col.button("Delete", key=f"del_assays_{i}"):
-            st.session_state["Assays_rows"].pop(i)
-            st.rerun()
+    if grid_mode("Assays_rows"):
+        row_grid_editor("Assays_rows", SPEC_ROW_COLUMNS)
+    else:
+        drop_grid("Assays_rows")
+        for i, row_data in enumerate(st.session_state["Assays_rows"]):
+            c1, c2, c3, c4, del_col = st.columns([3, 3, 2.5, 2.5, 2])
+            st.session_state["Assays_rows"][i]["param"] = c1.text_input(
+                f"Assays Parameter {i+1}",
+                row_data.get("param", ""),
+                key=f"AssaysParam_{i}"
+            )
+            st.session_state["Assays_rows"][i]["spec"] = c2.text_input(
+                f"Assays Spec {i+1}",
+                row_data.get("spec", ""),
+                key=f"AssaysSpec_{i}"
+            )
+            st.session_state["Assays_rows"][i]["result"] = c3.text_input(
+                f"Assays Result {i+1}",
+                row_data.get("result", ""),
+                key=f"AssaysResult_{i}"
+            )
+            st.session_state["Assays_rows"][i]["method"] = c4.text_input(
+                f"Assays Method {i+1}",
+                row_data.get("method", ""),
+                key=f"AssaysMethod_{i}"
+            )
+            if del_col.button("Delete", key=f"del_assays_{i}"):
+                st.session_state["Assays_rows"].pop(i)
+                st.rerun()
 
-    if st.button("Add New Assays Row"):
-        st.session_state["Assays_rows"].append({"param": "", "spec": "", "result": "", "method": ""})
-        st.rerun()
+        if st.button("Add New Assays Row"):
+            st.session_state["Assays_rows"].append({"param": "", "spec": "", "result": "", "method": ""})
+            st.rerun()
 
     # PESTICIDES
     st.subheader("Pesticides")
@@ -927,27 +812,31 @@ with col1:
         st.rerun()
 
     st.markdown("#### Add Additional Pesticides Rows")
-    for i, row_data in enumerate(st.session_state["Pesticides_rows"]):
-        c1, c2, c3, c4, del_col = st.columns([3, 2.5, 2.5, 2.5, 2])
-        st.session_state["Pesticides_rows"][i]["param"] = c1.text_input(
-            f"Pesticides Parameter {i+1}", row_data.get("param",""), key=f"PesticidesParam_{i}"
-        )
-        st.session_state["Pesticides_rows"][i]["spec"] = c2.text_input(
-            f"Pesticides Spec {i+1}", row_data.get("spec",""), key=f"PesticidesSpec_{i}"
-        )
-        st.session_state["Pesticides_rows"][i]["result"] = c3.text_input(
-            f"Pesticides Result {i+1}", row_data.get("result",""), key=f"PesticidesResult_{i}"
-        )
-        st.session_state["Pesticides_rows"][i]["method"] = c4.text_input(
-            f"Pesticides Method {i+1}", row_data.get("method",""), key=f"PesticidesMethod_{i}"
-        )
-        if del_col.button("Delete", key=f"del_pesticides_{i}"):
-            st.session_state["Pesticides_rows"].pop(i)
-            st.rerun()
+    if grid_mode("Pesticides_rows"):
+        row_grid_editor("Pesticides_rows", SPEC_ROW_COLUMNS)
+    else:
+        drop_grid("Pesticides_rows")
+        for i, row_data in enumerate(st.session_state["Pesticides_rows"]):
+            c1, c2, c3, c4, del_col = st.columns([3, 2.5, 2.5, 2.5, 2])
+            st.session_state["Pesticides_rows"][i]["param"] = c1.text_input(
+                f"Pesticides Parameter {i+1}", row_data.get("param",""), key=f"PesticidesParam_{i}"
+            )
+            st.session_state["Pesticides_rows"][i]["spec"] = c2.text_input(
+                f"Pesticides Spec {i+1}", row_data.get("spec",""), key=f"PesticidesSpec_{i}"
+            )
+            st.session_state["Pesticides_rows"][i]["result"] = c3.text_input(
+                f"Pesticides Result {i+1}", row_data.get("result",""), key=f"PesticidesResult_{i}"
+            )
+            st.session_state["Pesticides_rows"][i]["method"] = c4.text_input(
+                f"Pesticides Method {i+1}", row_data.get("method",""), key=f"PesticidesMethod_{i}"
+            )
+            if del_col.button("Delete", key=f"del_pesticides_{i}"):
+                st.session_state["Pesticides_rows"].pop(i)
+                st.rerun()
 
-    if st.button("Add New Pesticides Row"):
-        st.session_state["Pesticides_rows"].append({"param": "", "spec": "", "result": "", "method": ""})
-        st.rerun()
+        if st.button("Add New Pesticides Row"):
+            st.session_state["Pesticides_rows"].append({"param": "", "spec": "", "result": "", "method": ""})
+            st.rerun()
 
     # RESIDUAL SOLVENT
     st.subheader("Residual Solvent")
@@ -969,27 +858,31 @@ with col1:
         st.rerun()
 
     st.markdown("#### Add Additional Residual Solvent Rows")
-    for i, row_data in enumerate(st.session_state["ResidualSolvent_rows"]):
-        c1, c2, c3, c4, del_col = st.columns([3, 2.5, 2.5, 2.5, 2])
-        st.session_state["ResidualSolvent_rows"][i]["param"] = c1.text_input(
-            f"Residual Solvent Parameter {i+1}", row_data.get("param",""), key=f"ResidualSolventParam_{i}"
-        )
-        st.session_state["ResidualSolvent_rows"][i]["spec"] = c2.text_input(
-            f"Residual Solvent Spec {i+1}", row_data.get("spec",""), key=f"ResidualSolventSpec_{i}"
-        )
-        st.session_state["ResidualSolvent_rows"][i]["result"] = c3.text_input(
-            f"Residual Solvent Result {i+1}", row_data.get("result",""), key=f"ResidualSolventResult_{i}"
-        )
-        st.session_state["ResidualSolvent_rows"][i]["method"] = c4.text_input(
-            f"Residual Solvent Method {i+1}", row_data.get("method",""), key=f"ResidualSolventMethod_{i}"
-        )
-        if del_col.button("Delete", key=f"del_residual_{i}"):
-            st.session_state["ResidualSolvent_rows"].pop(i)
-            st.rerun()
+    if grid_mode("ResidualSolvent_rows"):
+        row_grid_editor("ResidualSolvent_rows", SPEC_ROW_COLUMNS)
+    else:
+        drop_grid("ResidualSolvent_rows")
+        for i, row_data in enumerate(st.session_state["ResidualSolvent_rows"]):
+            c1, c2, c3, c4, del_col = st.columns([3, 2.5, 2.5, 2.5, 2])
+            st.session_state["ResidualSolvent_rows"][i]["param"] = c1.text_input(
+                f"Residual Solvent Parameter {i+1}", row_data.get("param",""), key=f"ResidualSolventParam_{i}"
+            )
+            st.session_state["ResidualSolvent_rows"][i]["spec"] = c2.text_input(
+                f"Residual Solvent Spec {i+1}", row_data.get("spec",""), key=f"ResidualSolventSpec_{i}"
+            )
+            st.session_state["ResidualSolvent_rows"][i]["result"] = c3.text_input(
+                f"Residual Solvent Result {i+1}", row_data.get("result",""), key=f"ResidualSolventResult_{i}"
+            )
+            st.session_state["ResidualSolvent_rows"][i]["method"] = c4.text_input(
+                f"Residual Solvent Method {i+1}", row_data.get("method",""), key=f"ResidualSolventMethod_{i}"
+            )
+            if del_col.button("Delete", key=f"del_residual_{i}"):
+                st.session_state["ResidualSolvent_rows"].pop(i)
+                st.rerun()
 
-    if st.button("Add New Residual Solvent Row"):
-        st.session_state["ResidualSolvent_rows"].append({"param": "", "spec": "", "result": "", "method": ""})
-        st.rerun()
+        if st.button("Add New Residual Solvent Row"):
+            st.session_state["ResidualSolvent_rows"].append({"param": "", "spec": "", "result": "", "method": ""})
+            st.rerun()
 
     # MICROBIOLOGICAL
     st.subheader("Microbiological Profile")
@@ -1079,379 +972,427 @@ with col1:
         st.rerun()
 
     st.markdown("#### Add Additional Microbiological Profile Rows")
-    for i, row_data in enumerate(st.session_state["MicrobiologicalProfile_rows"]):
-        c1, c2, c3, c4, del_col = st.columns([3, 2.5, 2.5, 2.5, 2])
-        st.session_state["MicrobiologicalProfile_rows"][i]["param"] = c1.text_input(
-            f"Microbio Parameter {i+1}", row_data.get("param",""), key=f"MicrobioParam_{i}"
-        )
-        st.session_state["MicrobiologicalProfile_rows"][i]["spec"] = c2.text_input(
-            f"Microbio Spec {i+1}", row_data.get("spec",""), key=f"MicrobioSpec_{i}"
-        )
-        st.session_state["MicrobiologicalProfile_rows"][i]["result"] = c3.text_input(
-            f"Microbio Result {i+1}", row_data.get("result",""), key=f"MicrobioResult_{i}"
-        )
-        st.session_state["MicrobiologicalProfile_rows"][i]["method"] = c4.text_input(
-            f"Microbio Method {i+1}", row_data.get("method",""), key=f"MicrobioMethod_{i}"
-        )
-        if del_col.button("Delete", key=f"del_micro_{i}"):
-            st.session_state["MicrobiologicalProfile_rows"].pop(i)
-            st.rerun()
+    if grid_mode("MicrobiologicalProfile_rows"):
+        row_grid_editor("MicrobiologicalProfile_rows", SPEC_ROW_COLUMNS)
+    else:
+        drop_grid("MicrobiologicalProfile_rows")
+        for i, row_data in enumerate(st.session_state["MicrobiologicalProfile_rows"]):
+            c1, c2, c3, c4, del_col = st.columns([3, 2.5, 2.5, 2.5, 2])
+            st.session_state["MicrobiologicalProfile_rows"][i]["param"] = c1.text_input(
+                f"Microbio Parameter {i+1}", row_data.get("param",""), key=f"MicrobioParam_{i}"
+            )
+            st.session_state["MicrobiologicalProfile_rows"][i]["spec"] = c2.text_input(
+                f"Microbio Spec {i+1}", row_data.get("spec",""), key=f"MicrobioSpec_{i}"
+            )
+            st.session_state["MicrobiologicalProfile_rows"][i]["result"] = c3.text_input(
+                f"Microbio Result {i+1}", row_data.get("result",""), key=f"MicrobioResult_{i}"
+            )
+            st.session_state["MicrobiologicalProfile_rows"][i]["method"] = c4.text_input(
+                f"Microbio Method {i+1}", row_data.get("method",""), key=f"MicrobioMethod_{i}"
+            )
+            if del_col.button("Delete", key=f"del_micro_{i}"):
+                st.session_state["MicrobiologicalProfile_rows"].pop(i)
+                st.rerun()
 
-    if st.button("Add New Microbiological Row"):
-        st.session_state["MicrobiologicalProfile_rows"].append({"param": "", "spec": "", "result": "", "method": ""})
-        st.rerun()
+        if st.button("Add New Microbiological Row"):
+            st.session_state["MicrobiologicalProfile_rows"].append({"param": "", "spec": "", "result": "", "method": ""})
+            st.rerun()
 
     # Declaration
     st.subheader("Declaration - Allergen Statement")
-    allergen_statement = st.selectbox("Allergen Statement", options=["Free from allergen", "Contains Allergen"])
+    allergen_options = list(ALLERGEN_STATEMENTS)
+    product_allergen_statement = settings.layout(product_code).allergen_statement
+    allergen_statement = st.selectbox(
+        "Allergen Statement",
+        options=allergen_options,
+        # The product's configured default, until the user picks one
+        index=allergen_options.index(product_allergen_statement),
+    )
+
+
+    # ----------- COLLECT FORM DATA -----------
+    data = {
+        "product_name": product_name,
+        "botanical_name": botanical_name,
+        "chemical_name": chemical_name,
+        "cas_no": cas_no,
+        "product_code": product_code,
+        "batch_no": batch_no,
+        "manufacturing_date": manufacturing_date,
+        "reanalysis_date": reanalysis_date,
+        "quantity": quantity,
+        "origin": origin,
+
+        "description_spec": st.session_state["description_spec"],
+        "description_result": st.session_state["description_result"],
+        "description_method": st.session_state["description_method"],
+
+        "identification_spec": st.session_state["identification_spec"],
+        "identification_result": st.session_state["identification_result"],
+        "identification_method": st.session_state["identification_method"],
 
-    # ----------- PREVIEW & COMPILE BUTTONS -----------
+        "loss_on_drying_spec": st.session_state["loss_on_drying_spec"],
+        "loss_on_drying_result": st.session_state["loss_on_drying_result"],
+        "loss_on_drying_method": st.session_state["loss_on_drying_method"],
+
+        "moisture_spec": st.session_state["moisture_spec"],
+        "moisture_result": st.session_state["moisture_result"],
+        "moisture_method": st.session_state["moisture_method"],
+
+        "particle_size_spec": st.session_state["particle_size_spec"],
+        "particle_size_result": st.session_state["particle_size_result"],
+        "particle_size_method": st.session_state["particle_size_method"],
+
+        "ash_contents_spec": st.session_state["ash_contents_spec"],
+        "ash_contents_result": st.session_state["ash_contents_result"],
+        "ash_contents_method": st.session_state["ash_contents_method"],
+
+        "residue_on_ignition_spec": st.session_state["residue_on_ignition_spec"],
+        "residue_on_ignition_result": st.session_state["residue_on_ignition_result"],
+        "residue_on_ignition_method": st.session_state["residue_on_ignition_method"],
+
+        "bulk_density_spec": st.session_state["bulk_density_spec"],
+        "bulk_density_result": st.session_state["bulk_density_result"],
+        "bulk_density_method": st.session_state["bulk_density_method"],
+
+        "tapped_density_spec": st.session_state["tapped_density_spec"],
+        "tapped_density_result": st.session_state["tapped_density_result"],
+        "tapped_density_method": st.session_state["tapped_density_method"],
+
+        "solubility_spec": st.session_state["solubility_spec"],
+        "solubility_result": st.session_state["solubility_result"],
+        "solubility_method": st.session_state["solubility_method"],
+
+        "ph_spec": st.session_state["ph_spec"],
+        "ph_result": st.session_state["ph_result"],
+        "ph_method": st.session_state["ph_method"],
+
+        "chlorides_nacl_spec": st.session_state["chlorides_nacl_spec"],
+        "chlorides_nacl_result": st.session_state["chlorides_nacl_result"],
+        "chlorides_nacl_method": st.session_state["chlorides_nacl_method"],
+
+        "sulphates_spec": st.session_state["sulphates_spec"],
+        "sulphates_result": st.session_state["sulphates_result"],
+        "sulphates_method": st.session_state["sulphates_method"],
+
+        "fats_spec": st.session_state["fats_spec"],
+        "fats_result": st.session_state["fats_result"],
+        "fats_method": st.session_state["fats_method"],
+
+        "protein_spec": st.session_state["protein_spec"],
+        "protein_result": st.session_state["protein_result"],
+        "protein_method": st.session_state["protein_method"],
+
+        "total_ig_g_spec": st.session_state["total_ig_g_spec"],
+        "total_ig_g_result": st.session_state["total_ig_g_result"],
+        "total_ig_g_method": st.session_state["total_ig_g_method"],
+
+        "sodium_spec": st.session_state["sodium_spec"],
+        "sodium_result": st.session_state["sodium_result"],
+        "sodium_method": st.session_state["sodium_method"],
+
+        "gluten_spec": st.session_state["gluten_spec"],
+        "gluten_result": st.session_state["gluten_result"],
+        "gluten_method": st.session_state["gluten_method"],
+
+        "lead_spec": st.session_state["lead_spec"],
+        "lead_result": st.session_state["lead_result"],
+        "lead_method": st.session_state["lead_method"],
+
+        "cadmium_spec": st.session_state["cadmium_spec"],
+        "cadmium_result": st.session_state["cadmium_result"],
+        "cadmium_method": st.session_state["cadmium_method"],
+
+        "arsenic_spec": st.session_state["arsenic_spec"],
+        "arsenic_result": st.session_state["arsenic_result"],
+        "arsenic_method": st.session_state["arsenic_method"],
+
+        "mercury_spec": st.session_state["mercury_spec"],
+        "mercury_result": st.session_state["mercury_result"],
+        "mercury_method": st.session_state["mercury_method"],
+
+        "assays_spec": st.session_state["assays_spec"],
+        "assays_result": st.session_state["assays_result"],
+        "assays_method": st.session_state["assays_method"],
+
+        "pesticide_spec": st.session_state["pesticide_spec"],
+        "pesticide_result": st.session_state["pesticide_result"],
+        "pesticide_method": st.session_state["pesticide_method"],
+
+        "residual_solvent_spec": st.session_state["residual_solvent_spec"],
+        "residual_solvent_result": st.session_state["residual_solvent_result"],
+        "residual_solvent_method": st.session_state["residual_solvent_method"],
+
+        "total_plate_count_spec": st.session_state["total_plate_count_spec"],
+        "total_plate_count_result": st.session_state["total_plate_count_result"],
+        "total_plate_count_method": st.session_state["total_plate_count_method"],
+
+        "yeasts_mould_spec": st.session_state["yeasts_mould_spec"],
+        "yeasts_mould_result": st.session_state["yeasts_mould_result"],
+        "yeasts_mould_method": st.session_state["yeasts_mould_method"],
+
+        "salmonella_spec": st.session_state["salmonella_spec"],
+        "salmonella_result": st.session_state["salmonella_result"],
+        "salmonella_method": st.session_state["salmonella_method"],
+
+        "e_coli_spec": st.session_state["e_coli_spec"],
+        "e_coli_result": st.session_state["e_coli_result"],
+        "e_coli_method": st.session_state["e_coli_method"],
+
+        "coliforms_spec": st.session_state["coliforms_spec"],
+        "coliforms_result": st.session_state["coliforms_result"],
+        "coliforms_method": st.session_state["coliforms_method"],
+
+        "allergen_statement": allergen_statement,
+
+        "physical_extra_rows": [
+            (row["param"], row["spec"], row["result"], row["method"])
+            for row in st.session_state["Physical_rows"]
+        ],
+        "others_extra_rows": [
+            (row["param"], row["spec"], row["result"], row["method"])
+            for row in st.session_state["Others_rows"]
+        ],
+        "assays_extra_rows": [
+            (row["param"], row["spec"], row["result"], row["method"])
+            for row in st.session_state["Assays_rows"]
+        ],
+        "pesticides_extra_rows": [
+            (row["param"], row["spec"], row["result"], row["method"])
+            for row in st.session_state["Pesticides_rows"]
+        ],
+        "residual_solvent_extra_rows": [
+            (row["param"], row["spec"], row["result"], row["method"])
+            for row in st.session_state["ResidualSolvent_rows"]
+        ],
+        "microbio_extra_rows": [
+            (row["param"], row["spec"], row["result"], row["method"])
+            for row in st.session_state["MicrobiologicalProfile_rows"]
+        ],
+        "product_additional_rows": [
+            (row["label"], row["value"])
+            for row in st.session_state["Product_rows"]
+        ],
+    }
+
+    # ----------- COMPLIANCE CHECK -----------
+    sections = spec_sections(data)
+    out_of_spec = [
+        f"{section_name}: {sections[section_name][i][0]}"
+        for section_name, statuses in evaluate_sections(sections).items()
+        for i in (statuses == FAIL).nonzero()[0]
+    ]
+    if out_of_spec:
+        st.warning("Out of specification (marked in the PDF):  \n" + "  \n".join(out_of_spec))
+    data_problems = validate(data)
+    if data_problems:
+        st.error("Fix before compiling:  \n" + "  \n".join(f"{p.key}: {p.message}" for p in data_problems))
+
+    # ----------- COMPILE BUTTON -----------
     st.write("---")
-    if st.button("Preview"):
-        data = {
-            "product_name": product_name,
-            "botanical_name": botanical_name,
-            "chemical_name": chemical_name,
-            "cas_no": cas_no,
-            "product_code": product_code,
-            "batch_no": batch_no,
-            "manufacturing_date": manufacturing_date,
-            "reanalysis_date": reanalysis_date,
-            "quantity": quantity,
-            "origin": origin,
-
-            "description_spec": st.session_state["description_spec"],
-            "description_result": st.session_state["description_result"],
-            "description_method": st.session_state["description_method"],
-
-            "identification_spec": st.session_state["identification_spec"],
-            "identification_result": st.session_state["identification_result"],
-            "identification_method": st.session_state["identification_method"],
-
-            "loss_on_drying_spec": st.session_state["loss_on_drying_spec"],
-            "loss_on_drying_result": st.session_state["loss_on_drying_result"],
-            "loss_on_drying_method": st.session_state["loss_on_drying_method"],
-
-            "moisture_spec": st.session_state["moisture_spec"],
-            "moisture_result": st.session_state["moisture_result"],
-            "moisture_method": st.session_state["moisture_method"],
-
-            "particle_size_spec": st.session_state["particle_size_spec"],
-            "particle_size_result": st.session_state["particle_size_result"],
-            "particle_size_method": st.session_state["particle_size_method"],
-
-            "ash_contents_spec": st.session_state["ash_contents_spec"],
-            "ash_contents_result": st.session_state["ash_contents_result"],
-            "ash_contents_method": st.session_state["ash_contents_method"],
-
-            "residue_on_ignition_spec": st.session_state["residue_on_ignition_spec"],
-            "residue_on_ignition_result": st.session_state["residue_on_ignition_result"],
-            "residue_on_ignition_method": st.session_state["residue_on_ignition_method"],
-
-            "bulk_density_spec": st.session_state["bulk_density_spec"],
-            "bulk_density_result": st.session_state["bulk_density_result"],
-            "bulk_density_method": st.session_state["bulk_density_method"],
-
-            "tapped_density_spec": st.session_state["tapped_density_spec"],
-            "tapped_density_result": st.session_state["tapped_density_result"],
-            "tapped_density_method": st.session_state["tapped_density_method"],
-
-            "solubility_spec": st.session_state["solubility_spec"],
-            "solubility_result": st.session_state["solubility_result"],
-            "solubility_method": st.session_state["solubility_method"],
-
-            "ph_spec": st.session_state["ph_spec"],
-            "ph_result": st.session_state["ph_result"],
-            "ph_method": st.session_state["ph_method"],
-
-            "chlorides_nacl_spec": st.session_state["chlorides_nacl_spec"],
-            "chlorides_nacl_result": st.session_state["chlorides_nacl_result"],
-            "chlorides_nacl_method": st.session_state["chlorides_nacl_method"],
-
-            "sulphates_spec": st.session_state["sulphates_spec"],
-            "sulphates_result": st.session_state["sulphates_result"],
-            "sulphates_method": st.session_state["sulphates_method"],
-
-            "fats_spec": st.session_state["fats_spec"],
-            "fats_result": st.session_state["fats_result"],
-            "fats_method": st.session_state["fats_method"],
-
-            "protein_spec": st.session_state["protein_spec"],
-            "protein_result": st.session_state["protein_result"],
-            "protein_method": st.session_state["protein_method"],
-
-            "total_ig_g_spec": st.session_state["total_ig_g_spec"],
-            "total_ig_g_result": st.session_state["total_ig_g_result"],
-            "total_ig_g_method": st.session_state["total_ig_g_method"],
-
-            "sodium_spec": st.session_state["sodium_spec"],
-            "sodium_result": st.session_state["sodium_result"],
-            "sodium_method": st.session_state["sodium_method"],
-
-            "gluten_spec": st.session_state["gluten_spec"],
-            "gluten_result": st.session_state["gluten_result"],
-            "gluten_method": st.session_state["gluten_method"],
-
-            "lead_spec": st.session_state["lead_spec"],
-            "lead_result": st.session_state["lead_result"],
-            "lead_method": st.session_state["lead_method"],
-
-            "cadmium_spec": st.session_state["cadmium_spec"],
-            "cadmium_result": st.session_state["cadmium_result"],
-            "cadmium_method": st.session_state["cadmium_method"],
-
-            "arsenic_spec": st.session_state["arsenic_spec"],
-            "arsenic_result": st.session_state["arsenic_result"],
-            "arsenic_method": st.session_state["arsenic_method"],
-
-            "mercury_spec": st.session_state["mercury_spec"],
-            "mercury_result": st.session_state["mercury_result"],
-            "mercury_method": st.session_state["mercury_method"],
-
-            "assays_spec": st.session_state["assays_spec"],
-            "assays_result": st.session_state["assays_result"],
-            "assays_method": st.session_state["assays_method"],
-
-            "pesticide_spec": st.session_state["pesticide_spec"],
-            "pesticide_result": st.session_state["pesticide_result"],
-            "pesticide_method": st.session_state["pesticide_method"],
-
-            "residual_solvent_spec": st.session_state["residual_solvent_spec"],
-            "residual_solvent_result": st.session_state["residual_solvent_result"],
-            "residual_solvent_method": st.session_state["residual_solvent_method"],
-
-            "total_plate_count_spec": st.session_state["total_plate_count_spec"],
-            "total_plate_count_result": st.session_state["total_plate_count_result"],
-            "total_plate_count_method": st.session_state["total_plate_count_method"],
-
-            "yeasts_mould_spec": st.session_state["yeasts_mould_spec"],
-            "yeasts_mould_result": st.session_state["yeasts_mould_result"],
-            "yeasts_mould_method": st.session_state["yeasts_mould_method"],
-
-            "salmonella_spec": st.session_state["salmonella_spec"],
-            "salmonella_result": st.session_state["salmonella_result"],
-            "salmonella_method": st.session_state["salmonella_method"],
-
-            "e_coli_spec": st.session_state["e_coli_spec"],
-            "e_coli_result": st.session_state["e_coli_result"],
-            "e_coli_method": st.session_state["e_coli_method"],
-
-            "coliforms_spec": st.session_state["coliforms_spec"],
-            "coliforms_result": st.session_state["coliforms_result"],
-            "coliforms_method": st.session_state["coliforms_method"],
-
-            "allergen_statement": allergen_statement,
-
-            "physical_extra_rows": [
-                (row["param"], row["spec"], row["result"], row["method"])
-                for row in st.session_state["Physical_rows"]
-            ],
-            "others_extra_rows": [
-                (row["param"], row["spec"], row["result"], row["method"])
-                for row in st.session_state["Others_rows"]
-            ],
-            "assays_extra_rows": [
-                (row["param"], row["spec"], row["result"], row["method"])
-                for row in st.session_state["Assays_rows"]
-            ],
-            "pesticides_extra_rows": [
-                (row["param"], row["spec"], row["result"], row["method"])
-                for row in st.session_state["Pesticides_rows"]
-            ],
-            "residual_solvent_extra_rows": [
-                (row["param"], row["spec"], row["result"], row["method"])
-                for row in st.session_state["ResidualSolvent_rows"]
-            ],
-            "microbio_extra_rows": [
-                (row["param"], row["spec"], row["result"], row["method"])
-                for row in st.session_state["MicrobiologicalProfile_rows"]
-            ],
-            "product_additional_rows": [
-                (row["label"], row["value"])
-                for row in st.session_state["Product_rows"]
-            ],
-        }
-
-        pdf_buffer = generate_pdf(data)
-        if pdf_buffer:
-            doc_preview = fitz.open(stream=pdf_buffer, filetype="pdf")
-            with col2:
-                for page in doc_preview:
-                    pix = page.get_pixmap()
-                    st.image(pix.tobytes(), caption=f"Page {page.number + 1}", use_container_width=True)
-            st.success("Preview generated successfully!")
-
-    if st.button("Compile and Generate PDF"):
-        data = {
-            "product_name": product_name,
-            "botanical_name": botanical_name,
-            "chemical_name": chemical_name,
-            "cas_no": cas_no,
-            "product_code": product_code,
-            "batch_no": batch_no,
-            "manufacturing_date": manufacturing_date,
-            "reanalysis_date": reanalysis_date,
-            "quantity": quantity,
-            "origin": origin,
-
-            "description_spec": st.session_state["description_spec"],
-            "description_result": st.session_state["description_result"],
-            "description_method": st.session_state["description_method"],
-
-            "identification_spec": st.session_state["identification_spec"],
-            "identification_result": st.session_state["identification_result"],
-            "identification_method": st.session_state["identification_method"],
-
-            "loss_on_drying_spec": st.session_state["loss_on_drying_spec"],
-            "loss_on_drying_result": st.session_state["loss_on_drying_result"],
-            "loss_on_drying_method": st.session_state["loss_on_drying_method"],
-
-            "moisture_spec": st.session_state["moisture_spec"],
-            "moisture_result": st.session_state["moisture_result"],
-            "moisture_method": st.session_state["moisture_method"],
-
-            "particle_size_spec": st.session_state["particle_size_spec"],
-            "particle_size_result": st.session_state["particle_size_result"],
-            "particle_size_method": st.session_state["particle_size_method"],
-
-            "ash_contents_spec": st.session_state["ash_contents_spec"],
-            "ash_contents_result": st.session_state["ash_contents_result"],
-            "ash_contents_method": st.session_state["ash_contents_method"],
-
-            "residue_on_ignition_spec": st.session_state["residue_on_ignition_spec"],
-            "residue_on_ignition_result": st.session_state["residue_on_ignition_result"],
-            "residue_on_ignition_method": st.session_state["residue_on_ignition_method"],
-
-            "bulk_density_spec": st.session_state["bulk_density_spec"],
-            "bulk_density_result": st.session_state["bulk_density_result"],
-            "bulk_density_method": st.session_state["bulk_density_method"],
-
-            "tapped_density_spec": st.session_state["tapped_density_spec"],
-            "tapped_density_result": st.session_state["tapped_density_result"],
-            "tapped_density_method": st.session_state["tapped_density_method"],
-
-            "solubility_spec": st.session_state["solubility_spec"],
-            "solubility_result": st.session_state["solubility_result"],
-            "solubility_method": st.session_state["solubility_method"],
-
-            "ph_spec": st.session_state["ph_spec"],
-            "ph_result": st.session_state["ph_result"],
-            "ph_method": st.session_state["ph_method"],
-
-            "chlorides_nacl_spec": st.session_state["chlorides_nacl_spec"],
-            "chlorides_nacl_result": st.session_state["chlorides_nacl_result"],
-            "chlorides_nacl_method": st.session_state["chlorides_nacl_method"],
-
-            "sulphates_spec": st.session_state["sulphates_spec"],
-            "sulphates_result": st.session_state["sulphates_result"],
-            "sulphates_method": st.session_state["sulphates_method"],
-
-            "fats_spec": st.session_state["fats_spec"],
-            "fats_result": st.session_state["fats_result"],
-            "fats_method": st.session_state["fats_method"],
-
-            "protein_spec": st.session_state["protein_spec"],
-            "protein_result": st.session_state["protein_result"],
-            "protein_method": st.session_state["protein_method"],
-
-            "total_ig_g_spec": st.session_state["total_ig_g_spec"],
-            "total_ig_g_result": st.session_state["total_ig_g_result"],
-            "total_ig_g_method": st.session_state["total_ig_g_method"],
-
-            "sodium_spec": st.session_state["sodium_spec"],
-            "sodium_result": st.session_state["sodium_result"],
-            "sodium_method": st.session_state["sodium_method"],
-
-            "gluten_spec": st.session_state["gluten_spec"],
-            "gluten_result": st.session_state["gluten_result"],
-            "gluten_method": st.session_state["gluten_method"],
-
-            "lead_spec": st.session_state["lead_spec"],
-            "lead_result": st.session_state["lead_result"],
-            "lead_method": st.session_state["lead_method"],
-
-            "cadmium_spec": st.session_state["cadmium_spec"],
-            "cadmium_result": st.session_state["cadmium_result"],
-            "cadmium_method": st.session_state["cadmium_method"],
-
-            "arsenic_spec": st.session_state["arsenic_spec"],
-            "arsenic_result": st.session_state["arsenic_result"],
-            "arsenic_method": st.session_state["arsenic_method"],
-
-            "mercury_spec": st.session_state["mercury_spec"],
-            "mercury_result": st.session_state["mercury_result"],
-            "mercury_method": st.session_state["mercury_method"],
-
-            "assays_spec": st.session_state["assays_spec"],
-            "assays_result": st.session_state["assays_result"],
-            "assays_method": st.session_state["assays_method"],
-
-            "pesticide_spec": st.session_state["pesticide_spec"],
-            "pesticide_result": st.session_state["pesticide_result"],
-            "pesticide_method": st.session_state["pesticide_method"],
-
-            "residual_solvent_spec": st.session_state["residual_solvent_spec"],
-            "residual_solvent_result": st.session_state["residual_solvent_result"],
-            "residual_solvent_method": st.session_state["residual_solvent_method"],
-
-            "total_plate_count_spec": st.session_state["total_plate_count_spec"],
-            "total_plate_count_result": st.session_state["total_plate_count_result"],
-            "total_plate_count_method": st.session_state["total_plate_count_method"],
-
-            "yeasts_mould_spec": st.session_state["yeasts_mould_spec"],
-            "yeasts_mould_result": st.session_state["yeasts_mould_result"],
-            "yeasts_mould_method": st.session_state["yeasts_mould_method"],
-
-            "salmonella_spec": st.session_state["salmonella_spec"],
-            "salmonella_result": st.session_state["salmonella_result"],
-            "salmonella_method": st.session_state["salmonella_method"],
-
-            "e_coli_spec": st.session_state["e_coli_spec"],
-            "e_coli_result": st.session_state["e_coli_result"],
-            "e_coli_method": st.session_state["e_coli_method"],
-
-            "coliforms_spec": st.session_state["coliforms_spec"],
-            "coliforms_result": st.session_state["coliforms_result"],
-            "coliforms_method": st.session_state["coliforms_method"],
-
-            "allergen_statement": allergen_statement,
-
-            "physical_extra_rows": [
-                (row["param"], row["spec"], row["result"], row["method"])
-                for row in st.session_state["Physical_rows"]
-            ],
-            "others_extra_rows": [
-                (row["param"], row["spec"], row["result"], row["method"])
-                for row in st.session_state["Others_rows"]
-            ],
-            "assays_extra_rows": [
-                (row["param"], row["spec"], row["result"], row["method"])
-                for row in st.session_state["Assays_rows"]
-            ],
-            "pesticides_extra_rows": [
-                (row["param"], row["spec"], row["result"], row["method"])
-                for row in st.session_state["Pesticides_rows"]
-            ],
-            "residual_solvent_extra_rows": [
-                (row["param"], row["spec"], row["result"], row["method"])
-                for row in st.session_state["ResidualSolvent_rows"]
-            ],
-            "microbio_extra_rows": [
-                (row["param"], row["spec"], row["result"], row["method"])
-                for row in st.session_state["MicrobiologicalProfile_rows"]
-            ],
-            "product_additional_rows": [
-                (row["label"], row["value"])
-                for row in st.session_state["Product_rows"]
-            ],
-        }
-
-        pdf_buffer = generate_pdf(data)
-        if pdf_buffer:
-            st.download_button(
-                label="Download COA PDF",
-                data=pdf_buffer,
-                file_name=(product_name or "COA") + ".pdf",
-                mime="application/pdf"
-            )
-            st.success("COA PDF generated and ready for download!")
+    backend = st.selectbox(
+        "Renderer",
+        list(BACKENDS),
+        index=list(BACKENDS).index(DEFAULT_BACKEND),
+        format_func=lambda name: BACKENDS[name].description,
+        key="renderer_backend",
+    )
+    optimize_output = st.checkbox(
+        "Optimize output size",
+        help="Compress streams, store shared images once and resample the footer to its printed resolution."
+    )
+    if st.button("Compile and Generate PDF", disabled=bool(data_problems)):
+        kind = "pdf_optimized" if optimize_output else "pdf"
+        st.session_state["compile_job"] = render_queue.submit(
+            data, kind=kind, backend=backend, priority=INTERACTIVE, owner=session_owner()
+        )
+        # Issued (recorded in the analytics and the archive) once its PDF is ready; see show_download
+        st.session_state["compile_issue"] = (st.session_state["compile_job"], data)
+        st.session_state["compile_file_name"] = (product_name or "COA") + ".pdf"
+        st.session_state["email_subject"] = f"Certificate of Analysis: {product_name} ({batch_no})"
+
+
+def queue_email(pdf_bytes):
+    recipients = st.session_state.get("email_recipients", "").replace(";", ",").split(",")
+    try:
+        outbox.enqueue(
+            pdf_bytes,
+            recipients,
+            st.session_state.get("email_subject", ""),
+            st.session_state.get("email_body", ""),
+            st.session_state.get("compile_file_name", "COA.pdf"),
+            smtp_sender,
+        )
+    except ValueError:
+        st.session_state["email_status"] = "Enter at least one recipient."
+    else:
+        st.session_state["email_status"] = "Queued for sending."
+
+
+def show_email_form(pdf_bytes):
+    with st.expander("Email to customer"):
+        init_ss("email_subject", "Certificate of Analysis")
+        init_ss("email_body", "Please find the Certificate of Analysis attached.")
+        st.text_input("To (comma separated)", key="email_recipients")
+        st.text_input("Subject", key="email_subject")
+        st.text_area("Message", key="email_body")
+        st.button("Queue email", on_click=queue_email, args=(pdf_bytes,))
+        if "email_status" in st.session_state:
+            st.caption(st.session_state.pop("email_status"))
+        counts = outbox.counts()
+        if counts:
+            st.caption("Outbox: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+
+
+def record_issue():
+    """Record the compiled COA as issued, once its render has succeeded."""
+    issue = st.session_state.get("compile_issue")
+    if issue is None or issue[0] != st.session_state.get("compile_job"):
+        return
+    # Re-compiling identical data is not counted twice
+    analytics_store.record_issue(issue[1])
+    coa_archive.add(issue[1])
+    del st.session_state["compile_issue"]
+
+
+def show_download(result):
+    record_issue()
+    if isinstance(result, OptimizedPdf):
+        pdf_bytes = result.pdf
+        st.caption(f"Optimized size: {result.report}")
+    else:
+        pdf_bytes = result
+    st.download_button(
+        label="Download COA PDF",
+        data=pdf_bytes,
+        file_name=st.session_state.get("compile_file_name", "COA.pdf"),
+        mime="application/pdf"
+    )
+    st.success("COA PDF generated and ready for download!")
+    show_email_form(pdf_bytes)
+
+
+with col1:
+    job_status_fragment("compile_job", show_download)
+
+def show_trends():
+    products = analytics_store.products()
+    if not products:
+        st.caption("No COAs issued yet.")
+        return
+    trend_cols = st.columns(2)
+    product = trend_cols[0].selectbox("Product Code", products)
+    analyte = trend_cols[1].selectbox("Analyte", analytics_store.analytes(product))
+    if not analyte:
+        return
+    summary = analytics_store.summary(product, analyte)
+    if not summary.count:
+        # Only non-numeric ("Present") or censored ("<10") results so far
+        st.write(f"No measured results; censored = {summary.censored}, out of spec = {summary.out_of_spec}")
+        return
+    st.write(
+        f"n = {summary.count}, mean = {summary.mean:.4g}, sd = {summary.std:.4g}, "
+        f"min = {summary.min:.4g}, max = {summary.max:.4g}, censored (not in the mean) = {summary.censored}, "
+        f"out of spec = {summary.out_of_spec}"
+    )
+    trend = [(day, agg) for day, agg in analytics_store.trend(product, analyte) if agg.count]
+    chart = pd.DataFrame(
+        {
+            "Daily mean": [agg.mean for _, agg in trend],
+            "Mean": summary.mean,
+            "UCL (+3 sd)": summary.mean + 3 * summary.std,
+            "LCL (-3 sd)": summary.mean - 3 * summary.std,
+        },
+        index=pd.to_datetime([day for day, _ in trend]),
+    )
+    st.line_chart(chart)
+
+
+def show_search():
+    query = st.text_input("Product, botanical name, CAS No., product code or batch", key="coa_search_query")
+    if not query.strip():
+        return
+    search_index.refresh()
+    hits = search_index.search(query, limit=20)
+    if not hits:
+        st.caption("No matching COAs.")
+        return
+    st.dataframe(
+        pd.DataFrame(
+            [{"Issued": hit.issued_at, **{k: hit.fields[k] for k in ("product_name", "product_code", "batch_no", "cas_no")}}
+             for hit in hits]
+        ),
+        hide_index=True,
+        use_container_width=True,
+    )
+    labels = {f"{hit.fields['product_name']} / {hit.fields['batch_no']} ({hit.issued_at})": hit.cert_id for hit in hits}
+    picked = st.selectbox("Certificate", list(labels))
+    if st.button("Render selected COA"):
+        st.session_state["compile_job"] = render_queue.submit(
+            coa_archive.get(labels[picked]), kind="pdf", priority=INTERACTIVE, owner=session_owner()
+        )
+        st.session_state["compile_file_name"] = (picked.split(" / ")[0] or "COA") + ".pdf"
+        st.rerun()
+
+
+def show_session_memory():
+    sessions = session_memory.usage()
+    st.write(
+        f"{len(sessions)} session(s), {sum(u.total_bytes for u in sessions) / 1024:.0f} KB accounted; "
+        f"render results in memory: {render_queue.memory_bytes() / 1024:.0f} KB; "
+        f"cap {session_memory.cap_bytes / 1024 / 1024:.0f} MB per session"
+    )
+    st.dataframe(
+        pd.DataFrame(
+            [{
+                "Session": u.session_id[:8],
+                "State KB": round(u.state_bytes / 1024, 1),
+                "Results KB": round(u.result_bytes / 1024, 1),
+                "Total KB": round(u.total_bytes / 1024, 1),
+                "Idle s": round(u.idle_seconds()),
+                "Evictions": u.evictions,
+            } for u in sessions]
+        ),
+        hide_index=True,
+        use_container_width=True,
+    )
+
+
+def show_render_metrics():
+    st.dataframe(
+        pd.DataFrame(
+            [{
+                "Class": name,
+                "Queued": stats["queued"],
+                "Running": stats["running"],
+                "Done": stats["completed"],
+                "Deadlines missed": stats["deadlines_missed"],
+                "Wait p50 s": round(stats["wait_p50"], 2),
+                "Wait p95 s": round(stats["wait_p95"], 2),
+                "Wait max s": round(stats["wait_max"], 2),
+            } for name, stats in render_queue.metrics().items()]
+        ),
+        hide_index=True,
+        use_container_width=True,
+    )
+
+
+# ----------- SESSION MEMORY -----------
+run_ctx = get_script_run_ctx()
+if run_ctx is not None:
+    session_memory.record(run_ctx.session_id, st.session_state.to_dict(), [st.session_state.get("compile_job")])
+
+with col2:
+    with st.expander("Find a previous COA"):
+        show_search()
+    with st.expander("QC Trends"):
+        show_trends()
+    if admin_key and st.query_params.get("admin") == admin_key:
+        with st.expander("Session memory (admin)"):
+            show_session_memory()
+        with st.expander("Render queue (admin)"):
+            show_render_metrics()
+    # Live preview: the HTML body is rebuilt on every rerun and laid out by the browser;
+    # only Compile renders a PDF
+    st.subheader("Preview")
+    st.html(preview_html(data))
@@ -0,0 +1,111 @@
+"""Benchmark fast_render.render_fast against generate_pdf and check they print the same page.
+
+    python benchmarks/bench_fast_render.py [--docs 200] [--zoom 2]
+
+Every sample certificate is rendered both ways and compared with PyMuPDF: the words
+must be the same and sit at the same place, and the rasterized pages may differ only
+by anti-aliasing noise. Any difference makes the run exit with status 1.
+"""
+import argparse
+import os
+import sys
+import time
+
+import fitz  # PyMuPDF
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fast_render import layout_blocks, render_fast, FastRenderUnsupported  # noqa: E402
+from pdf_generator import generate_pdf  # noqa: E402
+from samples import sample_data  # noqa: E402
+
+# Word boxes may move by float rounding only
+WORD_TOLERANCE = 0.01
+# A pixel "differs" when any channel is off by more than PIXEL_TOLERANCE; glyphs whose
+# origin lands right on a subpixel boundary can flip, so a page fails only when more
+# than MAX_DIFF_SHARE of its pixels differ
+PIXEL_TOLERANCE = 48
+MAX_DIFF_SHARE = 1e-4
+
+def rasterize(pdf_bytes, zoom):
+    """[(words, pixels), ...] per page."""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        pages = []
+        for page in doc:
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            pixels = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+            pages.append((page.get_text("words"), pixels))
+    return pages
+
+
+def page_differences(expected, actual):
+    """Human-readable differences between two rasterized pages; empty if equivalent."""
+    (expected_words, a), (actual_words, b) = expected, actual
+    problems = []
+    if [w[4] for w in expected_words] != [w[4] for w in actual_words]:
+        problems.append("text differs")
+    else:
+        moved = [w[4] for w, v in zip(expected_words, actual_words)
+                 if max(abs(w[i] - v[i]) for i in range(4)) > WORD_TOLERANCE]
+        if moved:
+            problems.append(f"{len(moved)} words moved, first {moved[0]!r}")
+    diff = np.abs(a.astype(np.int16) - b.astype(np.int16)).max(axis=2)
+    differing = int((diff > PIXEL_TOLERANCE).sum())
+    if differing > MAX_DIFF_SHARE * diff.size:
+        problems.append(f"{differing} pixels differ (max delta {diff.max()})")
+    return problems
+
+
+def time_renders(render, docs):
+    start = time.perf_counter()
+    for data in docs:
+        render(data).getvalue()
+    return (time.perf_counter() - start) / len(docs) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--zoom", type=float, default=2.0)
+    args = parser.parse_args()
+
+    docs = [sample_data(i) for i in range(args.docs)]
+    fallbacks = 0
+    for data in docs:
+        try:
+            layout_blocks(data)
+        except FastRenderUnsupported:
+            fallbacks += 1
+
+    # Warm up caches (fonts, images, parsed specs) before timing either path
+    generate_pdf(docs[0]).getvalue()
+    render_fast(docs[0]).getvalue()
+    platypus_ms = time_renders(generate_pdf, docs)
+    fast_ms = time_renders(render_fast, docs)
+    print(f"{args.docs} certificates, {fallbacks} fell back to platypus")
+    print(f"generate_pdf: {platypus_ms:7.2f} ms/doc")
+    print(f"render_fast:  {fast_ms:7.2f} ms/doc  ({platypus_ms / fast_ms:.1f}x)")
+
+    failures = 0
+    for i, data in enumerate(docs):
+        expected = rasterize(generate_pdf(data).getvalue(), args.zoom)
+        actual = rasterize(render_fast(data).getvalue(), args.zoom)
+        if len(expected) != len(actual):
+            print(f"doc {i}: {len(actual)} pages, expected {len(expected)}")
+            failures += 1
+            continue
+        problems = [
+            f"page {page + 1}: {problem}"
+            for page, (a, b) in enumerate(zip(expected, actual))
+            for problem in page_differences(a, b)
+        ]
+        if problems:
+            print(f"doc {i}: " + "; ".join(problems))
+            failures += 1
+    print(f"visual diff: {args.docs - failures}/{args.docs} identical")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
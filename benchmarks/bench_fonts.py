@@ -0,0 +1,71 @@
+"""Embedded TrueType fonts against the base-14 path, in batch mode.
+
+    python benchmarks/bench_fonts.py [--docs 200]
+
+The same sample certificates are rendered with generate_pdf three times: as is
+(base-14 fonts), with a Cyrillic botanical name and "µg/g ≤" results (embedded
+TrueType fonts, subsets cached), and the same again with the subset cache
+bypassed. Font registration, i.e. parsing the font files, is timed on its own
+since it happens once per process.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.pdfbase import pdfmetrics  # noqa: E402
+
+from coa_fonts import unicode_font_names  # noqa: E402
+from pdf_generator import generate_pdf  # noqa: E402
+from samples import sample_data  # noqa: E402
+
+
+def unicode_sample(i):
+    data = sample_data(i)
+    data["botanical_name"] = "Panax ginseng C.A.Mey. (Женьшень)"
+    data["lead_result"] = "0.5 µg/g ≤ 1"
+    return data
+
+
+def time_batch(make_data, docs):
+    start = time.perf_counter()
+    size = sum(len(generate_pdf(make_data(i)).getvalue()) for i in range(docs))
+    return time.perf_counter() - start, size
+
+
+def bypass_subset_cache(names):
+    for name in set(names.values()):
+        face = pdfmetrics.getFont(name).face
+        face.makeSubset = face.makeSubset.__wrapped__
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=200)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    names = unicode_font_names()
+    register_s = time.perf_counter() - start
+    if names is None:
+        print("No TrueType fonts found; see coa_fonts.FONT_DIRS")
+        return 1
+
+    generate_pdf(sample_data(0))  # warm the style and static part caches
+    base_s, base_size = time_batch(sample_data, args.docs)
+    ttf_s, ttf_size = time_batch(unicode_sample, args.docs)
+    bypass_subset_cache(names)
+    uncached_s, _ = time_batch(unicode_sample, args.docs)
+
+    per_doc = 1000 / args.docs
+    print(f"{args.docs} certificates, generate_pdf")
+    print(f"font registration (once per process): {register_s * 1000:7.1f} ms")
+    print(f"base-14:                    {base_s * per_doc:6.2f} ms/doc, {base_size / args.docs / 1024:6.1f} KB/doc")
+    print(f"TrueType, subsets cached:   {ttf_s * per_doc:6.2f} ms/doc, {ttf_size / args.docs / 1024:6.1f} KB/doc")
+    print(f"TrueType, subsets uncached: {uncached_s * per_doc:6.2f} ms/doc")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""Dispatch a shipment of COA emails to a local SMTP stand-in.
+
+    python benchmarks/bench_outbox.py [--docs 200] [--connections 4] [--batch-size 50] [--fail-every 0]
+
+Renders --docs sample certificates, queues one email per certificate in a
+scratch outbox and sends them with coa_outbox to the SMTP sink from
+tests/smtp_sink.py on localhost. The sink counts connections and messages and can answer every n-th message
+with a temporary 451 error to exercise retries, which are then sent on a
+few more passes with the backoff skipped.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tests"))
+
+from coa_outbox import Outbox, OutboxDispatcher, SmtpPool  # noqa: E402
+from pdf_generator import generate_pdf  # noqa: E402
+from samples import sample_data  # noqa: E402
+from smtp_sink import SmtpSink  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--fail-every", type=int, default=0, help="answer every n-th message with 451")
+    args = parser.parse_args()
+
+    sink = SmtpSink(args.fail_every).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        outbox = Outbox(os.path.join(tmp, "outbox.sqlite3"))
+        for i in range(args.docs):
+            data = sample_data(i)
+            outbox.enqueue(generate_pdf(data, deterministic=True).getvalue(), [f"qa{i}@customer.example"],
+                           f"Certificate of Analysis {data['batch_no']}", "COA attached.",
+                           f"{data['batch_no']}.pdf", "coa@truherb.example")
+
+        pool = SmtpPool("127.0.0.1", sink.port, size=args.connections)
+        dispatcher = OutboxDispatcher(outbox, pool, batch_size=args.batch_size)
+        start = time.perf_counter()
+        sent, deferred = dispatcher.dispatch_once()
+        first_s = time.perf_counter() - start
+        passes = 1
+        while deferred and passes < 5:
+            with outbox._connect() as conn:  # skip the backoff wait
+                conn.execute("UPDATE outbox SET next_attempt_at = 0 WHERE status = 'pending'")
+            retried, deferred = dispatcher.dispatch_once()
+            sent += retried
+            passes += 1
+        total_s = time.perf_counter() - start
+        dispatcher.stop()
+
+        print(f"{args.docs} emails, {args.connections} connections, batches of {args.batch_size}")
+        print(f"first pass: {first_s:.2f} s; total: {total_s:.2f} s over {passes} pass(es)")
+        print(f"sent {sent}, still queued {deferred}, received by sink {sink.received}")
+        print(f"SMTP connections opened: {pool.opened} (sink saw {sink.connections})")
+        print(f"outbox: {outbox.counts()}")
+    sink.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
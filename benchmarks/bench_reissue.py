@@ -0,0 +1,67 @@
+"""Bulk re-dating: patch-in-place reissue against a full re-render.
+
+    python benchmarks/bench_reissue.py [--docs 1000] [--workers 4] [--backend reportlab]
+
+Every sample certificate is rendered once and its field placements recorded;
+the timed step gives each one a new reanalysis date, first by patching the
+existing PDF and then by rendering it again from scratch.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_reissue import record_placements, reissue  # noqa: E402
+from renderers import DEFAULT_BACKEND, get_renderer  # noqa: E402
+from samples import sample_data  # noqa: E402
+
+NEW_DATE = "06/2028"
+
+
+def issue(backend, i):
+    data = sample_data(i)
+    pdf = get_renderer(backend).render(data)
+    return pdf, record_placements(pdf, data)
+
+
+def redate(backend, i, pdf, placements):
+    data = sample_data(i)
+    _, _, patched = reissue(pdf, placements, data, dict(data, reanalysis_date=NEW_DATE), backend)
+    return patched
+
+
+def rerender(backend, i):
+    return len(get_renderer(backend).render(dict(sample_data(i), reanalysis_date=NEW_DATE)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--backend", default=DEFAULT_BACKEND)
+    args = parser.parse_args()
+
+    indices = list(range(args.docs))
+    backends = [args.backend] * args.docs
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        issued = list(pool.map(issue, backends, indices, chunksize=16))
+        pdfs, placements = zip(*issued)
+
+        start = time.perf_counter()
+        patched = sum(pool.map(redate, backends, indices, pdfs, placements, chunksize=16))
+        patch_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        list(pool.map(rerender, backends, indices, chunksize=16))
+        render_s = time.perf_counter() - start
+
+    print(f"{args.docs} certificates, {args.workers} worker processes, backend={args.backend}")
+    print(f"patched in place: {patch_s:6.2f} s ({patched} patched, {args.docs - patched} re-rendered)")
+    print(f"full re-render:   {render_s:6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Throughput of every renderer backend on the same sample certificates.
+
+    python benchmarks/bench_renderers.py [--docs 200] [--workers 4] [--optimize]
+
+Each backend renders every sample once in this process (latency) and once spread
+over a process pool (batch throughput); the fastest backend for batch work is
+printed last.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from renderers import BACKENDS, get_renderer  # noqa: E402
+from samples import sample_data  # noqa: E402
+
+
+def render_many(backend, indices, optimize):
+    renderer = get_renderer(backend)
+    size = 0
+    for i in indices:
+        size += len(renderer.render(sample_data(i), optimize=optimize))
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--optimize", action="store_true", help="use the optimized output profile")
+    args = parser.parse_args()
+
+    indices = list(range(args.docs))
+    chunks = [indices[w::args.workers] for w in range(args.workers)]
+    print(f"{args.docs} certificates, {args.workers} worker processes, optimize={args.optimize}")
+    print(f"{'backend':<18} {'ms/doc':>8} {'KB/doc':>8} {'batch docs/s':>13}")
+
+    throughput = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for name in BACKENDS:
+            render_many(name, indices[:2], args.optimize)  # warm up fonts, images and caches
+
+            start = time.perf_counter()
+            size = render_many(name, indices, args.optimize)
+            latency_ms = (time.perf_counter() - start) / args.docs * 1000
+
+            # Warm every worker, then time the batch
+            list(pool.map(render_many, [name] * args.workers, [c[:1] for c in chunks], [args.optimize] * args.workers))
+            start = time.perf_counter()
+            list(pool.map(render_many, [name] * args.workers, chunks, [args.optimize] * args.workers))
+            throughput[name] = args.docs / (time.perf_counter() - start)
+
+            print(f"{name:<18} {latency_ms:8.2f} {size / args.docs / 1024:8.1f} {throughput[name]:13.1f}")
+
+    fastest = max(throughput, key=throughput.get)
+    print(f"fastest for batch work: {fastest} ({BACKENDS[fastest].description})")
+
+
+if __name__ == "__main__":
+    main()
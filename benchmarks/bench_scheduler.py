@@ -0,0 +1,92 @@
+"""Interactive render latency while a bulk batch is running, scheduled against first come first served.
+
+    python benchmarks/bench_scheduler.py [--bulk 200] [--interactive 10] [--workers 2]
+
+A bulk batch of --bulk sample certificates is queued on a RenderQueue, and
+--interactive Compile-like renders are submitted one at a time while it
+runs. Run once with every job in one class, of one owner and with no reserved
+worker (what the queue did before it had a scheduler), and once with the
+bulk batch at BULK and the renders at INTERACTIVE. Two extra batches of a second owner check that
+fair sharing interleaves them.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from render_queue import RenderQueue, BULK, INTERACTIVE, NORMAL  # noqa: E402
+from samples import sample_data  # noqa: E402
+
+
+def run(args, scheduled):
+    queue = RenderQueue(max_workers=args.workers, max_finished=args.bulk + args.interactive,
+                        reserved_interactive=1 if scheduled else 0)
+    done = threading.Event()
+    remaining = [args.bulk]
+    lock = threading.Lock()
+
+    def bulk_done(job):
+        with lock:
+            remaining[0] -= 1
+            if not remaining[0]:
+                done.set()
+
+    bulk_priority = BULK if scheduled else NORMAL
+    queue.submit_batch([sample_data(i) for i in range(args.bulk)], priority=bulk_priority,
+                       owner="reissue" if scheduled else "everyone", callback=bulk_done)
+    latencies = []
+    for n in range(args.interactive):
+        time.sleep(args.gap)
+        data = sample_data(100000 + n)
+        start = time.perf_counter()
+        if scheduled:
+            job_id = queue.submit(data, priority=INTERACTIVE, owner=f"user{n % 3}")
+        else:
+            job_id = queue.submit(data, owner="everyone")
+        while not queue.get(job_id).finished:
+            time.sleep(0.005)
+        latencies.append(time.perf_counter() - start)
+    done.wait()
+    metrics = queue.metrics()
+    queue.shutdown()
+    return sorted(latencies), metrics
+
+
+def fair_share(args):
+    """Order in which two bulk owners' documents start, in 20-job windows."""
+    queue = RenderQueue(max_workers=1, max_finished=2 * args.bulk)
+    order = []
+    queue.submit_batch([sample_data(i) for i in range(40)], priority=BULK, owner="a",
+                       callback=lambda job: order.append("a"))
+    queue.submit_batch([sample_data(1000 + i) for i in range(40)], priority=BULK, owner="b",
+                       callback=lambda job: order.append("b"))
+    while len(order) < 80:
+        time.sleep(0.05)
+    queue.shutdown()
+    return "".join(order)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bulk", type=int, default=200)
+    parser.add_argument("--interactive", type=int, default=10)
+    parser.add_argument("--gap", type=float, default=0.5, help="seconds between interactive renders")
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    for label, scheduled in (("first come first served", False), ("priority scheduler", True)):
+        latencies, metrics = run(args, scheduled)
+        print(f"{label}: interactive render p50 {latencies[len(latencies) // 2] * 1000:7.0f} ms, "
+              f"max {latencies[-1] * 1000:7.0f} ms")
+        for name, stats in metrics.items():
+            if stats["completed"]:
+                print(f"    {name:12} {stats['completed']:4} done, wait p50 {stats['wait_p50'] * 1000:7.0f} ms, "
+                      f"p95 {stats['wait_p95'] * 1000:7.0f} ms")
+    print(f"fair share, two bulk owners on one worker: {fair_share(args)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,434 @@
+"""Load test: many scripted sessions against one app server, with rerun latency, CPU and memory.
+
+    python benchmarks/load_test.py [--sessions 8] [--rounds 3] [--think-time 0.2] [--json results.json]
+
+Starts one `streamlit run app.py` server with its runtime state in a scratch
+directory (COA_VAR_DIR) and its working directory next to it: images/ and
+fonts/ link to the repository's, and .streamlit/config.toml is the
+repository's with an admin key added when it has none. Every session connects
+to it over the app's websocket, as browsers do. Each session does what a QC user
+does: fill in the product information, add and fill Physical and
+Microbiological rows, delete a base analyte and an extra row, then Compile and
+wait for the download button. Each widget change is one rerun, and every rerun
+also rebuilds the live preview, so the rerun latencies cover the preview too.
+
+All sessions share the server's interpreter (and its GIL), render queue and
+caches, so the latencies include the contention between them. CPU and memory
+are the server process's: user+system time over the run, and its resident
+set size after the first page load and at its peak.
+
+Per session, the report gives its rerun and compile latencies and the memory
+the app accounts to it (session_memory: its session state plus the render
+results it holds) at the end of the run, with its share of what all sessions
+hold. Those figures are read from the app's admin "Session memory" table by
+one more session after the others are done, since the app does not track
+memory per session in any other way; the server's RSS cannot be split by
+session, as every session shares one interpreter.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+import pyarrow as pa
+import tomllib
+from streamlit.proto.Alert_pb2 import Alert
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado.websocket import websocket_connect
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP_PATH = os.path.join(ROOT, "app.py")
+COMPILE_LABEL = "Compile and Generate PDF"
+COMPILE_TIMEOUT = 60.0
+SERVER_START_TIMEOUT = 60.0
+POLL_INTERVAL = 0.1
+
+PRODUCT_INFO = [
+    ("Product Name", "Ashwagandha Extract {n}"),
+    ("Product Code", "TH-ASH-{n:03d}"),
+    ("Batch No.", "B{n:05d}"),
+    ("Date of Manufacturing", "01/2026"),
+    ("Date of Reanalysis", "12/2027"),
+    ("Botanical Name", "Withania somnifera"),
+    ("Quantity", "{n}0 kg"),
+]
+PHYSICAL_ROW = ("Colour", "Light brown", "Complies", "Visual")
+MICROBIO_ROW = ("Staphylococcus aureus", "Absent/10g", "Absent", "USP<62>")
+DELETE_ANALYTE_KEY = "del_moist"
+SESSION_MEMORY_COLUMNS = ("Session", "State KB", "Results KB", "Total KB")
+
+
+# ----------------------------------------------------------------------------
+# SERVER
+# ----------------------------------------------------------------------------
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def prepare_run_dir(run_dir):
+    """A working directory for the server that sees the repository's images, fonts and
+    settings; returns the admin key of its settings."""
+    os.makedirs(os.path.join(run_dir, ".streamlit"))
+    for name in ("images", "fonts"):
+        if os.path.isdir(os.path.join(ROOT, name)):
+            os.symlink(os.path.join(ROOT, name), os.path.join(run_dir, name))
+    try:
+        with open(os.path.join(ROOT, ".streamlit", "config.toml"), encoding="utf-8") as f:
+            config = f.read()
+    except FileNotFoundError:
+        config = ""
+    admin_key = str(tomllib.loads(config).get("settings", {}).get("admin_key", ""))
+    if not admin_key:
+        admin_key = secrets.token_hex(8)
+        line = f'admin_key = "{admin_key}"'
+        config, added = re.subn(r"^\[settings\][ \t]*$", lambda match: f"{match.group(0)}\n{line}",
+                                config, count=1, flags=re.MULTILINE)
+        if not added:
+            config += f"\n[settings]\n{line}\n"
+    with open(os.path.join(run_dir, ".streamlit", "config.toml"), "w", encoding="utf-8") as f:
+        f.write(config)
+    return admin_key
+
+
+def start_server(port, var_dir, run_dir):
+    """`streamlit run app.py` in run_dir (see prepare_run_dir), writing its state under var_dir."""
+    env = dict(os.environ, COA_VAR_DIR=var_dir)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.port", str(port),
+         "--server.address", "127.0.0.1", "--server.headless", "true",
+         "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"],
+        cwd=run_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"streamlit exited with status {server.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as response:
+                if response.status == 200:
+                    return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("streamlit did not start")
+
+
+def process_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime are fields 14 and 15 of the line, counted in clock ticks
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def process_rss_kb(pid):
+    """(current, peak) resident set size of a process, in KiB."""
+    sizes = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                sizes[key] = int(value.split()[0])
+    return sizes["VmRSS"], sizes["VmHWM"]
+
+
+# ----------------------------------------------------------------------------
+# SESSIONS
+# ----------------------------------------------------------------------------
+class Session:
+    """One scripted user on its own websocket; records the latency of every rerun by step."""
+
+    def __init__(self, port, think_time):
+        self.url = f"ws://127.0.0.1:{port}/_stcore/stream"
+        self.think_time = think_time
+        self.timings = []
+        self.connection = None
+        self.session_id = None
+        self.elements = {}  # delta path -> Element of the last script run
+        self.values = {}  # widget id -> WidgetState the "browser" holds
+        self.cached = {}  # message hash -> ForwardMsg, for messages the server sends by reference
+
+    async def connect(self):
+        self.connection = await websocket_connect(self.url, subprotocols=["streamlit"])
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+    async def _receive(self):
+        payload = await self.connection.read_message()
+        if payload is None:
+            raise RuntimeError("server closed the connection")
+        msg = ForwardMsg()
+        msg.ParseFromString(payload)
+        if msg.WhichOneof("type") == "ref_hash":
+            msg = self.cached[msg.ref_hash]
+        elif msg.hash:
+            self.cached[msg.hash] = msg
+        return msg
+
+    async def _run(self, step, trigger=None, query_string=""):
+        """Rerun the script with the current widget values (and `trigger` pressed) until it finishes."""
+        back = BackMsg()
+        back.rerun_script.query_string = query_string
+        live = {element_id for element_id, _ in self._widgets()}
+        back.rerun_script.widget_states.widgets.extend(
+            state for widget_id, state in self.values.items() if widget_id in live
+        )
+        if trigger is not None:
+            back.rerun_script.widget_states.widgets.add(id=trigger, trigger_value=True)
+        start = time.perf_counter()
+        await self.connection.write_message(back.SerializeToString(), binary=True)
+        while True:
+            msg = await self._receive()
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                self.elements = {}  # a script run (possibly one the app started with st.rerun) begins
+                if msg.new_session.HasField("initialize"):
+                    self.session_id = msg.new_session.initialize.session_id
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                self.elements[tuple(msg.metadata.delta_path)] = msg.delta.new_element
+            elif kind == "script_finished" and msg.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                break
+        self.timings.append((step, time.perf_counter() - start))
+        for element in self.elements.values():
+            if element.WhichOneof("type") == "exception":
+                raise RuntimeError(f"{step}: {element.exception.message}")
+        if self.think_time:
+            await asyncio.sleep(self.think_time)
+
+    def _widgets(self, kind=None):
+        for element in self.elements.values():
+            element_kind = element.WhichOneof("type")
+            if kind is None or element_kind == kind:
+                widget = getattr(element, element_kind)
+                if getattr(widget, "id", ""):
+                    yield widget.id, widget
+
+    def _find(self, kind, label=None, key=None):
+        for widget_id, widget in self._widgets(kind):
+            # Ids of widgets with a user key end in "-<key>"
+            if (key is not None and widget_id.split("-", 2)[-1] == key) or \
+                    (label is not None and widget.label == label):
+                return widget_id
+        raise LookupError(f"no {kind} {label or key!r}")
+
+    def table(self, columns):
+        """The first dataframe shown with all of `columns`, as a pandas DataFrame."""
+        for element in self.elements.values():
+            if element.WhichOneof("type") == "arrow_data_frame":
+                frame = pa.ipc.open_stream(element.arrow_data_frame.data).read_all().to_pandas()
+                if set(columns) <= set(frame.columns):
+                    return frame
+        raise LookupError(f"no table with columns {columns}")
+
+    def _has(self, kind):
+        return any(element.WhichOneof("type") == kind for element in self.elements.values())
+
+    def _has_error(self):
+        return any(element.WhichOneof("type") == "alert" and element.alert.format == Alert.ERROR
+                   for element in self.elements.values())
+
+    async def type_text(self, value, label=None, key=None):
+        widget_id = self._find("text_input", label, key)
+        self.values[widget_id] = WidgetState(id=widget_id, string_value=value)
+        await self._run("edit")
+
+    async def click(self, step, label=None, key=None):
+        await self._run(step, trigger=self._find("button", label, key))
+
+    def _row_count(self, prefix):
+        return sum(1 for widget_id, _ in self._widgets("text_input")
+                   if widget_id.split("-", 2)[-1].startswith(f"{prefix}Param_"))
+
+    async def add_row(self, label, prefix, values):
+        """Add an extra spec row and type its four cells; returns the row index."""
+        index = self._row_count(prefix)
+        await self.click("add_row", label=label)
+        for part, value in zip(("Param", "Spec", "Result", "Method"), values):
+            await self.type_text(value, key=f"{prefix}{part}_{index}")
+        return index
+
+    async def compile(self):
+        """Press Compile and rerun (as the status fragment would) until the PDF is ready."""
+        start = time.perf_counter()
+        await self.click("compile", label=COMPILE_LABEL)
+        while not self._has("download_button"):
+            if self._has_error() or time.perf_counter() - start > COMPILE_TIMEOUT:
+                raise RuntimeError("compile did not finish")
+            await asyncio.sleep(POLL_INTERVAL)
+            await self._run("poll")
+        return time.perf_counter() - start
+
+    async def script(self, n):
+        for label, value in PRODUCT_INFO:
+            await self.type_text(value.format(n=n), label=label)
+        await self.add_row("Add New Physical Row", "Physical", PHYSICAL_ROW)
+        extra = await self.add_row("Add New Physical Row", "Physical", PHYSICAL_ROW)
+        await self.add_row("Add New Microbiological Row", "Microbio", MICROBIO_ROW)
+        await self.click("delete", key=DELETE_ANALYTE_KEY)
+        await self.click("delete", key=f"del_physical_{extra}")
+        return await self.compile()
+
+
+async def run_session(port, session_no, rounds, think_time):
+    """One session from first page load to its last compile."""
+    session = Session(port, think_time)
+    await session.connect()
+    try:
+        await session._run("load")
+        compiles = [await session.script(session_no * rounds + r) for r in range(rounds)]
+    finally:
+        session.close()
+    return {"session": session_no, "session_id": session.session_id, "timings": session.timings,
+            "compiles": compiles}
+
+
+async def session_memory(port, admin_key):
+    """{session id prefix: (state KB, results KB, total KB)} from the app's admin table."""
+    observer = Session(port, 0)
+    await observer.connect()
+    try:
+        await observer._run("load", query_string=f"admin={admin_key}")
+        table = observer.table(SESSION_MEMORY_COLUMNS)
+    finally:
+        observer.close()
+    return {row["Session"]: (row["State KB"], row["Results KB"], row["Total KB"]) for _, row in table.iterrows()}
+
+
+async def run_sessions(port, sessions, rounds, think_time, server_pid, admin_key):
+    # The server's first run imports the app and builds its caches; it is not part of the load
+    warm_up = Session(port, 0)
+    await warm_up.connect()
+    await warm_up._run("load")
+    warm_up.close()
+    cpu_start = process_cpu_seconds(server_pid)
+    rss_start, _ = process_rss_kb(server_pid)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_session(port, i, rounds, think_time) for i in range(sessions)))
+    wall_s = time.perf_counter() - start
+    rss_end, rss_peak = process_rss_kb(server_pid)
+    memory = await session_memory(port, admin_key)
+    for result in results:
+        result["memory_kb"] = memory.get(result["session_id"][:8])
+    server = {
+        "cpu_s": process_cpu_seconds(server_pid) - cpu_start,
+        "rss_start_kb": rss_start,
+        "rss_end_kb": rss_end,
+        "peak_rss_kb": rss_peak,
+    }
+    return results, server, wall_s
+
+
+# ----------------------------------------------------------------------------
+# REPORT
+# ----------------------------------------------------------------------------
+def percentiles(seconds):
+    if not seconds:
+        return {}
+    values = np.percentile(np.asarray(seconds) * 1000, [50, 90, 99])
+    return {"n": len(seconds), "p50_ms": values[0], "p90_ms": values[1], "p99_ms": values[2],
+            "max_ms": max(seconds) * 1000}
+
+
+def session_row(result, accounted_kb):
+    row = {"session": result["session"],
+           "rerun_p50_ms": percentiles([t for step, t in result["timings"] if step != "poll"])["p50_ms"],
+           "compile_p50_ms": percentiles(result["compiles"])["p50_ms"]}
+    if result["memory_kb"] is not None:
+        state_kb, results_kb, total_kb = result["memory_kb"]
+        row.update(state_kb=state_kb, results_kb=results_kb, total_kb=total_kb,
+                   memory_share=total_kb / accounted_kb if accounted_kb else 0.0)
+    return row
+
+
+def summarize(results, server, wall_s):
+    reruns = [t for result in results for step, t in result["timings"] if step != "poll"]
+    accounted_kb = sum(result["memory_kb"][2] for result in results if result["memory_kb"] is not None)
+    by_step = {}
+    for result in results:
+        for step, t in result["timings"]:
+            by_step.setdefault(step, []).append(t)
+    return {
+        "sessions": len(results),
+        "wall_s": wall_s,
+        "reruns_per_s": len(reruns) / wall_s if wall_s else 0.0,
+        "rerun": percentiles(reruns),
+        "steps": {step: percentiles(times) for step, times in sorted(by_step.items())},
+        "compile": percentiles([t for result in results for t in result["compiles"]]),
+        "server": server,
+        "accounted_kb": accounted_kb,
+        "per_session": [session_row(result, accounted_kb) for result in results],
+    }
+
+
+def _format(stats):
+    return (f"n={stats['n']:5d}  p50={stats['p50_ms']:7.1f} ms  p90={stats['p90_ms']:7.1f} ms  "
+            f"p99={stats['p99_ms']:7.1f} ms  max={stats['max_ms']:7.1f} ms")
+
+
+def report(summary):
+    print(f"{summary['sessions']} concurrent sessions on one server, {summary['wall_s']:.1f} s wall, "
+          f"{summary['reruns_per_s']:.1f} reruns/s")
+    print(f"  all reruns        {_format(summary['rerun'])}")
+    for step, stats in summary["steps"].items():
+        print(f"  {step:<17} {_format(stats)}")
+    print(f"  compile->download {_format(summary['compile'])}")
+    server = summary["server"]
+    print(f"  server: {server['cpu_s']:.2f} cpu s; RSS {server['rss_start_kb'] / 1024:.1f} MiB after the first "
+          f"load, {server['rss_end_kb'] / 1024:.1f} MiB at the end, {server['peak_rss_kb'] / 1024:.1f} MiB peak")
+    print(f"  sessions hold {summary['accounted_kb']:.1f} KB (session state and render results)")
+    print("  session   rerun p50 ms   compile p50 ms   state KB   results KB   share")
+    for row in summary["per_session"]:
+        line = f"  {row['session']:7d}  {row['rerun_p50_ms']:13.1f}  {row['compile_p50_ms']:15.1f}"
+        if "total_kb" in row:
+            line += f"  {row['state_kb']:9.1f}  {row['results_kb']:11.1f}  {row['memory_share']:5.0%}"
+        else:
+            line += "  (not tracked)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3, help="scripted edit-and-compile rounds per session")
+    parser.add_argument("--think-time", type=float, default=0.2, help="pause after every rerun, in seconds")
+    parser.add_argument("--json", help="also write the summary to this file, to compare runs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="coa-load-") as scratch:
+        var_dir, run_dir = os.path.join(scratch, "var"), os.path.join(scratch, "run")
+        admin_key = prepare_run_dir(run_dir)
+        port = free_port()
+        server = start_server(port, var_dir, run_dir)
+        try:
+            results, server_stats, wall_s = asyncio.run(
+                run_sessions(port, args.sessions, args.rounds, args.think_time, server.pid, admin_key)
+            )
+        finally:
+            server.terminate()
+            server.wait()
+        summary = summarize(results, server_stats, wall_s)
+
+    report(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
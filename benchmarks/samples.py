@@ -0,0 +1,37 @@
+"""Sample COA data dicts shared by the benchmarks."""
+from coa_data import SECTIONS
+
+METHODS = ["In house", "USP<731>", "By HPLC", "Visual", "AOAC", "Ph.Eur. 2.2.32"]
+
+
+def sample_data(i):
+    """A fully filled-in certificate that varies row counts, wrapping and failing results."""
+    data = {
+        "product_name": f"Ashwagandha Root Extract {i % 10 + 1}%",
+        "product_code": f"AW{i:04d}",
+        "batch_no": f"B{i:05d}",
+        "manufacturing_date": "01/2025",
+        "reanalysis_date": "01/2027",
+        "botanical_name": "Withania somnifera",
+        "extraction_ratio": "10:1",
+        "solvent": "Water and Ethanol",
+        "plant_part": "Root",
+        "cas_no": "90147-43-6",
+        # Markup in a field sends every 25th certificate down the platypus fallback
+        "chemical_name": "Withanolides <i>(HPLC)</i>" if i % 25 == 24 else "Withanolides",
+        "quantity": f"{25 + i} kg",
+        "origin": "India",
+        "allergen_statement": "Free from allergen",
+        "product_additional_rows": [["Carrier", "Maltodextrin"]] if i % 3 == 0 else [],
+    }
+    for s, (_, extra_key, base_rows) in enumerate(SECTIONS):
+        for r, (label, prefix) in enumerate(base_rows):
+            filled = (i + r + s) % 4 != 0
+            data[f"{prefix}_spec"] = "NMT 5.0%" if filled else ""
+            data[f"{prefix}_result"] = f"{(i + r) % 7}.{r}%" if filled else ""
+            data[f"{prefix}_method"] = METHODS[(i + r) % len(METHODS)] if filled else ""
+        data[extra_key] = [
+            [f"Extra {label} {n}", "Between 0.3 g/ml to 0.6 g/ml when tapped 500 times", "<10 cfu/g", "In house"]
+            for n, (label, _) in enumerate(base_rows[: i % 3])
+        ]
+    return data
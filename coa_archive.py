@@ -0,0 +1,60 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+from coa_data import data_hash
+from coa_settings import VAR_DIR
+
+DEFAULT_ARCHIVE_PATH = os.path.join(VAR_DIR, "coa_archive.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certificates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data_hash TEXT NOT NULL UNIQUE,
+    issued_at TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+"""
+
+
+class CoaArchive:
+    """Every issued COA's data dict, in issue order, so it can be found and re-rendered later."""
+
+    def __init__(self, path=DEFAULT_ARCHIVE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def add(self, data, issued_at=None):
+        """Store `data`; returns (certificate id, True) or (existing id, False) for identical data."""
+        issued_at = (issued_at or datetime.datetime.now()).isoformat(timespec="seconds")
+        key = data_hash(data)
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO certificates (data_hash, issued_at, data) VALUES (?, ?, ?)",
+                (key, issued_at, json.dumps(data)),
+            )
+            if cursor.rowcount:
+                return cursor.lastrowid, True
+            row = conn.execute("SELECT id FROM certificates WHERE data_hash = ?", (key,)).fetchone()
+            return row[0], False
+
+    def get(self, cert_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT data FROM certificates WHERE id = ?", (cert_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def iter_certificates(self, after_id=0):
+        """Yield (id, issued_at, data) in issue order, starting after `after_id`."""
+        with self._connect() as conn:
+            for cert_id, issued_at, data in conn.execute(
+                "SELECT id, issued_at, data FROM certificates WHERE id > ? ORDER BY id", (after_id,)
+            ):
+                yield cert_id, issued_at, json.loads(data)
@@ -0,0 +1,329 @@
+"""Render COAs from newline-delimited JSON data dicts into a directory of PDFs.
+
+    python coa_cli.py [records.ndjson | -] --out-dir out/ [--workers 4] [--max-in-flight 16]
+    python coa_cli.py --resume --out-dir out/ [--max-attempts 3]
+
+Each input line is one COA data dict. Records are validated as they are read and
+rendered on a pool of worker processes with a bounded number in flight, so memory
+stays flat however long the input is; each PDF is written as soon as it is done
+and one JSON status line per record is printed to stdout, in completion order.
+Output is deterministic and named after the data hash and the record's [coa]
+layout, so a record whose PDF already exists is skipped, and is rendered again
+once its layout in the settings changes.
+
+Every outcome is also appended to a journal (out-dir/journal.ndjson) under the
+record's line number and render key (data hash plus layout digest). --resume re-reads the input of the last run
+and renders only what the journal does not hold as done: records that failed are
+tried again until they have failed --max-attempts times, and records that fail
+validation are not tried again. A resumed run leaves the same PDFs as a run that
+was never interrupted.
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from coa_data import data_hash
+from coa_settings import layout_digest
+from coa_validate import validate
+from pdf_optimize import render_optimized
+from renderers import BACKENDS, DEFAULT_BACKEND, get_renderer
+
+_UNSAFE_NAME_CHARS = re.compile(r"[^0-9A-Za-z._-]+")
+# Temporary file of a PDF being written by write_atomic
+PARTIAL_FILE_RE = re.compile(r".+\.pdf\.\d+\.tmp")
+
+JOURNAL_NAME = "journal.ndjson"
+DEFAULT_MAX_ATTEMPTS = 3
+# The journal is flushed per record but fsynced at most this often; a record lost
+# from its tail is only rendered again, and finds its PDF already there
+JOURNAL_SYNC_SECONDS = 1.0
+
+
+def render_key(data):
+    """What a record's PDF depends on: its data hash and the digest of its [coa] layout."""
+    return f"{data_hash(data)}-{layout_digest(data)}"
+
+
+def output_name(data):
+    """File name of a record's PDF: batch number (if any), the data hash and the layout digest."""
+    batch = _UNSAFE_NAME_CHARS.sub("_", str(data.get("batch_no", "") or "").strip()).strip("._")
+    digest = f"{data_hash(data)[:16]}-{layout_digest(data)[:8]}"
+    return f"{batch}-{digest}.pdf" if batch else f"{digest}.pdf"
+
+
+def write_atomic(path, payload):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def remove_partial_files(out_dir):
+    """Delete temporary files left behind by workers that died mid-write (write_atomic's *.pdf.<pid>.tmp)."""
+    for path in glob.glob(os.path.join(out_dir, "*.pdf.*.tmp")):
+        if not PARTIAL_FILE_RE.fullmatch(os.path.basename(path)):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def render_record(line_no, data, out_dir, backend, optimize):
+    """Worker: render one record into out_dir and return its status dict."""
+    start = time.perf_counter()
+    path = os.path.join(out_dir, output_name(data))
+    if os.path.exists(path):
+        return {"line": line_no, "status": "skipped", "path": path}
+    if optimize:
+        pdf = render_optimized(data, backend, deterministic=True).pdf
+    else:
+        pdf = get_renderer(backend).render(data, deterministic=True)
+    write_atomic(path, pdf)
+    return {"line": line_no, "status": "ok", "path": path,
+            "ms": round((time.perf_counter() - start) * 1000, 1)}
+
+
+def read_records(stream):
+    """Yield (line number, data dict or None, error) for every non-blank input line."""
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as exc:
+            yield line_no, None, f"invalid JSON: {exc}"
+            continue
+        if not isinstance(data, dict):
+            yield line_no, None, "record is not a JSON object"
+            continue
+        yield line_no, data, None
+
+
+def emit(status, out=sys.stdout):
+    out.write(json.dumps(status) + "\n")
+    out.flush()
+
+
+# ----------------------------------------------------------------------------
+# PROGRESS JOURNAL
+#
+# One JSON line per event: {"run": {...}} when a run starts, then the status
+# line of every record with its render key (as "hash") and attempt number. A torn last line
+# (the process died mid-write) is cut off when the journal is read.
+# ----------------------------------------------------------------------------
+class JournalState:
+    """What a journal says about earlier runs."""
+
+    def __init__(self):
+        self.run = None  # options of the last run
+        self.done = {}  # line -> render key rendered (or found already rendered)
+        self.failures = {}  # (line, render key) -> failed attempts
+        self.permanent = set()  # (line, render key) of records that failed validation
+
+    def record(self, entry):
+        if "run" in entry:
+            self.run = entry["run"]
+            return
+        key = (entry["line"], entry.get("hash"))
+        if entry["status"] in ("ok", "skipped"):
+            self.done[entry["line"]] = entry["hash"]
+        elif entry.get("permanent"):
+            self.permanent.add(key)
+        elif entry["status"] == "error":
+            self.failures[key] = self.failures.get(key, 0) + 1
+
+
+def read_journal(path):
+    """JournalState of the journal at path (empty if there is none)."""
+    state = JournalState()
+    if not os.path.exists(path):
+        return state
+    good_size = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            state.record(entry)
+            good_size += len(line)
+    if good_size != os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(good_size)
+    return state
+
+
+class Journal:
+    def __init__(self, path, fresh):
+        self._file = open(path, "w" if fresh else "a", encoding="utf-8")
+        self._synced_at = time.monotonic()
+
+    def write(self, entry):
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        if time.monotonic() - self._synced_at >= JOURNAL_SYNC_SECONDS:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+        self._synced_at = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+
+def run(stream, out_dir, workers, max_in_flight, backend=DEFAULT_BACKEND, optimize=False,
+        journal_path=None, resume=False, max_attempts=DEFAULT_MAX_ATTEMPTS, input_name="-"):
+    """Render every record of `stream`; returns {status: count}.
+
+    With resume, records the journal holds as done are counted as "resumed" and records that
+    failed validation or max_attempts renders as "given_up", without being tried again.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    remove_partial_files(out_dir)
+    journal_path = journal_path or os.path.join(out_dir, JOURNAL_NAME)
+    state = read_journal(journal_path) if resume else JournalState()
+    journal = Journal(journal_path, fresh=not resume)
+    journal.write({"run": {
+        "input": input_name, "backend": backend, "optimize": optimize,
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"), "resume": resume,
+    }})
+    counts = {"ok": 0, "skipped": 0, "error": 0, "resumed": 0, "given_up": 0}
+
+    def report(status):
+        counts[status["status"]] += 1
+        journal.write(status)
+        emit(status)
+
+    def finish(future, line_no, data, key, attempt, alone=False):
+        """Report a finished render; returns False, reporting nothing, if its pool broke under it.
+
+        When a worker dies, the pool fails every render in flight, so a broken render
+        is only the dying worker's own when it was alone in the pool.
+        """
+        try:
+            status = future.result()
+        except BrokenProcessPool as exc:
+            if not alone:
+                return False
+            status = {"line": line_no, "status": "error", "error": f"{type(exc).__name__}: {exc}"}
+        except Exception as exc:  # one bad record must not stop the run
+            status = {"line": line_no, "status": "error", "error": f"{type(exc).__name__}: {exc}"}
+        status.update(hash=key, attempt=attempt)
+        report(status)
+        return True
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    in_flight = {}
+
+    def drain(until):
+        nonlocal pool
+        broken = []
+        while len(in_flight) > until or (broken and in_flight):
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = in_flight.pop(future)
+                if not finish(future, *job):
+                    broken.append(job)
+        # A worker died (killed for memory, most likely); its pool is unusable from here on.
+        # Render the records it took down again one at a time, so only the record that
+        # kills its worker is reported as an error
+        for job in sorted(broken, key=lambda job: job[0]):
+            pool.shutdown(wait=False)
+            pool = ProcessPoolExecutor(max_workers=workers)
+            future = pool.submit(render_record, job[0], job[1], out_dir, backend, optimize)
+            wait([future])
+            finish(future, *job, alone=True)
+
+    try:
+        for line_no, data, error in read_records(stream):
+            key = render_key(data) if data is not None else None
+            if resume and state.done.get(line_no) == key and key is not None:
+                counts["resumed"] += 1
+                continue
+            attempt = state.failures.get((line_no, key), 0) + 1
+            if resume and ((line_no, key) in state.permanent or attempt > max_attempts):
+                counts["given_up"] += 1
+                emit({"line": line_no, "status": "given_up", "hash": key})
+                continue
+            if error is None:
+                problems = validate(data)
+                if problems:
+                    error = "; ".join(f"{p.key}: {p.message}" for p in problems)
+            if error is not None:
+                report({"line": line_no, "status": "error", "error": error, "hash": key, "permanent": True})
+                continue
+            drain(max_in_flight - 1)
+            try:
+                future = pool.submit(render_record, line_no, data, out_dir, backend, optimize)
+            except BrokenProcessPool:
+                drain(0)
+                future = pool.submit(render_record, line_no, data, out_dir, backend, optimize)
+            in_flight[future] = (line_no, data, key, attempt)
+        drain(0)
+    finally:
+        pool.shutdown()
+        journal.close()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", nargs="?", default=None,
+                        help="NDJSON file, or - for stdin (default; with --resume, the last run's input)")
+    parser.add_argument("--out-dir", required=True)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="records submitted but not yet written (default: 4 per worker)")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=None)
+    parser.add_argument("--optimize", action="store_true", help="use the optimized output profile")
+    parser.add_argument("--journal", default=None, help=f"progress journal (default: out-dir/{JOURNAL_NAME})")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip records the journal holds as done and retry failed ones")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help="renders of a failing record before --resume gives up on it")
+    args = parser.parse_args(argv)
+
+    input_name, backend, optimize = args.input, args.backend, args.optimize
+    if args.resume:
+        last_run = read_journal(args.journal or os.path.join(args.out_dir, JOURNAL_NAME)).run
+        if last_run is None:
+            parser.error("nothing to resume: no journal in the output directory")
+        input_name = input_name or last_run["input"]
+        backend = backend or last_run["backend"]
+        optimize = optimize or last_run["optimize"]
+        if input_name == "-" and args.input is None:
+            parser.error("the interrupted run read stdin; pass the same records again")
+    input_name = input_name or "-"
+    backend = backend or DEFAULT_BACKEND
+
+    max_in_flight = args.max_in_flight or 4 * args.workers
+    options = dict(backend=backend, optimize=optimize, journal_path=args.journal, resume=args.resume,
+                   max_attempts=args.max_attempts)
+    if input_name == "-":
+        counts = run(sys.stdin, args.out_dir, args.workers, max_in_flight, input_name="-", **options)
+    else:
+        with open(input_name, encoding="utf-8") as stream:
+            counts = run(stream, args.out_dir, args.workers, max_in_flight, input_name=os.path.abspath(input_name),
+                         **options)
+    print(f"{counts['ok']} rendered, {counts['skipped']} skipped, {counts['error']} failed"
+          + (f", {counts['resumed']} done before, {counts['given_up']} given up" if args.resume else ""),
+          file=sys.stderr)
+    return 1 if counts["error"] or counts["given_up"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
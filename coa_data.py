@@ -0,0 +1,86 @@
+import hashlib
+import json
+
+# ----------------------------------------------------------------------------
+# COA DATA DICT SCHEMA
+#
+# The Streamlit form, generate_pdf and every batch tool share this layout:
+# each base analyte is stored as "<prefix>_spec", "<prefix>_result" and
+# "<prefix>_method", and each section takes extra (param, spec, result, method)
+# rows from its "<section>_extra_rows" list.
+# ----------------------------------------------------------------------------
+
+# (section name, extra rows key, [(row label, key prefix), ...]) in print order
+SECTIONS = [
+    ("Physical", "physical_extra_rows", [
+        ("Description", "description"),
+        ("Identification", "identification"),
+        ("Loss on Drying", "loss_on_drying"),
+        ("Moisture", "moisture"),
+        ("Particle Size", "particle_size"),
+        ("Ash Contents", "ash_contents"),
+        ("Residue on Ignition", "residue_on_ignition"),
+        ("Bulk Density", "bulk_density"),
+        ("Tapped Density", "tapped_density"),
+        ("Solubility", "solubility"),
+        ("pH", "ph"),
+        ("Chlorides of NaCl", "chlorides_nacl"),
+        ("Sulphates", "sulphates"),
+        ("Fats", "fats"),
+        ("Protein", "protein"),
+        ("Total IgG", "total_ig_g"),
+        ("Sodium", "sodium"),
+        ("Gluten", "gluten"),
+    ]),
+    ("Others", "others_extra_rows", [
+        ("Lead", "lead"),
+        ("Cadmium", "cadmium"),
+        ("Arsenic", "arsenic"),
+        ("Mercury", "mercury"),
+    ]),
+    ("Assays", "assays_extra_rows", [
+        ("Assays", "assays"),
+    ]),
+    ("Pesticides", "pesticides_extra_rows", [
+        ("Pesticide", "pesticide"),
+    ]),
+    ("Residual Solvent", "residual_solvent_extra_rows", [
+        ("Residual Solvent", "residual_solvent"),
+    ]),
+    ("Microbiological Profile", "microbio_extra_rows", [
+        ("Total Plate Count", "total_plate_count"),
+        ("Yeasts & Mould Count", "yeasts_mould"),
+        ("Salmonella", "salmonella"),
+        ("Escherichia coli", "e_coli"),
+        ("Coliforms", "coliforms"),
+    ]),
+]
+
+# Key prefix of every base analyte, e.g. "moisture" for moisture_spec/_result/_method
+ANALYTE_PREFIXES = [prefix for _, _, base_rows in SECTIONS for _, prefix in base_rows]
+
+
+def section_rows(data, extra_key, base_rows):
+    """Printed rows of one section: filled-in base analytes, then the extra rows."""
+    rows = []
+    for label, prefix in base_rows:
+        spec = data[f"{prefix}_spec"]
+        result = data[f"{prefix}_result"]
+        method = data[f"{prefix}_method"]
+        if spec and result and method:
+            rows.append((label, spec, result, method))
+    return rows + [r for r in data.get(extra_key, []) if r]
+
+
+def spec_sections(data):
+    """Section name -> list of (parameter, specification, result, method) rows, in print order."""
+    return {
+        section_name: section_rows(data, extra_key, base_rows)
+        for section_name, extra_key, base_rows in SECTIONS
+    }
+
+
+def data_hash(data):
+    """Stable content hash of a COA data dict (tuples and lists hash the same)."""
+    payload = json.dumps(data, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
@@ -0,0 +1,147 @@
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from reportlab.lib.fonts import addMapping
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont, TTFError
+
+# ----------------------------------------------------------------------------
+# EMBEDDED UNICODE FONTS
+#
+# The base-14 fonts only cover WinAnsi (plus what ReportLab borrows from
+# Symbol), so a certificate with text outside it is set in TrueType stand-ins
+# for Times and Helvetica instead. Each font file is parsed once per process
+# when it is registered, and the glyph subsets embedded into each PDF are kept
+# per character set, so a batch of similar certificates subsets each font once.
+# ----------------------------------------------------------------------------
+FONT_DIRS = [
+    os.path.join(os.getcwd(), "fonts"),
+    "/usr/share/fonts/truetype/dejavu",
+    "/usr/share/fonts/dejavu",
+    "/usr/share/fonts/TTF",
+]
+
+# Base-14 face -> TrueType files to stand in for it, first one found wins
+TTF_SUBSTITUTES = {
+    "Times-Roman": ["CoaSerif.ttf", "DejaVuSerif.ttf"],
+    "Times-Bold": ["CoaSerif-Bold.ttf", "DejaVuSerif-Bold.ttf"],
+    "Times-Italic": ["CoaSerif-Italic.ttf", "DejaVuSerif-Italic.ttf", "DejaVuSerif.ttf"],
+    "Times-BoldItalic": ["CoaSerif-BoldItalic.ttf", "DejaVuSerif-BoldItalic.ttf", "DejaVuSerif-Bold.ttf"],
+    "Helvetica": ["CoaSans.ttf", "DejaVuSans.ttf"],
+    "Helvetica-Bold": ["CoaSans-Bold.ttf", "DejaVuSans-Bold.ttf"],
+    "Helvetica-Oblique": ["CoaSans-Oblique.ttf", "DejaVuSans-Oblique.ttf", "DejaVuSans.ttf"],
+    "Helvetica-BoldOblique": ["CoaSans-BoldOblique.ttf", "DejaVuSans-BoldOblique.ttf", "DejaVuSans-Bold.ttf"],
+}
+
+# Family -> (regular, bold, italic, bold italic), so <b> and <i> in Paragraphs keep working
+FONT_FAMILIES = {
+    "Times-Roman": ("Times-Roman", "Times-Bold", "Times-Italic", "Times-BoldItalic"),
+    "Helvetica": ("Helvetica", "Helvetica-Bold", "Helvetica-Oblique", "Helvetica-BoldOblique"),
+}
+
+TTF_PREFIX = "Coa-"
+
+# Subsets kept per font; a subset is the font program for one list of characters
+SUBSET_CACHE_SIZE = 512
+
+
+def _find_font_file(names):
+    for name in names:
+        for font_dir in FONT_DIRS:
+            path = os.path.join(font_dir, name)
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def _cache_subsets(font):
+    """Memoize the font's subset builder by character list.
+
+    makeSubset also reads the parsed font with a shared file position, so
+    render threads building different documents take turns through the lock.
+    """
+    make_subset = font.face.makeSubset
+    cache = OrderedDict()
+    lock = threading.Lock()
+
+    def cached_make_subset(subset):
+        key = tuple(subset)
+        with lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+            program = make_subset(subset)
+            cache[key] = program
+            if len(cache) > SUBSET_CACHE_SIZE:
+                cache.popitem(last=False)
+            return program
+
+    cached_make_subset.__wrapped__ = make_subset
+    font.face.makeSubset = cached_make_subset
+    return font
+
+
+@lru_cache(maxsize=None)
+def unicode_font_names():
+    """Base-14 name -> registered TrueType name, or None when the fonts are not installed.
+
+    Registration parses every font file once; the result is kept for the process.
+    """
+    names = {}
+    registered = {}  # font file -> registered name
+    for base_name, candidates in TTF_SUBSTITUTES.items():
+        path = _find_font_file(candidates)
+        if path is None:
+            return None
+        if path in registered:
+            # A face without its own file (e.g. no italic) is set in the one already parsed
+            names[base_name] = registered[path]
+            continue
+        names[base_name] = registered[path] = TTF_PREFIX + base_name
+        try:
+            pdfmetrics.registerFont(_cache_subsets(TTFont(names[base_name], path)))
+        except TTFError:
+            return None
+    for family in FONT_FAMILIES.values():
+        regular, bold, italic, bold_italic = (names[face] for face in family)
+        # Mapped plainest last, so a font standing in for several faces maps back to the plainest
+        addMapping(regular, 1, 1, bold_italic)
+        addMapping(regular, 0, 1, italic)
+        addMapping(regular, 1, 0, bold)
+        addMapping(regular, 0, 0, regular)
+    return names
+
+
+def coa_font(name, unicode_fonts=False):
+    """Font to set `name` (a base-14 face) in; its TrueType stand-in with unicode_fonts."""
+    if not unicode_fonts:
+        return name
+    return unicode_font_names()[name]
+
+
+def _base14_safe(text):
+    try:
+        text.encode("cp1252")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def _texts(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _texts(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _texts(item)
+
+
+def needs_unicode_fonts(data):
+    """True if some text of the data dict is outside WinAnsi and TrueType fonts are installed."""
+    if all(_base14_safe(text) for text in _texts(data)):
+        return False
+    return unicode_font_names() is not None
@@ -0,0 +1,144 @@
+from html import escape
+
+from coa_data import spec_sections
+from compliance import evaluate_sections, FAIL
+from coa_settings import coa_layout
+from pdf_generator import declaration_rows, product_info_rows, allergen_statement_of, markup_runs
+
+# ----------------------------------------------------------------------------
+# COA AS HTML
+#
+# The certificate body (everything but the logo and footer) with the same
+# tables, column widths, fonts and compliance shading as generate_pdf.
+# ----------------------------------------------------------------------------
+GRID_RULE = 0.5
+
+COA_CSS = """
+.coa { font-family: Times; font-size: 10pt; line-height: 12pt; margin: 0; }
+.coa p { margin: 0; }
+.coa .title { font-family: Times; font-weight: bold; font-size: 12pt; line-height: 12pt; text-align: center; }
+.coa .product-title { margin-bottom: 4pt; }
+.coa .declaration-title { font-family: Times; font-weight: bold; font-size: 10pt; text-align: center; margin-top: 2pt; }
+.coa table { border-collapse: collapse; }
+.coa td, .coa th { padding: 3pt 6pt; vertical-align: top; text-align: left; border: 0.5pt solid black; }
+.coa th { font-family: Helvetica; font-weight: bold; text-align: center; background-color: #d3d3d3; }
+.coa .label, .coa .section, .coa .end-remark { font-family: Helvetica; font-weight: bold; }
+.coa .method, .coa .end-remark { text-align: center; }
+.coa .fail { background-color: #ffcccc; }
+.coa .declaration td { border: none; padding: 0; }
+.coa .declaration .label { font-family: Helvetica; font-weight: normal; }
+"""
+
+
+def markup_html(text):
+    """Cell text as HTML: the inline tags and entities a Paragraph understands become
+    the matching HTML elements, everything else is escaped."""
+    text = str(text)
+    try:
+        runs = markup_runs(text)
+    except ValueError:
+        # Paragraph would reject it too; show it as typed
+        return escape(text)
+    parts = []
+    for run in runs:
+        if run.line_break:
+            parts.append("<br/>")
+            continue
+        html = escape(run.text)
+        for flag, tag in ((run.rise > 0, "sup"), (run.rise < 0, "sub"), (run.underline, "u"),
+                          (run.strike, "s"), (run.italic, "i"), (run.bold, "b")):
+            if flag:
+                html = f"<{tag}>{html}</{tag}>"
+        parts.append(html)
+    return "".join(parts)
+
+
+def _cell(text, css_class=None, width=None, colspan=None, tag="td"):
+    attrs = ""
+    if css_class:
+        attrs += f' class="{css_class}"'
+    if width is not None:
+        attrs += f' style="width: {width:g}pt"'
+    if colspan:
+        attrs += f' colspan="{colspan}"'
+    return f"<{tag}{attrs}>{markup_html(text)}</{tag}>"
+
+
+def _widths(col_widths, padding, rule=0.0):
+    # CSS widths exclude the cell padding and grid rule that Table colWidths include
+    return [width - 2 * padding - rule for width in col_widths]
+
+
+def coa_html(data, check_compliance=True):
+    """The certificate body as an HTML fragment, to be styled with COA_CSS."""
+    layout = coa_layout(data)
+    sections = spec_sections(data)
+    statuses = evaluate_sections(sections) if check_compliance else {}
+    complies = not any((section_statuses == FAIL).any() for section_statuses in statuses.values())
+
+    parts = ['<div class="coa">', '<p class="title">CERTIFICATE OF ANALYSIS</p>']
+    product_name = data.get('product_name', '').strip().upper()
+    parts.append(f'<p class="title product-title">{markup_html(product_name)}</p>')
+
+    product_rows = product_info_rows(data)
+    if product_rows:
+        label_width, value_width = _widths(layout.product_col_widths, 6, GRID_RULE)
+        parts.append('<table class="product">')
+        for label, value, italic, bold in product_rows:
+            value_html = markup_html(value)
+            if italic:
+                value_html = f"<i>{value_html}</i>"
+            if bold:
+                value_html = f"<b>{value_html}</b>"
+            parts.append(f'<tr>{_cell(label, "label", label_width)}'
+                         f'<td style="width: {value_width:g}pt">{value_html}</td></tr>')
+        parts.append("</table>")
+
+    spec_widths = _widths(layout.spec_col_widths, 6, GRID_RULE)
+    parts.append('<table class="spec"><tr>')
+    parts.extend(_cell(text, width=width, tag="th")
+                 for text, width in zip(["Parameter", "Specification", "Result", "Method"], spec_widths))
+    parts.append("</tr>")
+    for section_name, rows in sections.items():
+        if not rows:
+            continue
+        parts.append(f'<tr>{_cell(section_name, "section", colspan=4)}</tr>')
+        section_statuses = statuses.get(section_name)
+        for i, (param, spec, result, method) in enumerate(rows):
+            failed = section_statuses is not None and section_statuses[i] == FAIL
+            parts.append(
+                f"<tr>{_cell(param)}{_cell(spec)}{_cell(result, 'fail' if failed else None)}"
+                f"{_cell(method, 'method')}</tr>"
+            )
+    parts.append(f"<tr>{_cell(layout.remarks_text, colspan=4)}</tr>")
+    end_text = layout.complies_text if complies else layout.does_not_comply_text
+    parts.append(f'<tr>{_cell(end_text, "end-remark", colspan=4)}</tr>')
+    parts.append("</table>")
+
+    parts.append('<p class="declaration-title">Declaration</p>')
+    parts.append('<table class="declaration">')
+    widths = _widths(layout.declaration_col_widths, 0)
+    for label, value, label2, value2 in declaration_rows(allergen_statement_of(data, layout), layout):
+        parts.append(
+            f'<tr>{_cell(label, "label", widths[0])}{_cell(value, width=widths[1])}'
+            f'<td style="width: {widths[2]:g}pt"></td>'
+            f'{_cell(label2, "label", widths[3])}{_cell(value2, width=widths[4])}</tr>'
+        )
+    parts.append("</table>")
+    parts.append("</div>")
+    return "\n".join(parts)
+
+
+# Browser-only look for the live preview: a white sheet that scrolls sideways in a narrow
+# column, as wide as the spec table and its outer grid rules
+PREVIEW_CSS = """
+.coa-sheet { background: white; color: black; padding: 12pt; overflow-x: auto; border: 1px solid #ddd; }
+.coa-sheet .coa { width: %gpt; margin: 0 auto; }
+.coa-sheet .coa table { margin-left: auto; margin-right: auto; }
+"""
+
+
+def preview_html(data):
+    """Self-contained HTML (styles included) of the certificate body, for st.html."""
+    preview_css = PREVIEW_CSS % (coa_layout(data).spec_table_width + 2 * GRID_RULE)
+    return f'<style>{COA_CSS}{preview_css}</style><div class="coa-sheet">{coa_html(data)}</div>'
@@ -0,0 +1,238 @@
+"""Import issued COA PDFs back into data dicts.
+
+    python coa_import.py pdfs/*.pdf --out imported.ndjson [--archive] [--workers 4]
+
+Reads the product info table, the specification table (section by section) and
+the allergen statement of PDFs laid out by this tool, and writes one NDJSON line
+per file: {"source": path, "data": {...}} or {"source": path, "error": "..."}.
+The output file doubles as the journal: a re-run after a crash skips every file
+it already holds, so an interrupted import resumes where it stopped.
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+from coa_archive import CoaArchive, DEFAULT_ARCHIVE_PATH
+from coa_data import SECTIONS
+from pdf_generator import PRODUCT_INFO_FIELDS
+from pdf_reissue import grid_rules
+
+# Product info label -> data key
+PRODUCT_LABELS = {label: key for label, key, _, _ in PRODUCT_INFO_FIELDS}
+
+# Section name -> (extra rows key, {row label: key prefix})
+SECTION_SCHEMA = {
+    name: (extra_key, {label: prefix for label, prefix in base_rows})
+    for name, extra_key, base_rows in SECTIONS
+}
+
+SPEC_HEADER = ["Parameter", "Specification", "Result", "Method"]
+
+_MIN_ROW_HEIGHT = 2.0
+_RULE_TOLERANCE = 0.5
+
+
+class CoaImportError(ValueError):
+    pass
+
+
+def empty_data():
+    """A data dict with every key the renderers read, all blank."""
+    data = {key: "" for _, key, _, _ in PRODUCT_INFO_FIELDS}
+    for _, extra_key, base_rows in SECTIONS:
+        for _, prefix in base_rows:
+            data[f"{prefix}_spec"] = data[f"{prefix}_result"] = data[f"{prefix}_method"] = ""
+        data[extra_key] = []
+    data["allergen_statement"] = ""
+    data["product_additional_rows"] = []
+    return data
+
+
+def _dedupe(values):
+    result = []
+    for value in sorted(values):
+        if not result or value - result[-1] > _RULE_TOLERANCE:
+            result.append(value)
+    return result
+
+
+def text_lines(page):
+    """(bbox, text) of every non-blank text line on the page, ligatures expanded."""
+    flags = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_LIGATURES
+    lines = []
+    for block in page.get_text("dict", flags=flags)["blocks"]:
+        for line in block.get("lines", []):
+            text = "".join(span["text"] for span in line["spans"]).strip()
+            if text:
+                lines.append((fitz.Rect(line["bbox"]), text))
+    return lines
+
+
+def table_rows(page, lines):
+    """Text of every ruled table row on the page, top to bottom, as a list of cell strings.
+
+    Rows are the bands between consecutive horizontal rules; cells are split by the
+    vertical rules crossing the middle of the band, so a spanned row is a single cell.
+    """
+    vertical, horizontal = grid_rules(page)
+
+    rows = []
+    edges = _dedupe(y for y, _, _ in horizontal)
+    for top, bottom in zip(edges, edges[1:]):
+        if bottom - top < _MIN_ROW_HEIGHT:
+            continue
+        middle = (top + bottom) / 2
+        xs = _dedupe(x for x, y0, y1 in vertical if y0 <= middle <= y1)
+        if len(xs) < 2:
+            continue
+        cells = [[] for _ in xs[1:]]
+        for rect, text in lines:
+            cx, cy = (rect.x0 + rect.x1) / 2, (rect.y0 + rect.y1) / 2
+            if top <= cy <= bottom and xs[0] <= cx <= xs[-1]:
+                column = max(i for i, x in enumerate(xs[:-1]) if x <= cx)
+                cells[column].append((rect.y0, rect.x0, text))
+        if any(cells):
+            rows.append([" ".join(text for _, _, text in sorted(cell)) for cell in cells])
+    return rows
+
+
+def _allergen_statement(lines):
+    labels = {text: rect for rect, text in lines if text in ("Allergen statement:", "Storage condition:")}
+    label = labels.get("Allergen statement:")
+    if label is None:
+        return ""
+    # The value column starts right of the label; it may wrap down to the next label
+    bottom = labels["Storage condition:"].y0 if "Storage condition:" in labels else label.y1
+    value = [
+        (rect.y0, text) for rect, text in lines
+        if rect.x0 > label.x1 and label.y0 - 1 <= rect.y0 < bottom - 1
+    ]
+    return " ".join(text for _, text in sorted(value))
+
+
+def parse_coa(pdf_bytes):
+    """Data dict of a COA PDF laid out by this tool."""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        if not doc.page_count:
+            raise CoaImportError("empty document")
+        page = doc[0]
+        lines = text_lines(page)
+        rows = table_rows(page, lines)
+        allergen_statement = _allergen_statement(lines)
+
+    data = empty_data()
+    data["allergen_statement"] = allergen_statement
+    additional = []
+    section = None
+    seen_header = False
+    for cells in rows:
+        if len(cells) == 2 and not seen_header:
+            label, value = cells
+            key = PRODUCT_LABELS.get(label)
+            if key is None:
+                additional.append((label, value))
+            else:
+                data[key] = value
+        elif len(cells) == 4:
+            if cells == SPEC_HEADER:
+                seen_header = True
+                continue
+            if section is None:
+                raise CoaImportError(f"spec row outside any section: {cells[0]!r}")
+            extra_key, base_prefixes = SECTION_SCHEMA[section]
+            prefix = base_prefixes.get(cells[0])
+            if prefix is not None and all(cells[1:]) and not data[f"{prefix}_spec"]:
+                data[f"{prefix}_spec"], data[f"{prefix}_result"], data[f"{prefix}_method"] = cells[1:]
+            else:
+                data[extra_key].append(tuple(cells))
+        elif len(cells) == 1 and cells[0] in SECTION_SCHEMA:
+            section = cells[0]
+        # Any other single-cell row is one of the fixed remarks
+    if not seen_header:
+        raise CoaImportError("no specification table found")
+    data["product_additional_rows"] = additional
+    return data
+
+
+def import_file(path):
+    """Worker: the journal record of one PDF."""
+    try:
+        with open(path, "rb") as f:
+            return {"source": path, "data": parse_coa(f.read())}
+    except Exception as exc:  # recorded in the journal, the import carries on
+        return {"source": path, "error": f"{type(exc).__name__}: {exc}"}
+
+
+def read_journal(path):
+    """Sources already recorded in the output file; drops a torn last line left by a crash."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    good_size = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            done.add(record["source"])
+            good_size += len(line)
+    if good_size != os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(good_size)
+    return done
+
+
+def run(paths, out_path, workers=None, archive=None, retry_errors=False):
+    """Import every PDF of `paths` not yet journalled in `out_path`; returns (imported, failed, skipped)."""
+    done = read_journal(out_path)
+    if retry_errors:
+        done = {record["source"] for record in iter_journal(out_path) if "data" in record}
+    todo = [path for path in paths if path not in done]
+    imported = failed = 0
+    with open(out_path, "a", encoding="utf-8") as out, ProcessPoolExecutor(max_workers=workers) as pool:
+        for record in pool.map(import_file, todo, chunksize=8):
+            if "data" in record:
+                if archive is not None:
+                    archive.add(record["data"])
+                imported += 1
+            else:
+                failed += 1
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+    return imported, failed, len(paths) - len(todo)
+
+
+def iter_journal(path):
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdfs", nargs="+")
+    parser.add_argument("--out", required=True, help="NDJSON output, also the resume journal")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--archive", nargs="?", const=DEFAULT_ARCHIVE_PATH, default=None,
+                        help="also store imported COAs in the archive (default path if no value)")
+    parser.add_argument("--retry-errors", action="store_true", help="re-import files that failed before")
+    args = parser.parse_args(argv)
+
+    archive = CoaArchive(args.archive) if args.archive else None
+    imported, failed, skipped = run(args.pdfs, args.out, args.workers, archive, args.retry_errors)
+    print(f"{imported} imported, {failed} failed, {skipped} already done", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
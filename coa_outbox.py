@@ -0,0 +1,484 @@
+"""Send queued COA emails over pooled SMTP connections.
+
+    python coa_outbox.py send --smtp-host mail.example.com [--loop] [--batch-size 50]
+    python coa_outbox.py status
+    python coa_outbox.py retry-failed
+
+The app queues a COA PDF with its recipients in the outbox (an SQLite file);
+this command, or the dispatcher thread the app starts when smtp_host is set,
+sends whatever is due. Messages go out in batches, one batch per pooled
+connection, and a connection is reused for the next batch. A message that
+fails with a temporary error is retried with exponential backoff; one that
+the server rejects outright (5xx), or that has used up its attempts, is
+marked failed. Recipients the server refuses are kept on the message: a
+temporary refusal (4xx) is retried for those recipients only, a permanent
+one marks the message failed. Each message's outcome is stored as soon as
+it is sent, the queue survives restarts, and a message claimed by a
+dispatcher that died is sent again once its lease runs out.
+"""
+import argparse
+import datetime
+import json
+import os
+import queue
+import random
+import smtplib
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+from coa_settings import VAR_DIR
+
+DEFAULT_OUTBOX_PATH = os.path.join(VAR_DIR, "coa_outbox.sqlite3")
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+MAX_ATTEMPTS = 8
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+# A claimed message not reported back within this long is handed out again
+LEASE_SECONDS = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    recipients TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    pdf BLOB NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    sent_at TEXT,
+    delivered TEXT NOT NULL DEFAULT '[]',
+    refused TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+# Columns added after the first release, with their definitions, for outboxes created before
+ADDED_COLUMNS = {
+    "delivered": "TEXT NOT NULL DEFAULT '[]'",
+    "refused": "TEXT NOT NULL DEFAULT '{}'",
+}
+
+
+def retry_delay(attempts):
+    """Seconds to wait after the given number of failed attempts: doubling, capped, jittered."""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class OutboxMessage:
+    """A claimed message; `recipients` are only the addresses still to be sent to."""
+
+    def __init__(self, msg_id, sender, recipients, subject, body, file_name, pdf, attempts,
+                 delivered=(), refused=None):
+        self.msg_id = msg_id
+        self.sender = sender
+        self.recipients = recipients
+        self.subject = subject
+        self.body = body
+        self.file_name = file_name
+        self.pdf = pdf
+        self.attempts = attempts
+        self.delivered = list(delivered)
+        self.refused = dict(refused or {})
+
+    def email(self):
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = ", ".join(self.recipients)
+        message["Subject"] = self.subject
+        message.set_content(self.body)
+        message.add_attachment(self.pdf, maintype="application", subtype="pdf", filename=self.file_name)
+        return message
+
+
+class Outbox:
+    """Persistent queue of COA emails."""
+
+    def __init__(self, path=DEFAULT_OUTBOX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+            for column, definition in ADDED_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} {definition}")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def enqueue(self, pdf, recipients, subject, body="", file_name="COA.pdf", sender=""):
+        """Queue one email with the PDF attached; returns its id."""
+        recipients = [r.strip() for r in recipients if r.strip()]
+        if not recipients:
+            raise ValueError("no recipients")
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO outbox (created_at, sender, recipients, subject, body, file_name, pdf, status,"
+                " next_attempt_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (datetime.datetime.now().isoformat(timespec="seconds"), sender, json.dumps(recipients),
+                 subject, body, file_name, bytes(pdf), PENDING, time.time()),
+            )
+            return cursor.lastrowid
+
+    def claim(self, limit, lease=LEASE_SECONDS):
+        """Up to `limit` due messages, oldest first, leased to the caller for `lease` seconds.
+
+        A message is claimed for its recipients that have neither received it nor
+        permanently refused it.
+        """
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, sender, recipients, subject, body, file_name, pdf, attempts, delivered, refused"
+                " FROM outbox WHERE status IN (?, ?) AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (PENDING, SENDING, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET status = ?, next_attempt_at = ? WHERE id = ?",
+                [(SENDING, now + lease, row[0]) for row in rows],
+            )
+        messages = []
+        for msg_id, sender, recipients, subject, body, file_name, pdf, attempts, delivered, refused in rows:
+            delivered, refused = json.loads(delivered), json.loads(refused)
+            to_send = [r for r in json.loads(recipients)
+                       if r not in delivered and not (r in refused and refused[r][0] >= 500)]
+            messages.append(OutboxMessage(msg_id, sender, to_send, subject, body, file_name, pdf, attempts,
+                                          delivered, refused))
+        return messages
+
+    def record(self, outcomes):
+        """Store the outcome of claimed messages: (message, error or None, permanent, refused) each.
+
+        `refused` maps the recipients the server refused to (code, reason); with no error,
+        every other recipient received the message.
+        """
+        now = time.time()
+        sent_at = datetime.datetime.now().isoformat(timespec="seconds")
+        updates = []
+        for message, error, permanent, refused in outcomes:
+            attempts = message.attempts + 1
+            delivered = list(message.delivered)
+            if error is None:
+                delivered += [r for r in message.recipients if r not in refused]
+            # Permanent refusals stay on the message; temporary ones only until the next attempt
+            all_refused = {r: reason for r, reason in message.refused.items() if reason[0] >= 500}
+            all_refused.update((r, [code, _text(reason)]) for r, (code, reason) in refused.items())
+            if error is None and all_refused:
+                error = "refused " + ", ".join(f"{r} ({code} {reason})" for r, (code, reason) in all_refused.items())
+                permanent = all(code >= 500 for code, _ in all_refused.values())
+            if error is None:
+                status, next_attempt_at = SENT, now
+            elif permanent or attempts >= MAX_ATTEMPTS:
+                status, next_attempt_at = FAILED, now
+            else:
+                status, next_attempt_at = PENDING, now + retry_delay(attempts)
+            updates.append((status, attempts, next_attempt_at, error, sent_at if delivered else None,
+                            json.dumps(delivered), json.dumps(all_refused), message.msg_id))
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?,"
+                " sent_at = COALESCE(sent_at, ?), delivered = ?, refused = ? WHERE id = ?",
+                updates,
+            )
+
+    def retry_failed(self):
+        """Put every failed message back in the queue with fresh attempts, for every recipient
+        that has not received it yet; returns how many."""
+        with self._lock, self._connect() as conn:
+            return conn.execute(
+                "UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = ?, refused = '{}' WHERE status = ?",
+                (PENDING, time.time(), FAILED),
+            ).rowcount
+
+    def counts(self):
+        """Messages per status."""
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status"))
+
+    def failures(self, limit=20):
+        """(id, recipients, subject, last_error) of the latest failed messages."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, recipients, subject, last_error FROM outbox WHERE status = ? ORDER BY id DESC LIMIT ?",
+                (FAILED, limit),
+            ).fetchall()
+        return [(msg_id, json.loads(recipients), subject, error) for msg_id, recipients, subject, error in rows]
+
+
+# ----------------------------------------------------------------------------
+# SMTP CONNECTION POOL
+#
+# Logging in costs a TLS handshake and several round trips, so connections
+# are kept and handed to the next batch. An idle connection is checked with
+# NOOP before it is reused, since servers drop them after a few minutes, and
+# one is retired after max_messages, the usual per-connection server limit.
+# ----------------------------------------------------------------------------
+class SmtpPool:
+    def __init__(self, host, port=25, username=None, password=None, starttls=False, size=4,
+                 timeout=30, max_messages=100, check_after=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.size = size
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.check_after = check_after
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def _open(self):
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                conn.starttls()
+            if self.username:
+                conn.login(self.username, self.password or "")
+        except Exception:
+            conn.close()
+            raise
+        with self._lock:
+            self.opened += 1
+        conn.coa_sent = 0
+        return conn
+
+    def get(self):
+        """A live connection: an idle one from the pool if it still answers, else a new one."""
+        while True:
+            try:
+                conn, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                return self._open()
+            if time.monotonic() - idle_since < self.check_after:
+                return conn
+            try:
+                if conn.noop()[0] == 250:
+                    return conn
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.discard(conn)
+
+    def put(self, conn):
+        """Return a healthy connection for reuse."""
+        if conn.coa_sent >= self.max_messages or self._idle.qsize() >= self.size:
+            self._quit(conn)
+        else:
+            self._idle.put((conn, time.monotonic()))
+
+    def discard(self, conn):
+        """Drop a connection after an error."""
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    def _quit(self, conn):
+        try:
+            conn.quit()
+        except (smtplib.SMTPException, OSError):
+            self.discard(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._quit(conn)
+
+
+def _is_permanent(exc):
+    """True for errors retrying won't fix: the server answered 5xx."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code >= 500 and not isinstance(exc, smtplib.SMTPAuthenticationError)
+    return False
+
+
+def _describe(exc):
+    return f"{type(exc).__name__}: {exc}"
+
+
+def _text(reason):
+    # smtplib hands server replies over as bytes
+    return reason.decode("utf-8", "replace") if isinstance(reason, bytes) else str(reason)
+
+
+# ----------------------------------------------------------------------------
+# DISPATCHER
+# ----------------------------------------------------------------------------
+class OutboxDispatcher:
+    def __init__(self, outbox, pool, batch_size=50, default_sender=""):
+        self.outbox = outbox
+        self.pool = pool
+        self.batch_size = batch_size
+        self.default_sender = default_sender
+        self._executor = ThreadPoolExecutor(max_workers=pool.size, thread_name_prefix="coa-outbox")
+        self._stop = threading.Event()
+        self._thread = None
+
+    def send_batch(self, messages):
+        """Send messages over one pooled connection, storing each outcome in the outbox as soon as
+        it is known; returns (message, error, permanent, refused) per message (see Outbox.record)."""
+        outcomes = []
+
+        def done(*new_outcomes):
+            # Recorded per message, so a crash mid-batch re-sends at most the message in flight
+            self.outbox.record(new_outcomes)
+            outcomes.extend(new_outcomes)
+
+        conn = None
+        for i, message in enumerate(messages):
+            try:
+                email = message.email()
+                if not email["From"]:
+                    email.replace_header("From", self.default_sender)
+            except Exception as exc:
+                # A header that can't be encoded (e.g. a linefeed in the subject) never will be
+                done((message, _describe(exc), True, {}))
+                continue
+            if conn is None:
+                try:
+                    conn = self.pool.get()
+                except (smtplib.SMTPException, OSError) as exc:
+                    # No connection: nothing else in this batch can go out either
+                    done(*((m, _describe(exc), _is_permanent(exc), {}) for m in messages[i:]))
+                    return outcomes
+            try:
+                refused = conn.send_message(email, to_addrs=message.recipients)
+                conn.coa_sent += 1
+                done((message, None, False, refused))
+            except smtplib.SMTPRecipientsRefused as exc:
+                # Every recipient refused: kept on the message like a partial refusal
+                done((message, None, False, exc.recipients))
+                try:
+                    conn.rset()
+                except (smtplib.SMTPException, OSError):
+                    self.pool.discard(conn)
+                    conn = None
+            except (smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as exc:
+                # The server answered, so the connection is still good once reset
+                done((message, _describe(exc), _is_permanent(exc), {}))
+                try:
+                    conn.rset()
+                except (smtplib.SMTPException, OSError):
+                    self.pool.discard(conn)
+                    conn = None
+            except Exception as exc:
+                # SMTP or socket errors, or anything else send_message raised mid-transaction;
+                # the connection's state is unknown, so it is not reused
+                done((message, _describe(exc), _is_permanent(exc), {}))
+                self.pool.discard(conn)
+                conn = None
+        if conn is not None:
+            self.pool.put(conn)
+        return outcomes
+
+    def dispatch_once(self, limit=None):
+        """Send every due message, at most `limit`; returns (sent, failed or deferred)."""
+        limit = limit or self.batch_size * self.pool.size
+        sent = failed = 0
+        while True:
+            messages = self.outbox.claim(limit)
+            if not messages:
+                return sent, failed
+            batches = [messages[i:i + self.batch_size] for i in range(0, len(messages), self.batch_size)]
+            for outcomes in self._executor.map(self.send_batch, batches):
+                for _, error, _, refused in outcomes:
+                    if error is None and not refused:
+                        sent += 1
+                    else:
+                        failed += 1
+
+    def run(self, interval=10.0, log=sys.stderr):
+        while not self._stop.is_set():
+            try:
+                sent, failed = self.dispatch_once()
+            except Exception as exc:
+                # Claimed messages go back in the queue when their lease runs out
+                print(f"outbox: {_describe(exc)}", file=log)
+            else:
+                if sent or failed:
+                    print(f"outbox: {sent} sent, {failed} failed or deferred", file=log)
+            self._stop.wait(interval)
+
+    def start(self, interval=10.0):
+        """Dispatch in a background thread until stop()."""
+        self._thread = threading.Thread(target=self.run, args=(interval,), name="coa-outbox-dispatch", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._executor.shutdown()
+        self.pool.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["send", "status", "retry-failed"])
+    parser.add_argument("--outbox", default=DEFAULT_OUTBOX_PATH)
+    parser.add_argument("--smtp-host", default=os.environ.get("COA_SMTP_HOST", "localhost"))
+    parser.add_argument("--smtp-port", type=int, default=int(os.environ.get("COA_SMTP_PORT", 25)))
+    parser.add_argument("--smtp-user", default=os.environ.get("COA_SMTP_USER"))
+    parser.add_argument("--starttls", action="store_true")
+    parser.add_argument("--sender", default=os.environ.get("COA_SMTP_SENDER", ""),
+                        help="From address for messages queued without one")
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--loop", action="store_true", help="keep sending every --interval seconds")
+    parser.add_argument("--interval", type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    outbox = Outbox(args.outbox)
+    if args.command == "status":
+        for status, count in sorted(outbox.counts().items()):
+            print(f"{status:8} {count}")
+        for msg_id, recipients, subject, error in outbox.failures():
+            print(f"failed #{msg_id} to {', '.join(recipients)}: {subject} ({error})")
+        return 0
+    if args.command == "retry-failed":
+        print(f"{outbox.retry_failed()} message(s) queued again")
+        return 0
+
+    # The password comes from the environment only, so it never shows up in `ps`
+    pool = SmtpPool(args.smtp_host, args.smtp_port, args.smtp_user, os.environ.get("COA_SMTP_PASSWORD"),
+                    args.starttls, size=args.connections)
+    dispatcher = OutboxDispatcher(outbox, pool, args.batch_size, args.sender)
+    try:
+        if args.loop:
+            dispatcher.run(args.interval)
+            return 0
+        sent, failed = dispatcher.dispatch_once()
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        dispatcher.stop()
+    print(f"{sent} sent, {failed} failed or deferred over {pool.opened} connection(s)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
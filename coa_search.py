@@ -0,0 +1,121 @@
+import re
+import threading
+from array import array
+
+import numpy as np
+
+# Product-info fields of the data dict that are searchable, as rendered by generate_pdf
+SEARCH_FIELDS = ["product_name", "botanical_name", "cas_no", "chemical_name", "product_code", "batch_no"]
+
+_TOKEN_RE = re.compile(r"[0-9a-z]+")
+
+
+def trigrams(text):
+    """pg_trgm-style trigrams: each lowercase alphanumeric word padded as '  word '."""
+    grams = set()
+    for token in _TOKEN_RE.findall(text.lower()):
+        padded = f"  {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _append_postings(index, grams, position):
+    for gram in grams:
+        postings = index.get(gram)
+        if postings is None:
+            postings = index[gram] = array("i")
+        postings.append(position)
+
+
+def _hit_counts(index, grams, n_docs):
+    lists = [np.frombuffer(index[g], dtype=np.int32) for g in grams if g in index]
+    if not lists:
+        return np.zeros(n_docs, dtype=np.int64)
+    return np.bincount(np.concatenate(lists), minlength=n_docs)
+
+
+class SearchHit:
+    def __init__(self, cert_id, issued_at, fields, score):
+        self.cert_id = cert_id
+        self.issued_at = issued_at
+        self.fields = fields
+        self.score = score
+
+
+class CoaSearchIndex:
+    """In-memory trigram inverted index over the product-info fields of archived COAs.
+
+    Postings are append-only int32 arrays of document positions, scored per query with
+    a single numpy bincount, so a lookup costs the length of the query's postings lists
+    rather than a scan of every certificate.
+    """
+
+    def __init__(self, archive=None):
+        self.archive = archive
+        self._lock = threading.Lock()
+        # Held for a whole refresh, so concurrent refreshes can't read the same _last_id
+        # and index a certificate twice; searches only wait on _lock
+        self._refresh_lock = threading.Lock()
+        self._postings = {}
+        self._name_postings = {}
+        self._cert_ids = []
+        self._issued_at = []
+        self._fields = []
+        self._last_id = 0
+
+    def __len__(self):
+        return len(self._cert_ids)
+
+    def add(self, cert_id, issued_at, data):
+        fields = {name: str(data.get(name, "") or "") for name in SEARCH_FIELDS}
+        grams = set()
+        for value in fields.values():
+            grams |= trigrams(value)
+        with self._lock:
+            position = len(self._cert_ids)
+            _append_postings(self._postings, grams, position)
+            _append_postings(self._name_postings, trigrams(fields["product_name"]), position)
+            self._cert_ids.append(cert_id)
+            self._issued_at.append(issued_at)
+            self._fields.append(fields)
+            self._last_id = max(self._last_id, cert_id)
+
+    def refresh(self):
+        """Index certificates archived since the last refresh (also by other processes)."""
+        if self.archive is None:
+            return 0
+        added = 0
+        with self._refresh_lock:
+            for cert_id, issued_at, data in self.archive.iter_certificates(after_id=self._last_id):
+                self.add(cert_id, issued_at, data)
+                added += 1
+        return added
+
+    def search(self, query, limit=20, min_score=0.5):
+        """Best matches for `query`, highest similarity first and newest first among equals."""
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        with self._lock:
+            n_docs = len(self._cert_ids)
+            if not n_docs:
+                return []
+            shared = _hit_counts(self._postings, query_grams, n_docs)
+            candidates = np.flatnonzero(shared)
+            # Share of the query's trigrams found in the certificate (pg_trgm word_similarity),
+            # so a short query is not penalised for the other product-info fields; matches
+            # inside the product name itself weigh a little extra
+            name_shared = _hit_counts(self._name_postings, query_grams, n_docs)[candidates]
+            score = (0.9 * shared[candidates] + 0.1 * name_shared) / len(query_grams)
+            keep = score >= min_score
+            candidates, score = candidates[keep], score[keep]
+            # Rank by score, then by archive position so the newest certificate wins a tie
+            rank = np.floor(score * 1e6).astype(np.int64) * (n_docs + 1) + candidates
+            if len(rank) > limit:
+                top = np.argpartition(-rank, limit - 1)[:limit]
+                candidates, score, rank = candidates[top], score[top], rank[top]
+            order = np.argsort(-rank)
+            return [
+                SearchHit(self._cert_ids[i], self._issued_at[i], self._fields[i], float(s))
+                for i, s in zip(candidates[order].tolist(), score[order].tolist())
+            ]
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+import tomllib
+from collections import namedtuple
+
+# ----------------------------------------------------------------------------
+# CACHED SETTINGS
+#
+# .streamlit/config.toml is parsed as TOML once per process and kept; every
+# CHECK_SECONDS at most, a lookup stats the file and parses it again if its
+# modification time or size changed, so a Streamlit rerun does no file I/O.
+# A file that fails to parse on reload is reported and the last good
+# settings stay in use.
+#
+#   [settings]                      app options (theme, admin_key, smtp_host, ...)
+#   [coa]                           certificate layout and declaration defaults
+#   [coa.products.<product code>]   overrides of [coa] for one product
+# ----------------------------------------------------------------------------
+DEFAULT_CONFIG_PATH = os.path.join(os.getcwd(), ".streamlit", "config.toml")
+CHECK_SECONDS = 2.0
+
+# Runtime state (archive, analytics, outbox, spill files, caches) lives here;
+# COA_VAR_DIR moves it elsewhere, e.g. to a scratch directory for a load test
+VAR_DIR = os.environ.get("COA_VAR_DIR") or os.path.join(os.getcwd(), "var")
+
+# Layout and declaration values of a certificate, [coa] key -> default
+LAYOUT_DEFAULTS = {
+    "product_col_widths": (140, 360),
+    "spec_table_width": 500,
+    "spec_col_ratios": (0.23, 0.39, 0.18, 0.20),
+    "declaration_col_widths": (80, 150, 75, 100, 95),
+    "remarks_text": ("Since the product is derived from natural origin, there is likely to be minor color "
+                     "variation because of the geographical and seasonal variations of the raw material"),
+    "complies_text": "REMARKS: COMPLIES WITH IN HOUSE SPECIFICATIONS",
+    "does_not_comply_text": "REMARKS: DOES NOT COMPLY WITH IN HOUSE SPECIFICATIONS",
+    "gmo_status": "Free from GMO",
+    "irradiation_status": "Non – Irradiated",
+    "storage_condition": "At room temperature",
+    "prepared_by": "Executive – QC",
+    "approved_by": "Head-QC/QA",
+    "allergen_statement": "Free from allergen",
+}
+
+# The allergen statements the app offers; [coa] allergen_statement must be one of them
+ALLERGEN_STATEMENTS = ("Free from allergen", "Contains Allergen")
+
+# Column count of each width list
+_COLUMN_COUNTS = {"product_col_widths": 2, "spec_col_ratios": 4, "declaration_col_widths": 5}
+
+# Hashable, so renderers can key their caches on it
+CoaLayout = namedtuple("CoaLayout", [*LAYOUT_DEFAULTS, "spec_col_widths"])
+
+
+class SettingsError(ValueError):
+    pass
+
+
+def make_layout(values):
+    """CoaLayout of [coa]-style values (missing keys take their defaults)."""
+    unknown = set(values) - set(LAYOUT_DEFAULTS)
+    if unknown:
+        raise SettingsError(f"unknown [coa] setting(s): {', '.join(sorted(unknown))}")
+    fields = dict(LAYOUT_DEFAULTS)
+    for key, value in values.items():
+        default = LAYOUT_DEFAULTS[key]
+        if isinstance(default, tuple):
+            if not isinstance(value, list) or len(value) != _COLUMN_COUNTS[key] or \
+                    not all(isinstance(v, (int, float)) and v > 0 for v in value):
+                raise SettingsError(f"{key} must be a list of {_COLUMN_COUNTS[key]} positive numbers")
+            value = tuple(value)
+        elif not isinstance(value, type(default)) and not (isinstance(default, int) and isinstance(value, float)):
+            raise SettingsError(f"{key} must be a {type(default).__name__}")
+        fields[key] = value
+    if fields["allergen_statement"] not in ALLERGEN_STATEMENTS:
+        raise SettingsError(f"allergen_statement must be one of: {', '.join(ALLERGEN_STATEMENTS)}")
+    width = fields["spec_table_width"]
+    fields["spec_col_widths"] = tuple(width * ratio for ratio in fields["spec_col_ratios"])
+    return CoaLayout(**fields)
+
+
+DEFAULT_LAYOUT = make_layout({})
+
+
+class Settings:
+    """One parse of the config file."""
+
+    def __init__(self, values=None):
+        values = values or {}
+        self.app = values.get("settings", {})
+        coa = dict(values.get("coa", {}))
+        products = coa.pop("products", {})
+        # Built up front, so a bad value is reported when the file is loaded, not mid-render
+        self.layout_default = make_layout(coa)
+        self.layouts = {str(code): make_layout({**coa, **overrides}) for code, overrides in products.items()}
+
+    def get(self, key, default=None):
+        """A value of the [settings] table."""
+        return self.app.get(key, default)
+
+    def layout(self, product_code=None):
+        """CoaLayout of a product: [coa] with its [coa.products.<code>] overrides applied."""
+        return self.layouts.get(str(product_code or "").strip(), self.layout_default)
+
+
+def load_settings(path):
+    try:
+        with open(path, "rb") as f:
+            return Settings(tomllib.load(f))
+    except FileNotFoundError:
+        return Settings()
+
+
+class _CachedSettings:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.signature = None
+        self.checked_at = None
+        self.settings = None
+
+    def current(self):
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < CHECK_SECONDS:
+            return self.settings
+        with self.lock:
+            if self.checked_at is not None and now - self.checked_at < CHECK_SECONDS:
+                return self.settings
+            try:
+                stat = os.stat(self.path)
+                signature = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                signature = None
+            if self.settings is None or signature != self.signature:
+                try:
+                    self.settings = load_settings(self.path)
+                except (OSError, tomllib.TOMLDecodeError, SettingsError) as exc:
+                    if self.settings is None:
+                        raise
+                    print(f"{self.path}: {exc}; keeping the previous settings", file=sys.stderr)
+                self.signature = signature
+            self.checked_at = now
+            return self.settings
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_settings(path=DEFAULT_CONFIG_PATH):
+    """Settings of the config file at path, parsed again only after it changes."""
+    cached = _cache.get(path)
+    if cached is None:
+        with _cache_lock:
+            cached = _cache.setdefault(path, _CachedSettings(path))
+    return cached.current()
+
+
+def coa_layout(data):
+    """CoaLayout of a certificate's data dict, by its product code."""
+    return get_settings().layout(data.get("product_code"))
+
+
+def layout_digest(data):
+    """Short digest of the [coa] layout a certificate is rendered with, for cache and output keys.
+
+    The same data renders differently once the layout in the settings changes, so
+    anything keyed on the data hash alone would serve the old certificate.
+    """
+    return hashlib.sha256(repr(coa_layout(data)).encode("utf-8")).hexdigest()[:16]
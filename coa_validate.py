@@ -0,0 +1,144 @@
+import re
+from collections import namedtuple
+
+from coa_data import SECTIONS
+from pdf_generator import PRODUCT_INFO_FIELDS
+
+# ----------------------------------------------------------------------------
+# DATA DICT VALIDATION
+#
+# Every data dict of a batch is checked up front, so a missing key, a wrong
+# type or text that would break Paragraph markup is reported before any
+# rendering starts instead of failing halfway through a batch.
+# ----------------------------------------------------------------------------
+Problem = namedtuple("Problem", "index key message")
+
+# Longest accepted text per kind of value
+MAX_TITLE_LENGTH = 120
+MAX_FIELD_LENGTH = 300
+MAX_CELL_LENGTH = 500
+
+# Inline tags a value may use on purpose, e.g. <i> in a chemical name
+ALLOWED_TAGS = {"b", "i", "u", "strike", "sub", "sup", "super", "em", "strong", "br"}
+VOID_TAGS = {"br"}
+
+# A '<' followed by a letter, '/', '!' or '?' is parsed as a tag ("<10 cfu/g" and
+# "USP<62>" print as typed); an '&' followed by a letter or '#' as an entity
+_TAG_START_RE = re.compile(r"<(?=[A-Za-z/!?])")
+_TAG_RE = re.compile(r"<(/?)([A-Za-z][A-Za-z0-9]*)\s*(/?)>")
+_ENTITY_START_RE = re.compile(r"&(?=[A-Za-z#])")
+_ENTITY_RE = re.compile(r"&(?:[A-Za-z][A-Za-z0-9]*|#[0-9]+|#x[0-9A-Fa-f]+);")
+
+
+class DataValidationError(ValueError):
+    def __init__(self, problems):
+        self.problems = problems
+        lines = [f"#{p.index} {p.key}: {p.message}" if p.index is not None else f"{p.key}: {p.message}"
+                 for p in problems]
+        super().__init__(f"{len(problems)} problem(s) in COA data:\n" + "\n".join(lines))
+
+
+def markup_problem(text):
+    """Why `text` is not safe as Paragraph markup, or None."""
+    if "<" not in text and "&" not in text:
+        return None
+    open_tags = []
+    for match in _TAG_START_RE.finditer(text):
+        tag = _TAG_RE.match(text, match.start())
+        if tag is None or tag.group(2).lower() not in ALLOWED_TAGS:
+            snippet = text[match.start():match.start() + 12]
+            return f"stray '<' in {snippet!r}; escape it as &lt;"
+        closing, name, self_closing = tag.group(1), tag.group(2).lower(), tag.group(3)
+        if name in VOID_TAGS or self_closing:
+            continue
+        if not closing:
+            open_tags.append(name)
+        elif not open_tags or open_tags.pop() != name:
+            return f"</{name}> does not close the open tag"
+    if open_tags:
+        return f"<{open_tags[-1]}> is never closed"
+    for match in _ENTITY_START_RE.finditer(text):
+        if not _ENTITY_RE.match(text, match.start()):
+            snippet = text[match.start():match.start() + 12]
+            return f"stray '&' in {snippet!r}; escape it as &amp;"
+    return None
+
+
+def _check_text(problems, index, key, value, max_length, required):
+    if value is None:
+        if required:
+            problems.append(Problem(index, key, "is missing"))
+        return
+    if not isinstance(value, str):
+        problems.append(Problem(index, key, f"must be text, not {type(value).__name__}"))
+        return
+    if len(value) > max_length:
+        problems.append(Problem(index, key, f"is {len(value)} characters long (limit {max_length})"))
+    reason = markup_problem(value)
+    if reason:
+        problems.append(Problem(index, key, reason))
+
+
+def _check_rows(problems, index, key, rows, width, max_length):
+    if rows is None:
+        return
+    if not isinstance(rows, (list, tuple)):
+        problems.append(Problem(index, key, f"must be a list of rows, not {type(rows).__name__}"))
+        return
+    for r, row in enumerate(rows):
+        if not row:
+            continue  # blank rows are skipped when rendering
+        if not isinstance(row, (list, tuple)) or len(row) != width:
+            problems.append(Problem(index, f"{key}[{r}]", f"must be a row of {width} values"))
+            continue
+        for c, cell in enumerate(row):
+            _check_text(problems, index, f"{key}[{r}][{c}]", cell, max_length, True)
+
+
+class DataValidator:
+    """Checks data dicts against the COA schema; the key lists are built once."""
+
+    def __init__(self):
+        # (key, max length, required): the analyte keys are read with data[...], so they must exist
+        self.text_fields = [
+            (key, MAX_TITLE_LENGTH if key == "product_name" else MAX_FIELD_LENGTH, False)
+            for _, key, _, _ in PRODUCT_INFO_FIELDS
+        ]
+        self.text_fields.append(("allergen_statement", MAX_FIELD_LENGTH, False))
+        self.text_fields.extend(
+            (f"{prefix}_{part}", MAX_CELL_LENGTH, True)
+            for _, _, base_rows in SECTIONS
+            for _, prefix in base_rows
+            for part in ("spec", "result", "method")
+        )
+        self.row_fields = [(extra_key, 4, MAX_CELL_LENGTH) for _, extra_key, _ in SECTIONS]
+        self.row_fields.append(("product_additional_rows", 2, MAX_FIELD_LENGTH))
+
+    def validate(self, data, index=None):
+        """Every problem of one data dict, as a list of Problem."""
+        if not isinstance(data, dict):
+            return [Problem(index, "", f"must be a JSON object, not {type(data).__name__}")]
+        problems = []
+        for key, max_length, required in self.text_fields:
+            _check_text(problems, index, key, data.get(key), max_length, required)
+        for key, width, max_length in self.row_fields:
+            _check_rows(problems, index, key, data.get(key), width, max_length)
+        return problems
+
+    def validate_batch(self, data_list):
+        problems = []
+        for index, data in enumerate(data_list):
+            problems.extend(self.validate(data, index))
+        return problems
+
+    def check_batch(self, data_list):
+        """Raise DataValidationError listing every problem of the batch, if there are any."""
+        problems = self.validate_batch(data_list)
+        if problems:
+            raise DataValidationError(problems)
+
+
+validator = DataValidator()
+validate = validator.validate
+validate_batch = validator.validate_batch
+check_batch = validator.check_batch
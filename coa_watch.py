@@ -0,0 +1,379 @@
+"""Watch a folder of LIMS result exports and render a COA for every new result.
+
+    python coa_watch.py incoming/ --out-dir out/ [--interval 5] [--once] [--archive]
+
+Every .json, .ndjson and .csv file in the folder is parsed into COA data dicts
+(see parse_file for the formats). Each data dict is normalized and keyed on its
+hash and [coa] layout, and only keys that have not been rendered before are
+rendered (every file is parsed again once the layouts in the settings change,
+so certificates whose layout changed are rendered anew); PDFs and the
+manifest (out-dir/manifest.json) are written atomically, so after a restart
+unchanged files are skipped without being parsed and finished COAs are never
+rendered twice. A file that is still being written (modified within --settle
+seconds) is left for the next pass.
+"""
+import argparse
+import csv
+import datetime
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from coa_archive import CoaArchive, DEFAULT_ARCHIVE_PATH
+from coa_cli import output_name, render_key, write_atomic
+from coa_import import empty_data
+from coa_settings import get_settings
+from coa_validate import validate
+from renderers import BACKENDS, DEFAULT_BACKEND, get_renderer
+
+MANIFEST_NAME = "manifest.json"
+WATCHED_EXTENSIONS = (".json", ".ndjson", ".csv")
+
+# A record that fails to render is tried again on later passes up to this many times
+MAX_RENDER_ATTEMPTS = 3
+
+# Finished renders are written to the manifest in batches of this many, or after this
+# many seconds; a crash in between only costs re-checking PDFs that already exist
+MANIFEST_SAVE_EVERY = 50
+MANIFEST_SAVE_SECONDS = 5.0
+
+# Keys of empty_data() that hold lists of rows; everything else is text
+ROW_KEYS = {key for key, value in empty_data().items() if isinstance(value, list)}
+
+
+class WatchParseError(ValueError):
+    pass
+
+
+# ----------------------------------------------------------------------------
+# PARSING
+# ----------------------------------------------------------------------------
+def parse_csv(stream):
+    """One data dict from a key,value export.
+
+    A row "<key>,<value>" sets a text field (e.g. "moisture_result,3.2%"); a row
+    whose key is a rows list appends its remaining cells as one row (e.g.
+    "physical_extra_rows,Colour,Light brown,Complies,Visual").
+    """
+    data = {}
+    for line_no, record in enumerate(csv.reader(stream), start=1):
+        if not record or not record[0].strip() or record[0].startswith("#"):
+            continue
+        key = record[0].strip()
+        if key in ROW_KEYS:
+            data.setdefault(key, []).append(record[1:])
+        elif len(record) == 2:
+            data[key] = record[1]
+        elif line_no == 1 and key.lower() in ("key", "field"):
+            continue  # header
+        else:
+            raise WatchParseError(f"line {line_no}: expected key,value")
+    return [data]
+
+
+def parse_file(path):
+    """The data dicts of one export file: a JSON object or list, NDJSON lines, or a key,value CSV."""
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, encoding="utf-8-sig", newline="") as stream:
+        if extension == ".csv":
+            records = parse_csv(stream)
+        elif extension == ".ndjson":
+            records = [json.loads(line) for line in stream if line.strip()]
+        else:
+            payload = json.load(stream)
+            records = payload if isinstance(payload, list) else [payload]
+    for record in records:
+        if not isinstance(record, dict):
+            raise WatchParseError("record is not a JSON object")
+    return records
+
+
+def normalize(record):
+    """Full data dict of a parsed record: every key present, text stripped, rows as lists.
+
+    Exports that differ only in key order, surrounding whitespace or omitted blank
+    fields normalize (and hash) the same.
+    """
+    data = empty_data()
+    for key, value in record.items():
+        if key in ROW_KEYS:
+            data[key] = [[str(cell).strip() for cell in row] for row in value or []]
+        elif isinstance(value, str):
+            data[key] = value.strip()
+        else:
+            data[key] = value
+    return data
+
+
+# ----------------------------------------------------------------------------
+# MANIFEST
+#
+# {"layouts": digest of the [coa] layouts the files were parsed under,
+#  "files": {name: {"size", "mtime_ns", "hashes" or "error"}},
+#  "rendered": {render key: {"pdf", "source", "rendered_at"}},
+#  "failed": {render key: {"source", "error", "attempts"}}}
+#
+# A render key is coa_cli.render_key: the data hash plus the record's layout digest.
+# ----------------------------------------------------------------------------
+def load_manifest(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+    manifest.setdefault("files", {})
+    manifest.setdefault("rendered", {})
+    manifest.setdefault("failed", {})
+    return manifest
+
+
+def layouts_digest():
+    """Digest of every [coa] layout in the settings, default and per product."""
+    settings = get_settings()
+    layouts = (settings.layout_default, sorted(settings.layouts.items()))
+    return hashlib.sha256(repr(layouts).encode("utf-8")).hexdigest()[:16]
+
+
+def save_manifest(path, manifest):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def render_data(data, out_dir, backend):
+    """Worker: render one normalized data dict; returns the PDF's file name."""
+    name = output_name(data)
+    path = os.path.join(out_dir, name)
+    if not os.path.exists(path):  # rendered before a crash, but not yet in the manifest
+        write_atomic(path, get_renderer(backend).render(data, deterministic=True))
+    return name
+
+
+# ----------------------------------------------------------------------------
+# WATCHER
+# ----------------------------------------------------------------------------
+class FolderWatcher:
+    def __init__(self, watch_dir, out_dir, backend=DEFAULT_BACKEND, workers=None, settle=2.0, archive=None,
+                 max_in_flight=None):
+        self.watch_dir = watch_dir
+        self.out_dir = out_dir
+        self.backend = backend
+        self.workers = workers
+        self.settle = settle
+        self.archive = archive
+        # Records submitted to the pool but not yet recorded in the manifest
+        self.max_in_flight = max_in_flight or 4 * (workers or os.cpu_count() or 1)
+        os.makedirs(out_dir, exist_ok=True)
+        self.manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+        self.manifest = load_manifest(self.manifest_path)
+        self.unsaved = 0
+        self.saved_at = time.monotonic()
+        self.pool = None  # renders inline until run() starts a process pool
+
+    def save(self, force=False):
+        """Write the manifest if forced, or once enough renders or time have gone unsaved."""
+        if force or self.unsaved >= MANIFEST_SAVE_EVERY or \
+                time.monotonic() - self.saved_at >= MANIFEST_SAVE_SECONDS:
+            save_manifest(self.manifest_path, self.manifest)
+            self.unsaved = 0
+            self.saved_at = time.monotonic()
+
+    def new_pool(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def finished(self, entry):
+        """True once every record of a manifest file entry is rendered or out of attempts."""
+        if "error" in entry:
+            return True
+        rendered, failed = self.manifest["rendered"], self.manifest["failed"]
+        return all(key in rendered or failed.get(key, {}).get("attempts", 0) >= MAX_RENDER_ATTEMPTS
+                   for key in entry.get("hashes", ()))
+
+    def changed_files(self, layouts):
+        """(name, stat) of every export that is new, changed, or not yet fully rendered;
+        every export once the [coa] layouts (see layouts_digest) have changed since the last pass."""
+        now = time.time()
+        same_layouts = self.manifest.get("layouts") == layouts
+        changed = []
+        with os.scandir(self.watch_dir) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.lower().endswith(WATCHED_EXTENSIONS):
+                    continue
+                stat = entry.stat()
+                if now - stat.st_mtime < self.settle:
+                    continue  # still being written
+                seen = self.manifest["files"].get(entry.name)
+                if same_layouts and seen and seen["size"] == stat.st_size \
+                        and seen["mtime_ns"] == stat.st_mtime_ns and self.finished(seen):
+                    continue
+                changed.append((entry.name, stat))
+        return sorted(changed)
+
+    def render_all(self, todo, record):
+        """Render every record of todo ({render key: (data, source)}), calling
+        record(render key, PDF name, error) as each one finishes."""
+        if self.pool is None:
+            for key, (data, _) in todo.items():
+                record(key, *_call(render_data, data, self.out_dir, self.backend))
+            return
+        in_flight = {}  # future -> render key
+
+        def drain(until):
+            broken = []
+            while len(in_flight) > until or (broken and in_flight):
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = in_flight.pop(future)
+                    try:
+                        record(key, future.result(), None)
+                    except BrokenProcessPool:
+                        broken.append(key)
+                    except Exception as exc:  # one bad record must not stop the pass
+                        record(key, None, f"{type(exc).__name__}: {exc}")
+            # A worker died (killed for memory, most likely) and its pool failed every render in
+            # flight. Render those again one at a time, so only the record that kills its worker
+            # is charged an attempt
+            for key in broken:
+                self.new_pool()
+                future = self.pool.submit(render_data, todo[key][0], self.out_dir, self.backend)
+                record(key, *_result(future))
+            if broken:
+                self.new_pool()
+
+        for key, (data, _) in todo.items():
+            drain(self.max_in_flight - 1)
+            try:
+                future = self.pool.submit(render_data, data, self.out_dir, self.backend)
+            except BrokenProcessPool:
+                drain(0)
+                self.new_pool()
+                future = self.pool.submit(render_data, data, self.out_dir, self.backend)
+            in_flight[future] = key
+        drain(0)
+
+    def scan(self):
+        """One pass over the folder; returns (files parsed, COAs rendered, files or records failed)."""
+        todo = {}  # render key -> (data, source)
+        failed = 0
+        layouts = layouts_digest()
+        changed = self.changed_files(layouts)
+        for name, stat in changed:
+            entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            try:
+                records = [normalize(record) for record in parse_file(os.path.join(self.watch_dir, name))]
+                problems = [p for record in records for p in validate(record)]
+                if problems:
+                    raise WatchParseError("; ".join(f"{p.key}: {p.message}" for p in problems))
+            except (OSError, ValueError) as exc:
+                entry["error"] = f"{type(exc).__name__}: {exc}"
+                failed += 1
+            else:
+                entry["hashes"] = [render_key(record) for record in records]
+                for key, record in zip(entry["hashes"], records):
+                    if key not in self.manifest["rendered"] and \
+                            self.manifest["failed"].get(key, {}).get("attempts", 0) < MAX_RENDER_ATTEMPTS:
+                        todo.setdefault(key, (record, name))
+            # The file counts as seen only while finished() holds, so a crash before all of its
+            # records are rendered leaves it to be picked up again after a restart
+            self.manifest["files"][name] = entry
+
+        rendered = 0
+
+        def record(key, pdf_name, error):
+            nonlocal rendered, failed
+            data, source = todo[key]
+            if error is not None:
+                # Logged per record; the other records and the daemon carry on
+                previous = self.manifest["failed"].get(key, {}).get("attempts", 0)
+                self.manifest["failed"][key] = {"source": source, "error": error, "attempts": previous + 1}
+                print(f"{source}: rendering {key[:16]} failed: {error}", file=sys.stderr)
+                failed += 1
+            else:
+                self.manifest["failed"].pop(key, None)
+                self.manifest["rendered"][key] = {
+                    "pdf": pdf_name,
+                    "source": source,
+                    "rendered_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                }
+                rendered += 1
+                if self.archive is not None:
+                    self.archive.add(data)
+            self.unsaved += 1
+            self.save()
+
+        self.render_all(todo, record)
+        if changed or self.manifest.get("layouts") != layouts:
+            self.manifest["layouts"] = layouts
+            self.save(force=True)
+        return len(changed), rendered, failed
+
+    def run(self, interval=5.0, once=False, log=sys.stderr):
+        self.new_pool()
+        try:
+            while True:
+                try:
+                    parsed, rendered, failed = self.scan()
+                except Exception as exc:  # e.g. the out-dir went away; try again next pass
+                    print(f"scan failed: {type(exc).__name__}: {exc}", file=log)
+                    parsed, rendered, failed = 0, 0, 1
+                if parsed:
+                    print(f"{parsed} file(s) parsed, {rendered} COA(s) rendered, {failed} failed", file=log)
+                if once:
+                    return failed
+                time.sleep(interval)
+        finally:
+            self.pool.shutdown()
+            self.pool = None
+
+
+def _call(function, *args):
+    try:
+        return function(*args), None
+    except Exception as exc:
+        return None, f"{type(exc).__name__}: {exc}"
+
+
+def _result(future):
+    try:
+        return future.result(), None
+    except Exception as exc:
+        return None, f"{type(exc).__name__}: {exc}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("watch_dir")
+    parser.add_argument("--out-dir", required=True, help="PDFs and manifest.json")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between scans")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="ignore files modified more recently than this many seconds")
+    parser.add_argument("--once", action="store_true", help="scan once and exit")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="records submitted but not yet recorded (default: 4 per worker)")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=DEFAULT_BACKEND)
+    parser.add_argument("--archive", nargs="?", const=DEFAULT_ARCHIVE_PATH, default=None,
+                        help="also store rendered COAs in the archive (default path if no value)")
+    args = parser.parse_args(argv)
+
+    archive = CoaArchive(args.archive) if args.archive else None
+    watcher = FolderWatcher(args.watch_dir, args.out_dir, args.backend, args.workers, args.settle, archive,
+                            args.max_in_flight)
+    try:
+        failed = watcher.run(args.interval, args.once)
+    except KeyboardInterrupt:
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from coa_data import spec_sections
+
+# Row status codes
+FAIL = 0
+PASS = 1
+NOT_EVALUATED = -1
+
+# Spec kinds
+NUMERIC = 0
+ABSENT = 1
+UNPARSED = 2
+
+SpecLimit = namedtuple("SpecLimit", "kind lo hi lo_strict hi_strict scale")
+ParsedResult = namedtuple("ParsedResult", "value absent present below scale")
+
+UNPARSED_SPEC = SpecLimit(UNPARSED, -np.inf, np.inf, False, False, np.nan)
+
+# Multipliers to a common base per unit family (mass fraction in ppm)
+UNIT_SCALE = {
+    "%": 1e4, "ppm": 1.0, "mg/kg": 1.0, "µg/g": 1.0, "ug/g": 1.0, "mcg/g": 1.0,
+    "ppb": 1e-3, "µg/kg": 1e-3, "ug/kg": 1e-3, "mcg/kg": 1e-3,
+}
+
+_NUMBER = (r"(?:10\s*(?:\^|\*\*)\s*[-+]?\d+"
+           r"|[-+]?(?:\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:[.,]\d+)?)"
+           r"(?:\s*(?:x|×|\*)\s*10\s*(?:\^|\*\*)?\s*[-+]?\d+|[eE][-+]?\d+)?)")
+_NUMBER_RE = re.compile(_NUMBER)
+_UNIT_RE = re.compile(r"(%|ppm|ppb|mg/kg|µg/g|ug/g|mcg/g|µg/kg|ug/kg|mcg/kg)", re.IGNORECASE)
+_RANGE_RE = re.compile(rf"(?:between\s+)?({_NUMBER})\s*[^\d\s]*\s*(?:-|–|to|and)\s*({_NUMBER})", re.IGNORECASE)
+_UPPER_RE = re.compile(r"^(?:nmt|not\s+more\s+than|max(?:imum)?\.?|up\s+to|<=|≤|=<)", re.IGNORECASE)
+_UPPER_STRICT_RE = re.compile(r"^(?:less\s+than|below|<)", re.IGNORECASE)
+_LOWER_RE = re.compile(r"^(?:nlt|not\s+less\s+than|min(?:imum)?\.?|at\s+least|>=|≥|=>)", re.IGNORECASE)
+_LOWER_STRICT_RE = re.compile(r"^(?:more\s+than|greater\s+than|above|>)", re.IGNORECASE)
+_ABSENT_RE = re.compile(r"^(?:absent|not\s+detected|negative|nil|nd\b|bdl\b|bql\b|blq\b)", re.IGNORECASE)
+_PRESENT_RE = re.compile(r"^(?:present|detected|positive)", re.IGNORECASE)
+_BELOW_RE = re.compile(r"^(?:<|≤|less\s+than|below)", re.IGNORECASE)
+
+
+def parse_number(text):
+    """First number in `text` as a float; understands 1.5, 1,5, 1,000, 1x10^3, 10^3 and 1e3 forms."""
+    match = _NUMBER_RE.search(text)
+    if not match:
+        return np.nan
+    token = match.group(0).replace(" ", "")
+    if re.match(r"[-+]?\d{1,3}(?:,\d{3})+", token):
+        token = token.replace(",", "")
+    else:
+        token = token.replace(",", ".")
+    power = re.match(r"([-+]?[\d.]*?)(?:x|×|\*)?10(?:\^|\*\*)([-+]?\d+)$", token)
+    if power:
+        return float(power.group(1) or 1) * 10.0 ** int(power.group(2))
+    power = re.match(r"([-+]?[\d.]+)(?:x|×|\*)10([-+]?\d+)$", token)
+    if power:
+        return float(power.group(1)) * 10.0 ** int(power.group(2))
+    return float(token)
+
+
+def _unit_scale(text):
+    match = _UNIT_RE.search(text)
+    return UNIT_SCALE[match.group(1).lower()] if match else np.nan
+
+
+@lru_cache(maxsize=65536)
+def parse_spec(text):
+    """Turn a specification such as "NMT 10 ppm", "NLT 95%", "Absent/10g" or
+    "Between 0.3g/ml to 0.6g/ml" into numeric limits. Free-text specifications
+    ("To comply by TLC") come back as UNPARSED and are never judged."""
+    text = (text or "").strip()
+    if not text:
+        return UNPARSED_SPEC
+    if _ABSENT_RE.match(text):
+        return SpecLimit(ABSENT, -np.inf, np.inf, False, False, np.nan)
+    scale = _unit_scale(text)
+    for pattern, upper, strict in ((_UPPER_RE, True, False), (_UPPER_STRICT_RE, True, True),
+                                   (_LOWER_RE, False, False), (_LOWER_STRICT_RE, False, True)):
+        if pattern.match(text):
+            limit = parse_number(text)
+            if np.isnan(limit):
+                return UNPARSED_SPEC
+            if upper:
+                return SpecLimit(NUMERIC, -np.inf, limit, False, strict, scale)
+            return SpecLimit(NUMERIC, limit, np.inf, strict, False, scale)
+    match = _RANGE_RE.search(text)
+    if match:
+        lo, hi = sorted((parse_number(match.group(1)), parse_number(match.group(2))))
+        return SpecLimit(NUMERIC, lo, hi, False, False, scale)
+    return UNPARSED_SPEC
+
+
+@lru_cache(maxsize=65536)
+def parse_result(text):
+    text = (text or "").strip()
+    if _ABSENT_RE.match(text):
+        return ParsedResult(0.0, True, False, False, np.nan)
+    if _PRESENT_RE.match(text):
+        return ParsedResult(np.nan, False, True, False, np.nan)
+    # "<10 cfu/g" keeps its number, 10, with below set
+    return ParsedResult(parse_number(text), False, False, bool(_BELOW_RE.match(text)), _unit_scale(text))
+
+
+# ----------------------------------------------------------------------------
+# VECTORIZED EVALUATION
+# ----------------------------------------------------------------------------
+def evaluate(specs, results):
+    """Status (PASS / FAIL / NOT_EVALUATED) for each (spec, result) string pair, as an int8 array."""
+    limits = [parse_spec("" if s is None else str(s)) for s in specs]
+    parsed = [parse_result("" if r is None else str(r)) for r in results]
+    if not limits:
+        return np.empty(0, dtype=np.int8)
+
+    kind, lo, hi, lo_strict, hi_strict, spec_scale = (np.array(col) for col in zip(*limits))
+    value, absent, present, below, result_scale = (np.array(col) for col in zip(*parsed))
+    kind = kind.astype(np.int8)
+    lo = lo.astype(float)
+    hi = hi.astype(float)
+    value = value.astype(float)
+    spec_scale = spec_scale.astype(float)
+    result_scale = result_scale.astype(float)
+
+    # Convert results into the spec's unit where both carry a known unit (e.g. ppb vs ppm)
+    convert = ~np.isnan(spec_scale) & ~np.isnan(result_scale)
+    value = np.where(convert, value * result_scale / np.where(convert, spec_scale, 1.0), value)
+
+    with np.errstate(invalid="ignore"):
+        above_lo = np.where(lo_strict.astype(bool), value > lo, value >= lo)
+        below_hi = np.where(hi_strict.astype(bool), value < hi, value <= hi)
+    numeric_status = np.where(np.isnan(value), NOT_EVALUATED, np.where(above_lo & below_hi, PASS, FAIL))
+
+    # A "<10"-style result only bounds the value from above: it passes an upper limit
+    # of 10 or more (strict or not) and proves nothing against a lower limit
+    below = below.astype(bool)
+    below_status = np.where(np.isnan(value) | np.isfinite(lo), NOT_EVALUATED,
+                            np.where(value <= hi, PASS, NOT_EVALUATED))
+    numeric_status = np.where(below, below_status, numeric_status)
+
+    # A "<LOQ"-style result cannot prove absence, so it is left unjudged against Absent specs
+    absent = absent.astype(bool)
+    present = present.astype(bool)
+    absent_status = np.where(absent | (value == 0), PASS,
+                             np.where(present | ((value > 0) & ~below), FAIL, NOT_EVALUATED))
+
+    status = np.full(len(limits), NOT_EVALUATED, dtype=np.int8)
+    status = np.where(kind == NUMERIC, numeric_status, status)
+    status = np.where(kind == ABSENT, absent_status, status)
+    return status.astype(np.int8)
+
+
+def evaluate_rows(rows):
+    """Statuses for (parameter, specification, result, method) rows."""
+    return evaluate([row[1] for row in rows], [row[2] for row in rows])
+
+
+def evaluate_sections(sections):
+    """Section name -> status array, for the dict returned by coa_data.spec_sections."""
+    return {name: evaluate_rows(rows) for name, rows in sections.items()}
+
+
+class BatchCompliance:
+    """Flat per-row results for a batch of data dicts.
+
+    doc_index, section, row_index and status are parallel arrays with one entry per
+    printed spec row; `complies[i]` is False when document i has a failing row.
+    """
+
+    def __init__(self, doc_index, section, row_index, status, n_docs):
+        self.doc_index = doc_index
+        self.section = section
+        self.row_index = row_index
+        self.status = status
+        failing = np.bincount(doc_index[status == FAIL], minlength=n_docs)
+        self.fail_count = failing
+        self.complies = failing == 0
+
+    def failures(self, doc):
+        mask = (self.doc_index == doc) & (self.status == FAIL)
+        return list(zip(self.section[mask].tolist(), self.row_index[mask].tolist()))
+
+
+def evaluate_batch(data_list):
+    doc_index, section, row_index, specs, results = [], [], [], [], []
+    n_docs = 0
+    for n_docs, data in enumerate(data_list, start=1):
+        for section_name, rows in spec_sections(data).items():
+            for i, row in enumerate(rows):
+                doc_index.append(n_docs - 1)
+                section.append(section_name)
+                row_index.append(i)
+                specs.append(row[1])
+                results.append(row[2])
+    return BatchCompliance(
+        np.array(doc_index, dtype=np.int64),
+        np.array(section, dtype=object),
+        np.array(row_index, dtype=np.int64),
+        evaluate(specs, results),
+        n_docs,
+    )
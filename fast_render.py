@@ -0,0 +1,390 @@
+import copy
+import hashlib
+import io
+import os
+from functools import lru_cache
+
+from reportlab import rl_config
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfbase.pdfdoc import PDFImageXObject
+from reportlab.pdfgen.canvas import Canvas
+
+from coa_data import spec_sections
+from coa_fonts import needs_unicode_fonts
+from coa_settings import coa_layout
+from compliance import evaluate_sections, FAIL
+from pdf_generator import (
+    generate_pdf, downsampled_image, markup_runs, seed_document_id,
+    declaration_rows, product_info_rows, allergen_statement_of,
+    FAIL_BACKGROUND, LOGO_BOX, FOOTER_BOX, PAGE_TOP_MARGIN, PAGE_BOTTOM_MARGIN,
+)
+
+# ----------------------------------------------------------------------------
+# FIXED PAGE GEOMETRY
+#
+# The same numbers generate_pdf ends up with: SimpleDocTemplate's frame on A4
+# (1 inch side margins, 6pt frame padding) holding one KeepInFrame that shrinks
+# the whole certificate to fit.
+# ----------------------------------------------------------------------------
+FRAME_PADDING = 6
+FRAME_X = 72 + FRAME_PADDING
+FRAME_TOP = A4[1] - PAGE_TOP_MARGIN - FRAME_PADDING
+MAX_WIDTH = A4[0] - 2 * 72 - 2 * FRAME_PADDING
+MAX_HEIGHT = A4[1] - PAGE_TOP_MARGIN - PAGE_BOTTOM_MARGIN - 2 * FRAME_PADDING
+
+# Table defaults: 6pt side and 3pt top/bottom cell padding, 12pt leading
+CELL_PADDING_X = 6
+CELL_PADDING_Y = 3
+LEADING = 12
+FONT_SIZE = 10
+TITLE_FONT_SIZE = 12
+GRID_WIDTH = 0.5
+
+# Gaps between the blocks of the page (Spacer heights and the title's spaceAfter)
+TOP_GAP = 3
+TITLE_SPACE_AFTER = 1
+PRODUCT_GAP = 3
+DECLARATION_GAP = 2
+BOTTOM_GAP = 3
+
+LEFT = 0
+CENTER = 1
+
+# Platypus measures with a tolerance of this size; kept so positions match exactly
+_FUZZ = 1e-6
+
+
+class FastRenderUnsupported(Exception):
+    """Content the fixed layout cannot reproduce exactly; generate_pdf renders it instead."""
+
+
+@lru_cache(maxsize=65536)
+def is_plain_text(text):
+    """True if a Paragraph would print `text` as-is in a single font (no markup or entities)."""
+    if "\xa0" in text or "\xad" in text:
+        return False
+    if "<" not in text and "&" not in text:
+        return True
+    try:
+        runs = markup_runs(text)
+    except ValueError:
+        return False
+    # Any tag or entity changes the printed text
+    return "".join(run.text for run in runs) == text
+
+
+def wrap_text(text, font, size, width):
+    """Greedy line breaking as platypus does it for a plain paragraph: [(line, line width), ...]."""
+    if not is_plain_text(text):
+        raise FastRenderUnsupported(f"markup in {text!r}")
+    words = text.split()
+    space = stringWidth(" ", font, size)
+    shrink = rl_config.spaceShrinkage * space
+    lines = []
+    line = []
+    current = -space
+    for word in words:
+        word_width = stringWidth(word, font, size)
+        if word_width > width:
+            # Platypus would split the word itself
+            raise FastRenderUnsupported(f"{word!r} is wider than its column")
+        new_width = current + space + word_width
+        if line and new_width > width + shrink * len(line):
+            lines.append((" ".join(line), current))
+            line = [word]
+            current = word_width
+        else:
+            line.append(word)
+            current = new_width
+    if line:
+        lines.append((" ".join(line), current))
+    return lines
+
+
+class TextBlock:
+    """A wrapped paragraph: its lines, font and alignment within `width`."""
+
+    def __init__(self, text, font, width, align=LEFT, size=FONT_SIZE):
+        self.lines = wrap_text(str(text), font, size, width)
+        self.font = font
+        self.size = size
+        self.width = width
+        self.align = align
+
+    @property
+    def height(self):
+        return len(self.lines) * LEADING
+
+    def draw(self, canvas, x, top, width=None):
+        # First baseline sits one font size below the top, like Paragraph's
+        width = self.width if width is None else width
+        y = top - self.size
+        for text, line_width in self.lines:
+            extra = width - line_width
+            spaces = text.count(" ")
+            if extra < 0 and spaces:
+                # Spaces were shrunk to fit the line
+                tx = canvas.beginText(x, y)
+                tx.setFont(self.font, self.size, LEADING)
+                tx.setWordSpace(extra / spaces)
+                tx.textOut(text)
+                # Word spacing is part of the page's text state; reset it for later strings
+                tx.setWordSpace(0)
+                canvas.drawText(tx)
+            else:
+                canvas.setFont(self.font, self.size)
+                offset = 0.5 * extra if self.align == CENTER else 0
+                canvas.drawString(x + offset, y, text)
+            y -= LEADING
+
+
+class FixedTable:
+    """Rows of TextBlocks on fixed column widths, drawn the way platypus draws a Table
+    with VALIGN TOP and an optional 0.5pt grid. Spanned rows hold one block across all columns."""
+
+    def __init__(self, col_widths, padding_x=CELL_PADDING_X, padding_y=CELL_PADDING_Y, grid=True):
+        self.col_widths = col_widths
+        self.col_positions = [sum(col_widths[:i]) for i in range(len(col_widths) + 1)]
+        self.width = self.col_positions[-1]
+        self.padding_x = padding_x
+        self.padding_y = padding_y
+        self.grid = grid
+        self.rows = []
+        self.row_heights = []
+        self.spanned = []
+        self.backgrounds = []
+
+    def cell_width(self, col):
+        return self.col_widths[col] - 2 * self.padding_x
+
+    def add_row(self, blocks, spanned=False):
+        # `blocks` is {column: TextBlock}; empty cells are left out
+        self.rows.append(blocks)
+        self.spanned.append(spanned)
+        content = max((b.height for b in blocks.values()), default=0)
+        self.row_heights.append(content + 2 * self.padding_y)
+        return len(self.rows) - 1
+
+    def add_background(self, row, color, col=None):
+        self.backgrounds.append((row, col, color))
+
+    @property
+    def height(self):
+        return sum(self.row_heights)
+
+    def draw(self, canvas, x, y):
+        tops = [y + self.height]
+        for h in self.row_heights:
+            tops.append(tops[-1] - h)
+        canvas.saveState()
+        for row, col, color in self.backgrounds:
+            if col is None:
+                x0, x1 = self.col_positions[0], self.col_positions[-1]
+            else:
+                x0, x1 = self.col_positions[col], self.col_positions[col + 1]
+            canvas.setFillColor(color)
+            canvas.rect(x + x0, tops[row + 1], x1 - x0, tops[row] - tops[row + 1], stroke=0, fill=1)
+        canvas.setFillColor(colors.black)
+        for row, blocks in enumerate(self.rows):
+            for col, block in blocks.items():
+                block.draw(canvas, x + self.col_positions[col] + self.padding_x, tops[row] - self.padding_y)
+        if self.grid:
+            self._draw_grid(canvas, x, tops)
+        canvas.restoreState()
+
+    def _draw_grid(self, canvas, x, tops):
+        canvas.setStrokeColor(colors.black)
+        canvas.setLineWidth(GRID_WIDTH)
+        canvas.setLineCap(1)
+        canvas.setLineJoin(1)
+        left, right = x, x + self.width
+        for y in tops:
+            canvas.line(left, y, right, y)
+        for i, col_x in enumerate(self.col_positions):
+            outer = i in (0, len(self.col_positions) - 1)
+            # Inner column rules stop at spanned rows
+            start = None
+            for row in range(len(self.rows) + 1):
+                open_row = row < len(self.rows) and (outer or not self.spanned[row])
+                if open_row and start is None:
+                    start = row
+                elif not open_row and start is not None:
+                    canvas.line(x + col_x, tops[row], x + col_x, tops[start])
+                    start = None
+
+
+# ----------------------------------------------------------------------------
+# PAGE CHROME
+# ----------------------------------------------------------------------------
+@lru_cache(maxsize=None)
+def chrome_image(source):
+    """(form name, image XObject) for a logo/footer image, encoded once per process.
+
+    canvas.drawImage re-encodes the image for every new canvas, which is most of the
+    cost of a certificate; each canvas gets a shallow copy of the encoded object instead.
+    """
+    # Named after the pixels rather than the reader object, so the name is the same in every process
+    key = source.encode("utf-8") if isinstance(source, str) else source.getRGBData()
+    name = "Chrome" + hashlib.md5(key).hexdigest()
+    image = PDFImageXObject(name, source)
+    image.name = name
+    return name, image
+
+
+def draw_page_chrome(canvas, optimize=False):
+    # Same placement as header_footer / header_footer_optimized
+    logo_path = os.path.join(os.getcwd(), "images", "tru_herb_logo.png")
+    footer_path = os.path.join(os.getcwd(), "images", "footer.png")
+    images = []
+    if os.path.exists(logo_path):
+        images.append((logo_path, LOGO_BOX))
+    if os.path.exists(footer_path):
+        footer = downsampled_image(footer_path, *FOOTER_BOX[2:]) if optimize else footer_path
+        images.append((footer, FOOTER_BOX))
+
+    for source, (x, y, width, height) in images:
+        name, encoded = chrome_image(source)
+        # Register a copy with this document the way drawImage registers a new image
+        reg_name = canvas._doc.getXObjectName(name)
+        if reg_name not in canvas._doc.idToObject:
+            image = copy.copy(encoded)
+            canvas._setXObjects(image)
+            canvas._doc.Reference(image, reg_name)
+            canvas._doc.addForm(name, image)
+        canvas.saveState()
+        canvas.translate(x, y)
+        canvas.scale(width, height)
+        canvas.doForm(name)
+        canvas.restoreState()
+
+
+# ----------------------------------------------------------------------------
+# LAYOUT
+# ----------------------------------------------------------------------------
+def layout_blocks(data, check_compliance=True):
+    """Measure the certificate: [(block, height, space after), ...] in print order.
+
+    Raises FastRenderUnsupported for anything the fixed layout does not reproduce
+    exactly (markup, words wider than their column, a product name that wraps, text
+    that needs the embedded TrueType fonts).
+    """
+    if needs_unicode_fonts(data):
+        raise FastRenderUnsupported("text outside the base-14 fonts")
+    layout = coa_layout(data)
+    sections = spec_sections(data)
+    statuses = evaluate_sections(sections) if check_compliance else {}
+    complies = not any((section_statuses == FAIL).any() for section_statuses in statuses.values())
+
+    blocks = [(None, TOP_GAP, 0)]
+    title = TextBlock("CERTIFICATE OF ANALYSIS", "Times-Bold", MAX_WIDTH, CENTER, TITLE_FONT_SIZE)
+    blocks.append((title, title.height, TITLE_SPACE_AFTER))
+    product_name = TextBlock(data.get('product_name', '').upper(), "Times-Bold", MAX_WIDTH, CENTER, TITLE_FONT_SIZE)
+    if len(product_name.lines) > 1:
+        # KeepInFrame re-wraps the title at the shrunk width, which may change its line count
+        raise FastRenderUnsupported("product name wraps")
+    if product_name.lines:
+        blocks.append((product_name, product_name.height, TITLE_SPACE_AFTER))
+    blocks.append((None, PRODUCT_GAP, 0))
+
+    product_rows = product_info_rows(data)
+    if product_rows:
+        product_table = FixedTable(layout.product_col_widths)
+        for label, value, italic, bold in product_rows:
+            value_font = "Times-Bold" if bold else "Times-Italic" if italic else "Times-Roman"
+            product_table.add_row({
+                0: TextBlock(label, "Helvetica-Bold", product_table.cell_width(0)),
+                1: TextBlock(value, value_font, product_table.cell_width(1)),
+            })
+        blocks.append((product_table, product_table.height, 0))
+
+    spec_table = FixedTable(layout.spec_col_widths)
+    full_width = spec_table.width - 2 * CELL_PADDING_X
+    header = spec_table.add_row({
+        col: TextBlock(text, "Helvetica-Bold", spec_table.cell_width(col), CENTER)
+        for col, text in enumerate(["Parameter", "Specification", "Result", "Method"])
+    })
+    spec_table.add_background(header, colors.lightgrey)
+    for section_name, rows in sections.items():
+        if not rows:
+            continue
+        spec_table.add_row({0: TextBlock(section_name, "Helvetica-Bold", full_width)}, spanned=True)
+        section_statuses = statuses.get(section_name)
+        for i, param_tuple in enumerate(rows):
+            row = spec_table.add_row({
+                col: TextBlock(cell, "Times-Roman", spec_table.cell_width(col), CENTER if col == 3 else LEFT)
+                for col, cell in enumerate(param_tuple)
+            })
+            if section_statuses is not None and section_statuses[i] == FAIL:
+                spec_table.add_background(row, FAIL_BACKGROUND, col=2)
+    spec_table.add_row({0: TextBlock(layout.remarks_text, "Times-Roman", full_width)}, spanned=True)
+    end_text = layout.complies_text if complies else layout.does_not_comply_text
+    spec_table.add_row({0: TextBlock(end_text, "Helvetica-Bold", full_width, CENTER)}, spanned=True)
+    blocks.append((spec_table, spec_table.height, 0))
+    blocks.append((None, DECLARATION_GAP, 0))
+
+    declaration_title = TextBlock("Declaration", "Times-Bold", MAX_WIDTH, CENTER)
+    blocks.append((declaration_title, declaration_title.height, 0))
+    declaration = FixedTable(layout.declaration_col_widths, padding_x=0, padding_y=0, grid=False)
+    for label, value, label2, value2 in declaration_rows(allergen_statement_of(data, layout), layout):
+        declaration.add_row({
+            0: TextBlock(label, "Helvetica", declaration.cell_width(0)),
+            1: TextBlock(value, "Times-Roman", declaration.cell_width(1)),
+            3: TextBlock(label2, "Helvetica", declaration.cell_width(3)),
+            4: TextBlock(value2, "Times-Roman", declaration.cell_width(4)),
+        })
+    blocks.append((declaration, declaration.height, 0))
+    blocks.append((None, BOTTOM_GAP, 0))
+    return blocks
+
+
+def draw_blocks(canvas, blocks):
+    # Total height as KeepInFrame measures it: the last block's space after is dropped
+    total = sum(h + after for _, h, after in blocks) - blocks[-1][2]
+    if total <= MAX_HEIGHT + _FUZZ:
+        scale = 1.0
+        height = total - _FUZZ
+    else:
+        scale = total / MAX_HEIGHT
+        height = MAX_HEIGHT - _FUZZ
+    avail_width = (MAX_WIDTH - _FUZZ) * scale
+
+    canvas.saveState()
+    canvas.translate(FRAME_X, FRAME_TOP - height)
+    if scale != 1.0:
+        canvas.scale(1.0 / scale, 1.0 / scale)
+    y = height * scale
+    for block, h, after in blocks:
+        y -= h
+        if isinstance(block, TextBlock):
+            block.draw(canvas, 0, y + h, avail_width)
+        elif isinstance(block, FixedTable):
+            block.draw(canvas, (avail_width - block.width) / 2.0, y)
+        y -= after
+    canvas.restoreState()
+
+
+def render_fast(data, optimize=False, check_compliance=True, deterministic=False):
+    """Render one COA straight onto a canvas, into a BytesIO.
+
+    Produces the same page as generate_pdf without building platypus flowables;
+    content the fixed layout cannot reproduce goes through generate_pdf instead.
+    """
+    try:
+        blocks = layout_blocks(data, check_compliance)
+    except FastRenderUnsupported:
+        return generate_pdf(data, optimize=optimize, check_compliance=check_compliance, deterministic=deterministic)
+
+    buffer = io.BytesIO()
+    canvas = Canvas(
+        buffer, pagesize=A4, pageCompression=1 if optimize else None, invariant=1 if deterministic else None,
+    )
+    if deterministic:
+        seed_document_id(canvas, data)
+    draw_page_chrome(canvas, optimize)
+    draw_blocks(canvas, blocks)
+    canvas.showPage()
+    canvas.save()
+    buffer.seek(0)
+    return buffer
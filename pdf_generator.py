@@ -0,0 +1,455 @@
+import os
+import io
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+# ReportLab imports
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.platypus import (
+    SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer,
+    KeepInFrame
+)
+from reportlab.platypus.paraparser import ParaParser
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen.canvas import Canvas
+from PIL import Image
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from coa_data import spec_sections, data_hash
+from coa_fonts import coa_font, needs_unicode_fonts
+from coa_settings import coa_layout, DEFAULT_LAYOUT
+from compliance import evaluate_sections, FAIL
+
+# Resolution the footer is resampled to in the optimized output profile
+OPTIMIZED_IMAGE_DPI = 96
+
+# Result cell shading for rows that fail their specification
+FAIL_BACKGROUND = colors.Color(1, 0.8, 0.8)
+
+# Page chrome placement (x, y, width, height)
+LOGO_BOX = (250, A4[1] - 55, 100, 50)
+FOOTER_BOX = (50, 5, 500, 80)
+
+# Fixed single-page layout, shared with fast_render; table widths, remarks and
+# declaration values come from the product's CoaLayout (see coa_settings)
+PAGE_TOP_MARGIN = 50
+PAGE_BOTTOM_MARGIN = 80
+
+
+def header_footer(canvas, doc):
+    canvas.saveState()
+    logo_path = os.path.join(os.getcwd(), "images", "tru_herb_logo.png")
+    footer_path = os.path.join(os.getcwd(), "images", "footer.png")
+
+    if os.path.exists(logo_path):
+        canvas.drawImage(logo_path, *LOGO_BOX)
+    if os.path.exists(footer_path):
+        canvas.drawImage(footer_path, *FOOTER_BOX)
+    canvas.restoreState()
+
+
+@lru_cache(maxsize=None)
+def downsampled_image(path, width, height, dpi=OPTIMIZED_IMAGE_DPI):
+    """Image at `path` resampled to its printed size (in points) at `dpi`, never upscaled."""
+    img = Image.open(path)
+    img.load()
+    target = (min(img.width, round(width * dpi / 72)), min(img.height, round(height * dpi / 72)))
+    if target != img.size:
+        img = img.resize(target, Image.LANCZOS)
+    return ImageReader(img)
+
+
+def header_footer_optimized(canvas, doc):
+    # Same chrome as header_footer, with the footer drawn from a copy sized to its printed resolution
+    canvas.saveState()
+    logo_path = os.path.join(os.getcwd(), "images", "tru_herb_logo.png")
+    footer_path = os.path.join(os.getcwd(), "images", "footer.png")
+
+    if os.path.exists(logo_path):
+        canvas.drawImage(logo_path, *LOGO_BOX)
+    if os.path.exists(footer_path):
+        canvas.drawImage(downsampled_image(footer_path, *FOOTER_BOX[2:]), *FOOTER_BOX)
+    canvas.restoreState()
+
+
+@lru_cache(maxsize=None)
+def coa_styles(unicode_fonts=False):
+    # Paragraph styles shared by every certificate; built once per process and font set
+    styles = getSampleStyleSheet()
+
+    title_style = ParagraphStyle(
+        'title_style',
+        fontSize=12,
+        spaceAfter=1,
+        alignment=1,
+        fontName=coa_font('Times-Bold', unicode_fonts)
+    )
+    title_style1 = ParagraphStyle(
+        'title_style1',
+        fontSize=10,
+        spaceAfter=0,
+        alignment=1,
+        fontName=coa_font('Times-Bold', unicode_fonts)
+    )
+    normal_style = styles['BodyText']
+    normal_style.fontName = coa_font('Times-Roman', unicode_fonts)
+    normal_style.alignment = 0  # left aligned
+
+    # NEW: Define a style for the Method column that center aligns the text.
+    method_style = ParagraphStyle('method_style', parent=normal_style, alignment=1)
+
+    header_style = ParagraphStyle(
+        'header_style',
+        parent=styles['Normal'],
+        alignment=1,  # center aligned
+        fontName=coa_font('Helvetica-Bold', unicode_fonts),
+        fontSize=10
+    )
+    bold_center = ParagraphStyle('bold_center',
+                                 parent=styles['Normal'],
+                                 fontName=coa_font('Helvetica-Bold', unicode_fonts),
+                                 alignment=1)
+    # Section headings and product info labels
+    sections_style = styles["Normal"]
+    sections_style.fontName = coa_font('Helvetica', unicode_fonts)
+
+    return {
+        "title": title_style,
+        "title1": title_style1,
+        "normal": normal_style,
+        "method": method_style,
+        "sections": sections_style,
+        "header": header_style,
+        "bold_center": bold_center,
+    }
+
+
+# One styled run of cell text as a Paragraph prints it. fast_render and coa_html read
+# cell markup through markup_runs, so every backend agrees on what a tag means.
+TextRun = namedtuple("TextRun", "text bold italic rise underline strike line_break")
+
+
+@lru_cache(maxsize=65536)
+def markup_runs(text):
+    """The runs a Paragraph prints for `text`: inline tags applied, entities decoded.
+    Raises ValueError for markup Paragraph cannot parse."""
+    _, frags, _ = ParaParser().parse(text, coa_styles()["normal"])
+    runs = []
+    for frag in frags:
+        kinds = {line[1] for line in getattr(frag, "us_lines", ())}
+        runs.append(TextRun(frag.text, bool(frag.bold), bool(frag.italic), frag.rise,
+                            "underline" in kinds, "strike" in kinds,
+                            bool(getattr(frag, "lineBreak", False))))
+    return tuple(runs)
+
+
+def declaration_rows(allergen_statement, layout=DEFAULT_LAYOUT):
+    """(label, value, label, value) for each line of the declaration block."""
+    return [
+        ("GMO Status:", layout.gmo_status, "Allergen statement:", f"{allergen_statement}"),
+        ("Irradiation status:", layout.irradiation_status, "Storage condition:", layout.storage_condition),
+        ("Prepared by", layout.prepared_by, "Approved by", layout.approved_by),
+    ]
+
+
+def allergen_statement_of(data, layout=DEFAULT_LAYOUT):
+    return data.get('allergen_statement', layout.allergen_statement)
+
+
+# (label, data key, italic, bold) of the fixed product info rows, in print order;
+# the product_additional_rows go before the last one
+PRODUCT_INFO_FIELDS = [
+    ("Product Name", "product_name", False, True),
+    ("Product Code", "product_code", False, False),
+    ("Batch No.", "batch_no", False, False),
+    ("Date of Manufacturing", "manufacturing_date", False, False),
+    ("Date of Reanalysis", "reanalysis_date", False, False),
+    ("Botanical Name", "botanical_name", True, False),
+    ("Extraction Ratio", "extraction_ratio", False, False),
+    ("Extraction Solvents", "solvent", False, False),
+    ("Plant Parts", "plant_part", False, False),
+    ("CAS No.", "cas_no", False, False),
+    ("Chemical Name", "chemical_name", False, False),
+    ("Quantity", "quantity", False, False),
+    ("Country of Origin", "origin", False, False),
+]
+
+
+def product_info_rows(data):
+    """(label, value, italic, bold) for every filled-in product info field, in print order."""
+    rows = []
+
+    def maybe_add_product_row(label, value, italic=False, bold=False):
+        text_str = value.strip() if value else ""
+        if text_str:
+            rows.append((label, text_str, italic, bold))
+
+    for label, key, italic, bold in PRODUCT_INFO_FIELDS[:-1]:
+        maybe_add_product_row(label, data.get(key, ''), italic, bold)
+    # Add dynamic additional product info rows (if any)
+    for row in data.get("product_additional_rows", []):
+        maybe_add_product_row(row[0], row[1])
+    label, key, italic, bold = PRODUCT_INFO_FIELDS[-1]
+    maybe_add_product_row(label, data.get(key, ''), italic, bold)
+    return rows
+
+
+def build_static_parts(allergen_statement, complies, unicode_fonts=False, layout=DEFAULT_LAYOUT):
+    """Flowables that only depend on the allergen statement, the compliance verdict, the
+    font set and the layout: the title, the spec table header row, both remarks rows and
+    the declaration block."""
+    styles = coa_styles(unicode_fonts)
+    normal_style = styles["normal"]
+    header_style = styles["header"]
+
+    spec_headers = [
+        Paragraph("Parameter", header_style),
+        Paragraph("Specification", header_style),
+        Paragraph("Result", header_style),
+        Paragraph("Method", header_style)
+    ]
+
+    # Remarks
+    end_text = layout.complies_text if complies else layout.does_not_comply_text
+
+    # Declaration
+    declaration_data = [
+        [label, Paragraph(value, normal_style), "", label2, Paragraph(value2, normal_style)]
+        for label, value, label2, value2 in declaration_rows(allergen_statement, layout)
+    ]
+    declaration_table = Table(declaration_data, colWidths=list(layout.declaration_col_widths))
+    declaration_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), coa_font('Helvetica', unicode_fonts)),
+        ('ALIGN', (0, 0), (1, -1), 'LEFT'),
+        ('ALIGN', (3, 0), (4, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('WORDWRAP', (0, 0), (-1, -1), 'LTR'),
+        ('LEFTPADDING', (0, 0), (-1, -1), 0),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 0),
+        ('TOPPADDING', (0, 0), (-1, -1), 0),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
+        ('SPAN', (2, 0), (2, 2)),
+    ]))
+
+    return {
+        "title": Paragraph("CERTIFICATE OF ANALYSIS", styles["title"]),
+        "spec_headers": spec_headers,
+        "remarks": Paragraph(layout.remarks_text, normal_style),
+        "end_remark": Paragraph(end_text, styles["bold_center"]),
+        "declaration_title": Paragraph("Declaration", styles["title1"]),
+        "declaration_table": declaration_table,
+    }
+
+
+def build_section_rows(section_name, rows, unicode_fonts=False):
+    """Spec table rows of one section: the spanned heading, then one row per analyte."""
+    styles = coa_styles(unicode_fonts)
+    table_rows = [[Paragraph(f"<b>{section_name}</b>", styles["sections"]), "", "", ""]]
+    for param_tuple in rows:
+        # Use method_style (center aligned) for column 3, normal_style for others
+        table_rows.append([
+            Paragraph(str(cell), styles["method"]) if idx == 3 else Paragraph(str(cell), styles["normal"])
+            for idx, cell in enumerate(param_tuple)
+        ])
+    return table_rows
+
+
+# Built rows per (section, rows), so re-rendering after an edit only rebuilds the
+# Paragraphs of the sections that changed. Flowables keep layout state between wrap()
+# and drawOn(), so every render thread gets its own cache
+SECTION_CACHE_SIZE = 256
+_section_rows_cache = threading.local()
+
+
+def cached_section_rows(section_name, rows, unicode_fonts=False):
+    cache = getattr(_section_rows_cache, "rows", None)
+    if cache is None:
+        cache = _section_rows_cache.rows = OrderedDict()
+    key = (section_name, tuple(tuple(str(cell) for cell in row) for row in rows), unicode_fonts)
+    if key in cache:
+        cache.move_to_end(key)
+    else:
+        cache[key] = build_section_rows(section_name, rows, unicode_fonts)
+        if len(cache) > SECTION_CACHE_SIZE:
+            cache.popitem(last=False)
+    return cache[key]
+
+
+@lru_cache(maxsize=None)
+def skeleton_template(optimize=False):
+    """A one-page PDF holding only the page chrome (logo and footer), drawn once per process."""
+    buffer = io.BytesIO()
+    canvas = Canvas(buffer, pagesize=A4, pageCompression=1 if optimize else None)
+    (header_footer_optimized if optimize else header_footer)(canvas, None)
+    canvas.showPage()
+    canvas.save()
+    return buffer.getvalue()
+
+
+def stamp_skeleton(pdf_bytes, optimize=False, deterministic=False, doc_id=None):
+    # show_pdf_page embeds the template page as a form XObject underneath the content
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    template = fitz.open(stream=skeleton_template(optimize), filetype="pdf")
+    for page in doc:
+        page.show_pdf_page(page.rect, template, 0, overlay=False)
+    if doc_id is not None:
+        doc.xref_set_key(-1, "ID", f"[<{doc_id}><{doc_id}>]")
+    # MuPDF gives every save a fresh random second /ID unless told to keep the document's
+    out = doc.tobytes(deflate=True, no_new_id=deterministic)
+    template.close()
+    doc.close()
+    return out
+
+
+# ----------------------------------------------------------------------------
+# DETERMINISTIC OUTPUT
+#
+# Identical data dicts render to identical bytes: ReportLab's invariant mode
+# fixes the creation date (2000-01-01 UTC) and drops the time-based part of
+# the document /ID, which is seeded from the data hash instead so different
+# certificates still get different IDs.
+# ----------------------------------------------------------------------------
+def document_id(data):
+    """Stable 16-byte document ID of a certificate, as hex."""
+    return data_hash(data)[:32]
+
+
+def seed_document_id(canvas, data):
+    canvas._doc.updateSignature(document_id(data))
+
+
+def deterministic_canvas_maker(data):
+    def make_canvas(*args, **kwargs):
+        canvas = Canvas(*args, **kwargs)
+        seed_document_id(canvas, data)
+        return canvas
+    return make_canvas
+
+
+def generate_pdf(data, optimize=False, check_compliance=True, deterministic=False):
+    """Render one COA into a BytesIO.
+
+    With deterministic=True the same data always gives the same bytes. Text the base-14 fonts cannot show switches the
+    whole certificate to the embedded TrueType fonts of coa_fonts.
+    """
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        topMargin=PAGE_TOP_MARGIN,
+        bottomMargin=PAGE_BOTTOM_MARGIN,
+        pageCompression=1 if optimize else None,
+        invariant=1 if deterministic else None,
+    )
+    unicode_fonts = needs_unicode_fonts(data)
+    styles = coa_styles(unicode_fonts)
+    title_style = styles["title"]
+    normal_style = styles["normal"]
+    table_font = coa_font('Times-Roman', unicode_fonts)
+    layout = coa_layout(data)
+
+    sections = spec_sections(data)
+    statuses = evaluate_sections(sections) if check_compliance else {}
+    complies = not any((section_statuses == FAIL).any() for section_statuses in statuses.values())
+    allergen_statement = allergen_statement_of(data, layout)
+    static = build_static_parts(allergen_statement, complies, unicode_fonts, layout)
+
+    elements = []
+    elements.append(Spacer(1, 3))
+    elements.append(static["title"])
+    elements.append(Paragraph(data.get('product_name', '').upper(), title_style))
+    elements.append(Spacer(1, 3))
+
+    # ----------------------------------------------------------------
+    # Build Product Info table, skipping truly empty fields
+    # ----------------------------------------------------------------
+    product_info = []
+    for label, text_str, italic, bold in product_info_rows(data):
+        if italic:
+            text_str = f"<i>{text_str}</i>"
+        if bold:
+            text_str = f"<b>{text_str}</b>"
+        product_info.append([Paragraph(f"<b>{label}</b>", styles["sections"]), Paragraph(text_str, normal_style)])
+
+    if product_info:
+        product_table = Table(product_info, colWidths=list(layout.product_col_widths))
+        product_table.setStyle(TableStyle([
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+            ('FONTNAME', (0, 0), (-1, -1), table_font),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('WORDWRAP', (0, 0), (-1, -1), 'LTR'),
+        ]))
+        elements.append(product_table)
+        elements.append(Spacer(1, 0))
+
+    # ----------------------------------------------------------------
+    # SPECIFICATIONS TABLE
+    # ----------------------------------------------------------------
+    spec_data = [static["spec_headers"]]
+    heading_rows = []
+    failed_cells = []
+
+    for section_name, rows in sections.items():
+        if rows:
+            heading_rows.append(len(spec_data))
+            spec_data.extend(cached_section_rows(section_name, rows, unicode_fonts))
+            if section_name in statuses:
+                first_row = len(spec_data) - len(rows)
+                failed_cells.extend(first_row + int(i) for i in np.flatnonzero(statuses[section_name] == FAIL))
+
+    # Remarks
+    spec_data.append([static["remarks"], "", "", ""])
+    last_remarks_row = len(spec_data) - 1
+    spec_data.append([static["end_remark"], "", "", ""])
+    final_remark_row = len(spec_data) - 1
+
+    spec_table = Table(spec_data, colWidths=list(layout.spec_col_widths))
+
+    spec_table_style = [
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('FONTNAME', (0, 0), (-1, -1), table_font),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('WORDWRAP', (0, 0), (-1, -1), 'LTR'),
+    ]
+    # (The table style alignment for column 3 below is now optional since our Paragraph style takes precedence.)
+    spec_table_style.append(('ALIGN', (3, 0), (3, -1), 'CENTER'))
+    
+    for heading_row in heading_rows:
+        spec_table_style.append(('SPAN', (0, heading_row), (-1, heading_row)))
+    spec_table_style.append(('SPAN', (0, last_remarks_row), (-1, last_remarks_row)))
+    spec_table_style.append(('SPAN', (0, final_remark_row), (-1, final_remark_row)))
+    # Out-of-specification results
+    for failed_row in failed_cells:
+        spec_table_style.append(('BACKGROUND', (2, failed_row), (2, failed_row), FAIL_BACKGROUND))
+
+    spec_table.setStyle(TableStyle(spec_table_style))
+    elements.append(spec_table)
+    elements.append(Spacer(1, 2))
+
+    # Declaration
+    elements.append(static["declaration_title"])
+    elements.append(static["declaration_table"])
+    elements.append(Spacer(1, 3))
+
+    # Force single page
+    kiframe = KeepInFrame(
+        maxWidth=A4[0] - doc.leftMargin - doc.rightMargin,
+        maxHeight=A4[1] - doc.topMargin - doc.bottomMargin,
+        content=elements,
+        mode='shrink'
+    )
+    elements = [kiframe]
+
+    on_page = header_footer_optimized if optimize else header_footer
+    canvas_maker = deterministic_canvas_maker(data) if deterministic else Canvas
+    doc.build(elements, onFirstPage=on_page, onLaterPages=on_page, canvasmaker=canvas_maker)
+    buffer.seek(0)
+    return buffer
@@ -0,0 +1,61 @@
+import fitz  # PyMuPDF
+
+from renderers import get_renderer
+
+
+class SizeReport:
+    def __init__(self, before, after):
+        self.before = before
+        self.after = after
+
+    @property
+    def saved(self):
+        return self.before - self.after if self.before is not None else None
+
+    @property
+    def saved_percent(self):
+        return 100.0 * self.saved / self.before if self.before else None
+
+    def __str__(self):
+        if self.before is None:
+            return f"{self.after / 1024:.1f} KB"
+        return f"{self.before / 1024:.1f} KB -> {self.after / 1024:.1f} KB ({self.saved_percent:.0f}% smaller)"
+
+
+class OptimizedPdf:
+    def __init__(self, pdf, report):
+        self.pdf = pdf
+        self.report = report
+
+
+def _compact(doc, deterministic=False):
+    # ReportLab wraps every stream in ASCII85 on top of Flate; store them as plain Flate instead
+    for xref in range(1, doc.xref_length()):
+        if doc.xref_is_stream(xref) and "ASCII85" in doc.xref_get_key(xref, "Filter")[1]:
+            doc.update_stream(xref, doc.xref_stream(xref), compress=True)
+    # garbage=4 merges byte-identical objects, so a logo or footer repeated on many
+    # pages ends up as a single image XObject
+    return doc.tobytes(
+        garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, use_objstms=1,
+        no_new_id=deterministic,
+    )
+
+
+def compact_pdf(pdf_bytes, deterministic=False):
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return _compact(doc, deterministic)
+    finally:
+        doc.close()
+
+
+def render_optimized(data, backend=None, deterministic=False, compare=False):
+    """Render `data` with the optimized output profile.
+
+    The report holds the optimized size; with compare=True the certificate is also
+    rendered with the standard profile, to report the size saved against it.
+    """
+    renderer = get_renderer(backend)
+    pdf = compact_pdf(renderer.render(data, optimize=True, deterministic=deterministic), deterministic)
+    before = len(renderer.render(data, deterministic=deterministic)) if compare else None
+    return OptimizedPdf(pdf, SizeReport(before, len(pdf)))
@@ -0,0 +1,254 @@
+"""Reissue a COA with new product info values, patching the PDF in place when possible.
+
+    python pdf_reissue.py coa.pdf record.json --set reanalysis_date=12/2028 [--set batch_no=B2] \
+        -o new.pdf [--record-out new.json]
+
+record.json is the data dict coa.pdf was rendered from. When only the batch
+number, dates or quantity change and the new values fit their cells, those
+text runs are rewritten in coa.pdf; any other change renders the certificate
+again (--backend). The value placements are read from, and written to, a
+"<pdf>.placements.json" file next to each PDF, and --record-out saves the new
+data dict, so a chain of reissues measures the original only once.
+"""
+import argparse
+import json
+import sys
+
+import fitz  # PyMuPDF
+
+from coa_cli import write_atomic
+from renderers import BACKENDS, get_renderer
+
+# ----------------------------------------------------------------------------
+# PATCH-IN-PLACE REISSUE
+#
+# A reissue that only changes a product info value (a new batch number,
+# quantity or reanalysis date) rewrites that one text run in the existing PDF
+# instead of laying the certificate out again. The placement of each value is
+# recorded once per PDF; a value that no longer fits its cell, or any other
+# change, falls back to a full render.
+# ----------------------------------------------------------------------------
+
+# Data dict key -> product info label of the fields a reissue may patch
+REISSUE_FIELDS = {
+    "batch_no": "Batch No.",
+    "manufacturing_date": "Date of Manufacturing",
+    "reanalysis_date": "Date of Reanalysis",
+    "quantity": "Quantity",
+}
+
+# Fonts the renderers lay product info values out in -> the PyMuPDF built-in font
+# with the same metrics (MuPDF's built-ins are the Nimbus clones of the base-14 fonts)
+BASE14_FONTS = {
+    "Times-Roman": "tiro", "NimbusRoman-Regular": "tiro",
+    "Times-Bold": "tibo", "NimbusRoman-Bold": "tibo",
+    "Times-Italic": "tiit", "NimbusRoman-Italic": "tiit",
+    "Times-BoldItalic": "tibi", "NimbusRoman-BoldItalic": "tibi",
+    "Helvetica": "helv", "NimbusSans-Regular": "helv",
+    "Helvetica-Bold": "hebo", "NimbusSans-Bold": "hebo",
+}
+
+_SAME_LINE = 0.5
+
+
+def _lines(page):
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            yield line
+
+
+def grid_rules(page):
+    """Table grid of the page: [(x, y0, y1)] vertical and [(y, x0, x1)] horizontal rules.
+
+    ReportLab strokes its grid as line segments, MuPDF fills each border as a thin rectangle.
+    """
+    vertical, horizontal = [], []
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] == "l":
+                p1, p2 = item[1], item[2]
+                if abs(p1.x - p2.x) < 0.01:
+                    vertical.append((p1.x, min(p1.y, p2.y), max(p1.y, p2.y)))
+                elif abs(p1.y - p2.y) < 0.01:
+                    horizontal.append((p1.y, min(p1.x, p2.x), max(p1.x, p2.x)))
+            elif item[0] == "re":
+                rect = item[1]
+                if rect.width < 1 < rect.height:
+                    vertical.append(((rect.x0 + rect.x1) / 2, rect.y0, rect.y1))
+                elif rect.height < 1 < rect.width:
+                    horizontal.append(((rect.y0 + rect.y1) / 2, rect.x0, rect.x1))
+    return vertical, horizontal
+
+
+def _cell_limit(rules, rect):
+    # The text may run up to the cell's right rule less the same padding it has on the left
+    y = (rect.y0 + rect.y1) / 2
+    crossing = [x for x, y0, y1 in rules if y0 <= y <= y1]
+    left = [x for x in crossing if x <= rect.x0]
+    right = [x for x in crossing if x >= rect.x1]
+    if not left or not right:
+        return None
+    return min(right) - (rect.x0 - max(left))
+
+
+def record_placements(pdf_bytes, data):
+    """Field -> where its value is printed, for every patchable field found on a single line.
+
+    The result is JSON-serialisable, so it can be stored next to the PDF.
+    """
+    wanted = {
+        label: field for field, label in REISSUE_FIELDS.items()
+        if str(data.get(field, "") or "").strip()
+    }
+    placements = {}
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        for page_number, page in enumerate(doc):
+            lines = [line for line in _lines(page) if len(line["spans"]) == 1]
+            rules = None
+            for label_line in lines:
+                field = wanted.get(label_line["spans"][0]["text"].strip())
+                if field is None or field in placements:
+                    continue
+                label_origin = label_line["spans"][0]["origin"]
+                value = data[field].strip()
+                for line in lines:
+                    span = line["spans"][0]
+                    if (span["text"] == value and span["origin"][0] > label_origin[0]
+                            and abs(span["origin"][1] - label_origin[1]) < _SAME_LINE):
+                        break
+                else:
+                    continue
+                font = BASE14_FONTS.get(span["font"].split("+")[-1])
+                if rules is None:
+                    rules = grid_rules(page)[0]
+                limit = _cell_limit(rules, fitz.Rect(span["bbox"]))
+                if font is None or limit is None:
+                    continue
+                placements[field] = {
+                    "page": page_number,
+                    "rect": list(span["bbox"]),
+                    "origin": list(span["origin"]),
+                    "font": font,
+                    "size": span["size"],
+                    "color": span["color"],
+                    "limit": limit,
+                    "text": value,
+                }
+    finally:
+        doc.close()
+    return placements
+
+
+def _fits(placement, text):
+    width = fitz.get_text_length(text, fontname=placement["font"], fontsize=placement["size"])
+    return placement["origin"][0] + width <= placement["limit"]
+
+
+def patch_fields(pdf_bytes, placements, changes):
+    """Redact and rewrite the text runs of `changes` (field -> new value) in place.
+
+    Returns (pdf bytes, updated placements), or None when a change cannot be patched.
+    """
+    for field, text in changes.items():
+        placement = placements.get(field)
+        if placement is None or not text or not _fits(placement, text):
+            return None
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        placements = {field: dict(placement) for field, placement in placements.items()}
+        by_page = {}
+        for field in changes:
+            by_page.setdefault(placements[field]["page"], []).append(field)
+        for page_number, fields in by_page.items():
+            page = doc[page_number]
+            for field in fields:
+                # Only the middle of the line box, so glyphs of the rows above and below stay
+                rect = fitz.Rect(placements[field]["rect"])
+                inset = rect.height / 4
+                page.add_redact_annot(fitz.Rect(rect.x0, rect.y0 + inset, rect.x1, rect.y1 - inset), fill=False)
+            page.apply_redactions(
+                images=fitz.PDF_REDACT_IMAGE_NONE, graphics=fitz.PDF_REDACT_LINE_ART_NONE,
+            )
+            for field in fields:
+                placement = placements[field]
+                text = changes[field]
+                page.insert_text(
+                    placement["origin"], text,
+                    fontname=placement["font"], fontsize=placement["size"],
+                    color=fitz.sRGB_to_pdf(placement["color"]),
+                )
+                width = fitz.get_text_length(text, fontname=placement["font"], fontsize=placement["size"])
+                placement["rect"][2] = placement["origin"][0] + width
+                placement["text"] = text
+        return doc.tobytes(garbage=1, deflate=True), placements
+    finally:
+        doc.close()
+
+
+def reissue(pdf_bytes, placements, old_data, new_data, backend=None):
+    """PDF bytes and placements for `new_data`, patching `pdf_bytes` (rendered from
+    `old_data`) when only patchable fields changed, else rendering from scratch.
+
+    Returns (pdf bytes, placements, patched).
+    """
+    changed = {key for key in set(old_data) | set(new_data) if old_data.get(key) != new_data.get(key)}
+    if not changed:
+        return pdf_bytes, placements, True
+    if changed <= set(REISSUE_FIELDS):
+        patched = patch_fields(
+            pdf_bytes, placements, {field: str(new_data.get(field, "") or "").strip() for field in changed},
+        )
+        if patched is not None:
+            return patched[0], patched[1], True
+    pdf = get_renderer(backend).render(new_data)
+    return pdf, record_placements(pdf, new_data), False
+
+
+def placements_path(pdf_path):
+    return f"{pdf_path}.placements.json"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdf", help="the certificate to reissue")
+    parser.add_argument("record", help="JSON data dict the certificate was rendered from")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="a changed data value, e.g. reanalysis_date=12/2028 (repeatable)")
+    parser.add_argument("-o", "--output", required=True, help="the reissued PDF")
+    parser.add_argument("--record-out", help="also write the reissued data dict here")
+    parser.add_argument("--backend", choices=list(BACKENDS), default=None,
+                        help="renderer when the certificate has to be laid out again")
+    args = parser.parse_args(argv)
+
+    changes = {}
+    for assignment in args.set:
+        key, sep, value = assignment.partition("=")
+        if not sep or not key.strip():
+            parser.error(f"--set expects KEY=VALUE, got {assignment!r}")
+        changes[key.strip()] = value
+    with open(args.pdf, "rb") as f:
+        pdf_bytes = f.read()
+    with open(args.record, encoding="utf-8") as f:
+        old_data = json.load(f)
+    if not isinstance(old_data, dict):
+        print(f"{args.record}: not a JSON object", file=sys.stderr)
+        return 1
+    try:
+        with open(placements_path(args.pdf), encoding="utf-8") as f:
+            placements = json.load(f)
+    except FileNotFoundError:
+        placements = record_placements(pdf_bytes, old_data)
+
+    new_data = dict(old_data, **changes)
+    pdf, placements, patched = reissue(pdf_bytes, placements, old_data, new_data, args.backend)
+    write_atomic(args.output, pdf)
+    write_atomic(placements_path(args.output), json.dumps(placements).encode("utf-8"))
+    if args.record_out:
+        write_atomic(args.record_out, json.dumps(new_data, indent=1).encode("utf-8"))
+    print(f"{args.output}: {'patched in place' if patched else 'rendered again'}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""Contact sheets of many COAs on a few pages, for QA sign-off before shipment.
+
+    python proof_sheet.py records.ndjson -o proof.pdf [--workers 4] [--dpi 40]
+
+Each input line is one COA data dict; rendered .pdf files can be given too.
+The first page of every certificate is rendered and rasterized at low
+resolution on a process pool, and the thumbnails are tiled into landscape pages captioned with the batch number; certificates
+with out-of-specification results get a red frame and their failure count.
+Thumbnails are cached on disk by data hash and [coa] layout, so a re-run only
+rasterizes the certificates that changed.
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+from coa_data import data_hash
+from coa_settings import VAR_DIR, layout_digest
+from coa_validate import check_batch
+from compliance import evaluate_batch
+from renderers import BACKENDS, DEFAULT_BACKEND, get_renderer
+
+DEFAULT_CACHE_DIR = os.path.join(VAR_DIR, "proof_cache")
+
+SHEET_RECT = fitz.paper_rect("a4-l")
+SHEET_MARGIN = 24
+SHEET_HEADER = 18
+CAPTION_HEIGHT = 11
+CELL_GAP = 6
+FAIL_COLOR = (0.85, 0, 0)
+
+
+def rasterize_first_page(pdf_bytes, dpi):
+    """PNG bytes of the first page of a PDF at `dpi`."""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return doc[0].get_pixmap(dpi=dpi).tobytes("png")
+
+
+def thumbnail_from_data(data, backend, dpi):
+    """Worker: render one certificate and rasterize its first page."""
+    return rasterize_first_page(get_renderer(backend).render(data, deterministic=True), dpi)
+
+
+def thumbnail_from_file(path, dpi):
+    """Worker: rasterize the first page of a PDF file."""
+    with open(path, "rb") as f:
+        return rasterize_first_page(f.read(), dpi)
+
+
+class RasterCache:
+    """Thumbnail PNGs on disk, one file per cache key."""
+
+    def __init__(self, path=DEFAULT_CACHE_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.png")
+
+    def get(self, key):
+        try:
+            with open(self._file(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, png):
+        tmp_path = f"{self._file(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(png)
+        os.replace(tmp_path, self._file(key))
+
+
+class ProofEntry:
+    """One certificate on the sheet: its caption, failure count and how to rasterize it."""
+
+    def __init__(self, label, fail_count, cache_key, job, *job_args):
+        self.label = label
+        self.fail_count = fail_count
+        self.cache_key = cache_key
+        self.job = job
+        self.job_args = job_args
+
+
+def entries_from_data(data_list, backend=DEFAULT_BACKEND, dpi=40):
+    compliance = evaluate_batch(data_list)
+    return [
+        ProofEntry(
+            str(data.get("batch_no", "") or "").strip() or data.get("product_name", ""),
+            int(compliance.fail_count[i]),
+            # The same data looks different once the [coa] layout in the settings changes
+            f"{backend}-{dpi}-{layout_digest(data)}-{data_hash(data)}",
+            thumbnail_from_data, data, backend, dpi,
+        )
+        for i, data in enumerate(data_list)
+    ]
+
+
+def entries_from_files(paths, dpi=40):
+    # Out-of-spec results are only known from the data; files are shown without highlights
+    entries = []
+    for path in paths:
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        label = os.path.splitext(os.path.basename(path))[0]
+        entries.append(ProofEntry(label, 0, f"file-{dpi}-{digest}", thumbnail_from_file, path, dpi))
+    return entries
+
+
+def read_records(path):
+    """Data dicts of an NDJSON file, or of stdin for "-"; ValueError names the first bad line."""
+    records = []
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    with stream:
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                raise ValueError(f"{path}, line {line_no}: invalid JSON: {exc}") from None
+            if not isinstance(record, dict):
+                raise ValueError(f"{path}, line {line_no}: record is not a JSON object")
+            records.append(record)
+    return records
+
+
+def thumbnails(entries, workers=None, cache=None):
+    """PNG thumbnail of every entry, from the cache or rasterized on a process pool."""
+    images = [cache.get(entry.cache_key) if cache else None for entry in entries]
+    missing = [i for i, png in enumerate(images) if png is None]
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(entries[i].job, *entries[i].job_args) for i in missing]
+            for i, future in zip(missing, futures):
+                images[i] = future.result()
+                if cache:
+                    cache.put(entries[i].cache_key, images[i])
+    return images
+
+
+def _fit(box, png):
+    # Largest rect of the PNG's aspect ratio centred at the top of `box`
+    width, height = struct.unpack(">II", png[16:24])
+    scale = min(box.width / width, box.height / height)
+    x0 = box.x0 + (box.width - width * scale) / 2
+    return fitz.Rect(x0, box.y0, x0 + width * scale, box.y0 + height * scale)
+
+
+def tile_sheets(entries, images, columns=6, rows=3, title="COA proof sheet"):
+    """PDF bytes of landscape contact sheets, columns x rows thumbnails per page."""
+    per_page = columns * rows
+    cell_w = (SHEET_RECT.width - 2 * SHEET_MARGIN) / columns
+    cell_h = (SHEET_RECT.height - 2 * SHEET_MARGIN - SHEET_HEADER) / rows
+    n_pages = max(1, -(-len(entries) // per_page))
+    n_failing = sum(1 for entry in entries if entry.fail_count)
+
+    doc = fitz.open()
+    for page_number in range(n_pages):
+        page = doc.new_page(width=SHEET_RECT.width, height=SHEET_RECT.height)
+        page.insert_text(
+            (SHEET_MARGIN, SHEET_MARGIN + 10),
+            f"{title}  -  {len(entries)} certificates, {n_failing} out of specification"
+            f"  -  page {page_number + 1} of {n_pages}",
+            fontname="hebo", fontsize=10,
+        )
+        first = page_number * per_page
+        for slot, (entry, png) in enumerate(zip(entries[first:first + per_page], images[first:first + per_page])):
+            x0 = SHEET_MARGIN + (slot % columns) * cell_w
+            y0 = SHEET_MARGIN + SHEET_HEADER + (slot // columns) * cell_h
+            box = fitz.Rect(x0 + CELL_GAP / 2, y0, x0 + cell_w - CELL_GAP / 2, y0 + cell_h - CAPTION_HEIGHT - CELL_GAP)
+            image_rect = _fit(box, png)
+            page.insert_image(image_rect, stream=png)
+            caption = entry.label
+            color = (0, 0, 0)
+            if entry.fail_count:
+                page.draw_rect(image_rect, color=FAIL_COLOR, width=2)
+                caption = f"{entry.label}  OUT OF SPEC ({entry.fail_count})"
+                color = FAIL_COLOR
+            else:
+                page.draw_rect(image_rect, color=(0.6, 0.6, 0.6), width=0.5)
+            page.insert_textbox(
+                fitz.Rect(box.x0, box.y1 + 1, box.x1, box.y1 + 1 + CAPTION_HEIGHT + 2),
+                caption, fontname="helv", fontsize=7, color=color, align=fitz.TEXT_ALIGN_CENTER,
+            )
+    pdf = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return pdf
+
+
+def build_proof_sheet(entries, workers=None, cache=None, columns=6, rows=3):
+    return tile_sheets(entries, thumbnails(entries, workers, cache), columns, rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", nargs="*", default=["-"],
+                        help="NDJSON data dicts (file or - for stdin), or rendered .pdf files")
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--dpi", type=int, default=40)
+    parser.add_argument("--columns", type=int, default=6)
+    parser.add_argument("--rows", type=int, default=3)
+    parser.add_argument("--backend", choices=list(BACKENDS), default=DEFAULT_BACKEND)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args(argv)
+
+    # PDFs and data dicts can be mixed; certificates appear in input order
+    try:
+        records = {path: read_records(path) for path in args.inputs if not path.lower().endswith(".pdf")}
+        check_batch([data for data_list in records.values() for data in data_list])
+        entries = []
+        for path in args.inputs:
+            if path in records:
+                entries.extend(entries_from_data(records[path], args.backend, args.dpi))
+            else:
+                entries.extend(entries_from_files([path], args.dpi))
+    except (OSError, ValueError) as exc:  # ValueError includes DataValidationError
+        print(exc, file=sys.stderr)
+        return 1
+
+    cache = None if args.no_cache else RasterCache(args.cache_dir)
+    with open(args.output, "wb") as f:
+        f.write(build_proof_sheet(entries, args.workers, cache, args.columns, args.rows))
+    print(f"{len(entries)} certificates, {sum(1 for e in entries if e.fail_count)} out of specification -> {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
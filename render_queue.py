@@ -0,0 +1,434 @@
+import collections
+import heapq
+import itertools
+import os
+import pickle
+import sys
+import threading
+import time
+import uuid
+
+from coa_data import data_hash
+from coa_settings import layout_digest
+from pdf_optimize import render_optimized
+from renderers import get_renderer, DEFAULT_BACKEND
+
+
+# ----------------------------------------------------------------------------
+# JOB KINDS
+#
+# Issued PDFs are rendered deterministically, so the same data dict always
+# produces the same file and downstream stores can dedupe by content hash.
+# ----------------------------------------------------------------------------
+def render_pdf_bytes(data, backend=DEFAULT_BACKEND):
+    return get_renderer(backend).render(data, deterministic=True)
+
+
+def render_optimized_pdf(data, backend=DEFAULT_BACKEND):
+    # Only the app asks for this kind; it shows the size saved against the standard profile
+    return render_optimized(data, backend, deterministic=True, compare=True)
+
+
+RENDERERS = {
+    "pdf": render_pdf_bytes,
+    "pdf_optimized": render_optimized_pdf,
+}
+
+def result_size(result):
+    if result is None:
+        return 0
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    if hasattr(result, "pdf"):  # OptimizedPdf
+        return len(result.pdf)
+    return len(pickle.dumps(result))
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# ----------------------------------------------------------------------------
+# PRIORITY CLASSES
+#
+# A queued job of a lower class always starts before one of a higher class.
+# Bulk work (overnight reissues, batch renders) never takes the workers kept
+# back for interactive jobs, so a Compile click only ever waits behind other
+# interactive renders; since each document of a batch is its own job, a batch
+# gives way to an interactive job at the next document boundary.
+# ----------------------------------------------------------------------------
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal", BULK: "bulk"}
+
+# A job whose deadline is this close is started ahead of the other non-bulk classes
+URGENT_SECONDS = 60
+
+# Wait times kept per class for the metrics
+WAIT_SAMPLES = 512
+
+
+class RenderJob:
+    """One render request. A finished result may be evicted from memory: it is then
+    read back from its spill file, or rendered again from the kept data dict, which
+    gives the same bytes because issued PDFs are deterministic."""
+
+    def __init__(self, job_id, kind, key, data=None, backend=DEFAULT_BACKEND,
+                 priority=NORMAL, owner=None, deadline=None, callback=None):
+        self.job_id = job_id
+        self.kind = kind
+        self.key = key
+        self.data = data
+        self.backend = backend
+        self.priority = priority
+        self.owner = owner
+        self.deadline = deadline  # time.monotonic() value, or None
+        self.callback = callback
+        self.state = QUEUED
+        self._result = None
+        self.spill_path = None
+        self.error = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self._generation = 0  # bumped when the job is re-queued under a new priority or deadline
+
+    @property
+    def finished(self):
+        return self.state in (DONE, FAILED)
+
+    @property
+    def result(self):
+        result = self._result
+        if result is not None or self.state != DONE:
+            return result
+        if self.spill_path is not None:
+            try:
+                with open(self.spill_path, "rb") as f:
+                    return pickle.load(f)
+            except (OSError, pickle.UnpicklingError):
+                pass  # spill file lost; render it again below
+        return RENDERERS[self.kind](self.data, self.backend)
+
+    @result.setter
+    def result(self, value):
+        self._result = value
+
+    @property
+    def in_memory(self):
+        return self._result is not None
+
+    def memory_bytes(self):
+        """Size of the result held in memory (0 once evicted)."""
+        return result_size(self._result)
+
+    def waited(self):
+        """Seconds between submission and the start of rendering (so far, if still queued)."""
+        return (self.started_at or time.monotonic()) - self.submitted_at
+
+    @property
+    def missed_deadline(self):
+        return self.deadline is not None and (self.finished_at or time.monotonic()) > self.deadline
+
+    def elapsed(self):
+        end = self.finished_at or time.monotonic()
+        return end - self.submitted_at
+
+
+def _chain(first, second):
+    if first is None:
+        return second
+
+    def both(job):
+        first(job)
+        second(job)
+    return both
+
+
+# ----------------------------------------------------------------------------
+# BACKGROUND RENDER QUEUE
+# ----------------------------------------------------------------------------
+class RenderQueue:
+    """Renders COAs on background threads so a Streamlit script run never waits on doc.build.
+
+    Submitting the same data dict for the same kind and backend while an earlier job is still
+    queued, running or kept in the finished history returns the existing job id (a queued job
+    moves up to the more urgent of the two priorities and deadlines).
+
+    Queued jobs are started in this order: interactive and normal jobs within URGENT_SECONDS
+    of their deadline, by deadline; then by priority class; within a class, jobs with a deadline by deadline, then
+    the owner (a browser session or a batch) that has had the least render time so far, first
+    in first out per owner. Bulk jobs may use at most max_workers - reserved_interactive
+    workers at once.
+
+    Finished results stay in memory until evict() moves them to spill_dir (or just drops
+    them when spill_dir is None); job.result then loads or re-renders them on demand.
+    """
+
+    def __init__(self, max_workers=2, max_finished=64, spill_dir=None, reserved_interactive=1):
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._jobs = {}
+        self._by_key = {}
+        self._finished_order = []
+        self._max_finished = max_finished
+        self.spill_dir = spill_dir
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+        self.max_workers = max_workers
+        self.bulk_limit = max(1, max_workers - reserved_interactive)
+        self._seq = itertools.count()
+        self._deadlines = {priority: [] for priority in PRIORITY_NAMES}  # priority -> heap of (deadline, seq, generation, job)
+        self._fifo = {priority: {} for priority in PRIORITY_NAMES}  # priority -> owner -> deque of (generation, job)
+        self._served = {}  # owner -> render seconds, for fair share
+        self._owner_jobs = collections.Counter()  # owner -> jobs queued or running
+        self._running = {priority: 0 for priority in PRIORITY_NAMES}
+        self._waits = {priority: collections.deque(maxlen=WAIT_SAMPLES) for priority in PRIORITY_NAMES}
+        self._completed = {priority: 0 for priority in PRIORITY_NAMES}
+        self._missed = {priority: 0 for priority in PRIORITY_NAMES}
+        self._stopping = False
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"coa-render-{i}", daemon=True) for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, data, kind="pdf", backend=DEFAULT_BACKEND, priority=NORMAL, owner=None,
+               deadline=None, callback=None):
+        """Queue a render; returns its job id.
+
+        deadline is in seconds from now; callback(job) is called on the worker thread once the
+        job has finished, before it can be retired from the history.
+        """
+        if kind not in RENDERERS:
+            raise ValueError(f"Unknown render kind: {kind}")
+        if priority not in PRIORITY_NAMES:
+            raise ValueError(f"Unknown priority: {priority}")
+        get_renderer(backend)  # unknown backends fail here rather than in the worker
+        # The same data renders differently once its [coa] layout changes
+        key = (kind, backend, layout_digest(data), data_hash(data))
+        deadline_at = None if deadline is None else time.monotonic() + deadline
+        with self._work:
+            job = self._by_key.get(key)
+            if job is not None and job.state != FAILED:
+                if job.state == QUEUED:
+                    self._requeue(job, priority, deadline_at)
+                if callback is not None and not job.finished:
+                    job.callback = _chain(job.callback, callback)
+                    callback = None
+            else:
+                job = RenderJob(uuid.uuid4().hex, kind, key, data, backend, priority, owner, deadline_at, callback)
+                self._jobs[job.job_id] = job
+                self._by_key[key] = job
+                self._owner_jobs[owner] += 1
+                self._enqueue(job)
+                callback = None
+        if callback is not None:  # an identical job had already finished
+            callback(job)
+        return job.job_id
+
+    def submit_batch(self, data_list, kind="pdf", backend=DEFAULT_BACKEND, priority=BULK, owner=None,
+                     deadline=None, callback=None):
+        """Queue one job per data dict as a single fair-share owner; returns the job ids in order."""
+        owner = owner or f"batch:{uuid.uuid4().hex[:8]}"
+        return [self.submit(data, kind, backend, priority, owner, deadline, callback) for data in data_list]
+
+    # Scheduling; every method below runs with self._lock held
+
+    def _enqueue(self, job):
+        if job.owner not in self._served:
+            # A newcomer starts level with the least served owner instead of owing nothing
+            self._served[job.owner] = min(self._served.values(), default=0.0)
+        if job.deadline is not None:
+            heapq.heappush(self._deadlines[job.priority], (job.deadline, next(self._seq), job._generation, job))
+        else:
+            self._fifo[job.priority].setdefault(job.owner, collections.deque()).append((job._generation, job))
+        self._work.notify()
+
+    def _requeue(self, job, priority, deadline_at):
+        priority = min(priority, job.priority)
+        if deadline_at is not None and job.deadline is not None:
+            deadline_at = min(deadline_at, job.deadline)
+        deadline_at = deadline_at if deadline_at is not None else job.deadline
+        if priority == job.priority and deadline_at == job.deadline:
+            return
+        job.priority = priority
+        job.deadline = deadline_at
+        job._generation += 1  # the old queue entry is skipped when reached
+        self._enqueue(job)
+
+    @staticmethod
+    def _current(entry_generation, job):
+        return job.state == QUEUED and job._generation == entry_generation
+
+    def _deadline_head(self, priority):
+        """Earliest-deadline job queued in the class, or None; stale entries are dropped."""
+        heap = self._deadlines[priority]
+        while heap and not self._current(heap[0][2], heap[0][3]):
+            heapq.heappop(heap)
+        return heap[0][3] if heap else None
+
+    def _pick(self):
+        """Take the next job to start off the queue, or return None."""
+        # Bulk deadlines only order the bulk class: bulk work never goes ahead of a Compile click
+        heads = [self._deadline_head(priority) for priority in PRIORITY_NAMES if priority != BULK]
+        urgent = [job for job in heads if job is not None and job.deadline - time.monotonic() <= URGENT_SECONDS]
+        if urgent:
+            job = min(urgent, key=lambda job: job.deadline)
+            heapq.heappop(self._deadlines[job.priority])
+            return job
+        for priority in sorted(PRIORITY_NAMES):
+            if priority == BULK and self._running[BULK] >= self.bulk_limit:
+                return None
+            if self._deadline_head(priority) is not None:
+                return heapq.heappop(self._deadlines[priority])[3]
+            owners = self._fifo[priority]
+            while owners:
+                owner = min(owners, key=lambda o: self._served.get(o, 0.0))
+                queue = owners[owner]
+                while queue and not self._current(*queue[0]):
+                    queue.popleft()
+                if not queue:
+                    del owners[owner]
+                    continue
+                job = queue.popleft()[1]
+                if not queue:
+                    del owners[owner]
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._work:
+                job = self._pick()
+                while job is None:
+                    if self._stopping:
+                        return
+                    self._work.wait()
+                    job = self._pick()
+                job.state = RUNNING
+                job.started_at = time.monotonic()
+                self._running[job.priority] += 1
+                self._waits[job.priority].append(job.started_at - job.submitted_at)
+            self._run(job, job.data, job.backend)
+            with self._work:
+                self._running[job.priority] -= 1
+                self._completed[job.priority] += 1
+                if job.missed_deadline:
+                    self._missed[job.priority] += 1
+                self._owner_jobs[job.owner] -= 1
+                if self._owner_jobs[job.owner]:
+                    self._served[job.owner] += job.finished_at - job.started_at
+                else:  # nothing left queued or running for this owner
+                    del self._owner_jobs[job.owner]
+                    del self._served[job.owner]
+                self._work.notify_all()
+            self._retire(job)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def queue_position(self, job_id):
+        """Number of queued jobs ahead of job_id: those of a more urgent class, and those of
+        its own class submitted earlier (0 when running or finished)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.state != QUEUED:
+                return 0
+            return sum(
+                1 for other in self._jobs.values()
+                if other.state == QUEUED and (other.priority, other.submitted_at) < (job.priority, job.submitted_at)
+            )
+
+    def metrics(self):
+        """Per priority class name: queued and running jobs, jobs completed, deadlines missed,
+        and the mean, p50, p95 and max wait (seconds from submission to start) of recent jobs."""
+        with self._lock:
+            queued = collections.Counter(job.priority for job in self._jobs.values() if job.state == QUEUED)
+            metrics = {}
+            for priority, name in PRIORITY_NAMES.items():
+                waits = sorted(self._waits[priority])
+                metrics[name] = {
+                    "queued": queued[priority],
+                    "running": self._running[priority],
+                    "completed": self._completed[priority],
+                    "deadlines_missed": self._missed[priority],
+                    "wait_mean": sum(waits) / len(waits) if waits else 0.0,
+                    "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+                    "wait_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                    "wait_max": waits[-1] if waits else 0.0,
+                }
+        return metrics
+
+    def memory_bytes(self):
+        """Bytes of finished results currently held in memory."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return sum(job.memory_bytes() for job in jobs)
+
+    def evict(self, job_id):
+        """Move a finished result out of memory; returns the bytes freed."""
+        job = self.get(job_id)
+        if job is None or job.state != DONE:
+            return 0
+        result = job._result
+        if result is None:
+            return 0
+        if self.spill_dir and job.spill_path is None:
+            path = os.path.join(self.spill_dir, f"{job.job_id}.pickle")
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+                job.spill_path = path
+            except OSError:
+                pass  # disk full or read-only: drop it, it can be rendered again
+        job._result = None
+        return result_size(result)
+
+    def _run(self, job, data, backend):
+        try:
+            result, error = RENDERERS[job.kind](data, backend), None
+        except Exception as exc:  # surfaced to the UI through job.error
+            result, error = None, exc
+        with self._lock:
+            # Under the lock, so a callback added by submit() is either seen here or run there
+            job.result = result
+            job.error = error
+            job.state = FAILED if error is not None else DONE
+            job.finished_at = time.monotonic()
+            callback = job.callback
+        if callback is not None:
+            try:
+                callback(job)
+            except Exception as exc:  # a failing callback must not take the worker down
+                print(f"render callback for job {job.job_id} failed: {exc!r}", file=sys.stderr)
+
+    def _retire(self, job):
+        with self._lock:
+            self._finished_order.append(job.job_id)
+            while len(self._finished_order) > self._max_finished:
+                old = self._jobs.pop(self._finished_order.pop(0), None)
+                if old is None:
+                    continue
+                if self._by_key.get(old.key) is old:
+                    del self._by_key[old.key]
+                if old.spill_path is not None:
+                    try:
+                        os.remove(old.spill_path)
+                    except OSError:
+                        pass
+
+    def shutdown(self, wait=True):
+        """Stop the workers once the queue is empty."""
+        with self._work:
+            self._stopping = True
+            self._work.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
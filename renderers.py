@@ -0,0 +1,53 @@
+from fast_render import render_fast
+from pdf_generator import generate_pdf
+from story_render import render_story
+
+
+# ----------------------------------------------------------------------------
+# RENDERER BACKENDS
+#
+# Every backend turns the same data dict into the same single-page COA; the
+# render queue, batch tools and the app pick one by name per request.
+# ----------------------------------------------------------------------------
+class Renderer:
+    name = None
+    description = ""
+
+    def render(self, data, optimize=False, deterministic=False):
+        """PDF bytes for one COA; with deterministic=True identical data gives identical bytes."""
+        raise NotImplementedError
+
+
+class ReportLabRenderer(Renderer):
+    name = "reportlab"
+    description = "ReportLab platypus (reference layout)"
+
+    def render(self, data, optimize=False, deterministic=False):
+        return generate_pdf(data, optimize=optimize, deterministic=deterministic).getvalue()
+
+
+class CanvasRenderer(Renderer):
+    name = "reportlab_canvas"
+    description = "ReportLab canvas, fixed layout (falls back to platypus)"
+
+    def render(self, data, optimize=False, deterministic=False):
+        return render_fast(data, optimize=optimize, deterministic=deterministic).getvalue()
+
+
+class StoryRenderer(Renderer):
+    name = "pymupdf"
+    description = "PyMuPDF Story (HTML/CSS)"
+
+    def render(self, data, optimize=False, deterministic=False):
+        return render_story(data, optimize=optimize, deterministic=deterministic).getvalue()
+
+
+BACKENDS = {backend.name: backend for backend in (ReportLabRenderer(), CanvasRenderer(), StoryRenderer())}
+DEFAULT_BACKEND = ReportLabRenderer.name
+
+
+def get_renderer(name=None):
+    try:
+        return BACKENDS[name or DEFAULT_BACKEND]
+    except KeyError:
+        raise ValueError(f"Unknown renderer backend: {name}") from None
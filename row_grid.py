@@ -0,0 +1,67 @@
+import csv
+import io
+
+import pandas as pd
+
+# ----------------------------------------------------------------------------
+# GRID EDITING OF EXTRA ROWS
+#
+# A large row panel (a 150-analyte pesticide screen) is edited as one
+# st.data_editor instead of four text inputs and a Delete button per row.
+# These helpers convert between the session_state row dicts and the editor's
+# DataFrame, and parse rows pasted from a spreadsheet or a LIMS export.
+# ----------------------------------------------------------------------------
+SPEC_ROW_COLUMNS = [("param", "Parameter"), ("spec", "Specification"), ("result", "Result"), ("method", "Method")]
+PRODUCT_ROW_COLUMNS = [("label", "Label"), ("value", "Value")]
+
+# Rows are printed in this column's order; editing it moves a row
+ORDER_COLUMN = "Order"
+
+# Panels with more rows than this open as a grid
+GRID_ROWS_THRESHOLD = 20
+
+
+def rows_to_frame(rows, columns):
+    """Editor DataFrame of session_state row dicts, numbered 1..n in the Order column."""
+    frame = pd.DataFrame(
+        [[str(row.get(key, "") or "") for key, _ in columns] for row in rows],
+        columns=[label for _, label in columns],
+        dtype=object,
+    )
+    frame.insert(0, ORDER_COLUMN, range(1, len(rows) + 1))
+    return frame
+
+
+def frame_to_rows(frame, columns):
+    """Row dicts of an edited DataFrame, sorted by Order (ties keep grid order); blank rows dropped."""
+    ordered = frame.assign(_position=range(len(frame)))
+    ordered = ordered.sort_values([ORDER_COLUMN, "_position"], na_position="last", kind="stable")
+    rows = []
+    for values in ordered[[label for _, label in columns]].itertuples(index=False):
+        row = {key: "" if pd.isna(value) else str(value).strip() for (key, _), value in zip(columns, values)}
+        if any(row.values()):
+            rows.append(row)
+    return rows
+
+
+def parse_pasted_rows(text, columns):
+    """Row dicts of text pasted from a spreadsheet (tab separated) or a CSV file.
+
+    Cells beyond the panel's columns are ignored and missing cells are left blank; a
+    first line that repeats the column labels is skipped.
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return []
+    delimiter = "\t" if any("\t" in line for line in lines) else ","
+    records = list(csv.reader(io.StringIO("\n".join(lines)), delimiter=delimiter))
+    labels = [label.lower() for _, label in columns]
+    if [cell.strip().lower() for cell in records[0][:len(labels)]] == labels:
+        records = records[1:]
+    rows = []
+    for record in records:
+        cells = [cell.strip() for cell in record] + [""] * len(columns)
+        row = {key: cells[i] for i, (key, _) in enumerate(columns)}
+        if any(row.values()):
+            rows.append(row)
+    return rows
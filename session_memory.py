@@ -0,0 +1,117 @@
+import os
+import sys
+import threading
+import time
+
+from coa_settings import VAR_DIR
+
+# ----------------------------------------------------------------------------
+# PER-SESSION MEMORY ACCOUNTING
+#
+# Every script run reports its session state and the render jobs it refers
+# to. A session over the cap has its finished PDFs evicted from the render
+# queue (spilled to disk, or dropped and rendered again when they are next
+# needed), and sessions idle for longer than the idle timeout are
+# forgotten after their results are evicted the same way.
+# ----------------------------------------------------------------------------
+DEFAULT_CAP_MB = 16
+DEFAULT_IDLE_MINUTES = 30
+DEFAULT_SPILL_DIR = os.path.join(VAR_DIR, "spill")
+
+
+def deep_size(obj, seen=None):
+    """Approximate bytes held by obj and everything it contains."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if hasattr(obj, "memory_usage"):  # DataFrame, e.g. a grid editor's frame
+        return int(obj.memory_usage(deep=True).sum())
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_size(vars(obj), seen)
+    return size
+
+
+class SessionUsage:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.state_bytes = 0
+        self.result_bytes = 0
+        self.job_ids = ()
+        self.last_seen = time.monotonic()
+        self.evictions = 0
+
+    @property
+    def total_bytes(self):
+        return self.state_bytes + self.result_bytes
+
+    def idle_seconds(self, now=None):
+        return (now or time.monotonic()) - self.last_seen
+
+
+class SessionMemory:
+    """Memory held per browser session, kept under a cap by evicting render results."""
+
+    def __init__(self, render_queue, cap_mb=DEFAULT_CAP_MB, idle_minutes=DEFAULT_IDLE_MINUTES):
+        self.render_queue = render_queue
+        self.cap_bytes = int(cap_mb * 1024 * 1024)
+        self.idle_seconds = idle_minutes * 60
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def _result_bytes(self, job_ids):
+        total = 0
+        for job_id in job_ids:
+            job = self.render_queue.get(job_id)
+            if job is not None:
+                total += job.memory_bytes()
+        return total
+
+    def record(self, session_id, session_state, job_ids):
+        """Account one script run of a session; returns its SessionUsage after any eviction."""
+        job_ids = tuple(job_id for job_id in job_ids if job_id)
+        state_bytes = deep_size(session_state)
+        with self._lock:
+            usage = self._sessions.get(session_id)
+            if usage is None:
+                usage = self._sessions[session_id] = SessionUsage(session_id)
+            usage.state_bytes = state_bytes
+            usage.job_ids = job_ids
+            usage.last_seen = time.monotonic()
+        usage.result_bytes = self._result_bytes(job_ids)
+        if usage.total_bytes > self.cap_bytes:
+            for job_id in job_ids:
+                self.render_queue.evict(job_id)
+            usage.evictions += 1
+            usage.result_bytes = self._result_bytes(job_ids)
+        self.reclaim_idle()
+        return usage
+
+    def reclaim_idle(self):
+        """Evict the results of sessions idle past the timeout and forget them; returns how many."""
+        now = time.monotonic()
+        with self._lock:
+            idle = [usage for usage in self._sessions.values() if usage.idle_seconds(now) > self.idle_seconds]
+            for usage in idle:
+                del self._sessions[usage.session_id]
+            # A result shared with a live session (same data) stays in memory
+            live_jobs = {job_id for usage in self._sessions.values() for job_id in usage.job_ids}
+        for usage in idle:
+            for job_id in usage.job_ids:
+                if job_id not in live_jobs:
+                    self.render_queue.evict(job_id)
+        return len(idle)
+
+    def usage(self):
+        """SessionUsage of every tracked session, largest first; result sizes are refreshed."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for usage in sessions:
+            usage.result_bytes = self._result_bytes(usage.job_ids)
+        return sorted(sessions, key=lambda usage: usage.total_bytes, reverse=True)
@@ -0,0 +1,53 @@
+import io
+
+import fitz  # PyMuPDF
+
+from coa_html import coa_html, COA_CSS, GRID_RULE
+from coa_settings import coa_layout
+from pdf_generator import stamp_skeleton, document_id, PAGE_TOP_MARGIN, PAGE_BOTTOM_MARGIN
+
+# Same content frame as generate_pdf: 1 inch side margins plus 6pt frame padding
+PAGE_RECT = fitz.paper_rect("a4")
+CONTENT_RECT = fitz.Rect(
+    72 + 6, PAGE_TOP_MARGIN + 6,
+    PAGE_RECT.width - 72 - 6, PAGE_RECT.height - PAGE_BOTTOM_MARGIN - 6,
+)
+
+# COA_CSS is scoped to the .coa root so it can share a page with other HTML; a Story
+# is a page of its own, whose default body margin would offset the tables
+_STORY_CSS = "body { margin: 0; }" + COA_CSS
+
+# Tall enough for any certificate, so a single placement holds the whole body
+_MEASURE_HEIGHT = 100000
+
+
+def render_story(data, optimize=False, check_compliance=True, deterministic=False):
+    """Render one COA with PyMuPDF's HTML Story engine, into a BytesIO.
+
+    Like KeepInFrame, a certificate taller than the content frame is scaled down to
+    fit it. The logo and footer come from the cached skeleton_template page.
+    """
+    story = fitz.Story(html=coa_html(data, check_compliance), user_css=_STORY_CSS)
+    # Width of the laid-out body: the tables plus the outer half of their grid rules
+    body_width = coa_layout(data).spec_table_width + GRID_RULE
+    # The body is laid out exactly as wide as its tables; centring that column in the
+    # (scaled) frame centres the tables and titles the way platypus does
+    _, filled = story.place(fitz.Rect(0, 0, body_width, _MEASURE_HEIGHT))
+    scale = max(1.0, fitz.Rect(filled).y1 / CONTENT_RECT.height)
+    x = CONTENT_RECT.x0 + (CONTENT_RECT.width - body_width / scale) / 2
+
+    buffer = io.BytesIO()
+    writer = fitz.DocumentWriter(buffer)
+    device = writer.begin_page(PAGE_RECT)
+    story.draw(device, fitz.Matrix(1 / scale, 0, 0, 1 / scale, x, CONTENT_RECT.y0))
+    writer.end_page()
+    writer.close()
+    # DocumentWriter output carries no /ID, so deterministic output gets the data-derived one
+    pdf = stamp_skeleton(buffer.getvalue(), optimize, deterministic, document_id(data) if deterministic else None)
+    if optimize:
+        # MuPDF embeds the whole of each built-in font it lays text out with
+        doc = fitz.open(stream=pdf, filetype="pdf")
+        doc.subset_fonts()
+        pdf = doc.tobytes(garbage=3, deflate=True, no_new_id=deterministic)
+        doc.close()
+    return io.BytesIO(pdf)
@@ -0,0 +1,80 @@
+import socketserver
+import threading
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """Just enough of an SMTP server to accept mail and count it.
+
+    `refuse` maps recipient addresses to the reply their RCPT gets (e.g. "450 mailbox
+    busy"); every `fail_every`-th message is answered with `fail_reply` after DATA.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, fail_every=0, fail_reply="451 try again later", refuse=None):
+        super().__init__(("127.0.0.1", 0), SmtpSinkHandler)
+        self.fail_every = fail_every
+        self.fail_reply = fail_reply
+        self.refuse = dict(refuse or {})
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.received = 0
+        self.transactions = 0
+        self.deliveries = []  # accepted recipients of each received message
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class SmtpSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        sink = self.server
+        with sink.lock:
+            sink.connections += 1
+        self.reply("220 sink ready")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii", "replace").strip()
+            verb = command.upper()
+            if verb.startswith("EHLO"):
+                self.wfile.write(b"250-sink\r\n250-8BITMIME\r\n250 SIZE 52428800\r\n")
+            elif verb.startswith(("MAIL", "RSET")):
+                recipients = []
+                self.reply("250 OK")
+            elif verb.startswith("RCPT"):
+                address = command.partition("<")[2].partition(">")[0]
+                refusal = sink.refuse.get(address)
+                if refusal is None:
+                    recipients.append(address)
+                self.reply(refusal or "250 OK")
+            elif verb.startswith(("HELO", "NOOP")):
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 end with .")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                with sink.lock:
+                    sink.transactions += 1
+                    fail = sink.fail_every and sink.transactions % sink.fail_every == 0
+                    if not fail:
+                        sink.received += 1
+                        sink.deliveries.append(recipients)
+                recipients = []
+                self.reply(sink.fail_reply if fail else "250 queued")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
@@ -0,0 +1,38 @@
+from analytics import AnalyticsStore
+
+
+def data(batch_no, salmonella, moisture):
+    return {
+        "product_code": "AS01",
+        "batch_no": batch_no,
+        "moisture_spec": "NMT 5%", "moisture_result": moisture, "moisture_method": "USP",
+        "microbio_extra_rows": [["Salmonella", "Absent/10g", salmonella, "USP"]],
+    }
+
+
+def test_non_numeric_results_count_as_out_of_spec(tmp_path):
+    store = AnalyticsStore(str(tmp_path / "analytics.sqlite3"))
+    assert store.record_issue(data("B1", "Absent", "3.1%"))
+    assert store.record_issue(data("B2", "Present", "6.0%"))
+    assert not store.record_issue(data("B2", "Present", "6.0%"))  # same data: recorded once
+
+    salmonella = store.summary("AS01", "Salmonella")
+    assert salmonella.out_of_spec == 1
+    assert salmonella.count == 0  # neither result is a number
+
+    moisture = store.summary("AS01", "moisture")
+    assert (moisture.count, moisture.out_of_spec) == (2, 1)
+    assert moisture.min == 3.1 and moisture.max == 6.0
+
+
+def test_censored_results_are_counted_apart_from_the_mean(tmp_path):
+    store = AnalyticsStore(str(tmp_path / "analytics.sqlite3"))
+    store.record_issue(data("B1", "Absent", "3.0%"))
+    store.record_issue(data("B2", "Absent", "<1%"))
+    store.record_issue(data("B3", "Absent", "5.0%"))
+
+    moisture = store.summary("AS01", "moisture")
+    assert (moisture.count, moisture.censored) == (2, 1)
+    assert moisture.mean == 4.0 and moisture.min == 3.0
+    (day, daily), = store.trend("AS01", "moisture")
+    assert (daily.count, daily.censored) == (2, 1)
@@ -0,0 +1,80 @@
+import io
+import json
+import os
+
+import pytest
+
+from coa_cli import JournalState, output_name, read_journal, render_key, run
+from samples import sample_data
+
+
+def entry(line, status, key="k", **extra):
+    return {"line": line, "status": status, "hash": key, **extra}
+
+
+def write_journal(path, entries, tail=""):
+    path.write_text("".join(json.dumps(e) + "\n" for e in entries) + tail, encoding="utf-8")
+
+
+def test_journal_state_tracks_done_failed_and_permanent_records():
+    state = JournalState()
+    for e in [{"run": {"input": "in.ndjson"}}, entry(1, "ok"), entry(2, "skipped", "j"), entry(3, "error"),
+              entry(3, "error"), entry(4, "error", None, permanent=True), entry(5, "error"), entry(5, "ok")]:
+        state.record(e)
+    assert state.run == {"input": "in.ndjson"}
+    assert state.done == {1: "k", 2: "j", 5: "k"}
+    assert state.failures == {(3, "k"): 2, (5, "k"): 1}
+    assert state.permanent == {(4, None)}
+
+
+def test_read_journal_without_a_journal(tmp_path):
+    state = read_journal(str(tmp_path / "journal.ndjson"))
+    assert state.run is None and state.done == {}
+
+
+@pytest.mark.parametrize("tail", ['{"line": 3, "status": "o', '{"line": 3, "status": "ok", "hash"\n'],
+                         ids=["unterminated", "garbled"])
+def test_read_journal_cuts_off_a_torn_last_line(tmp_path, tail):
+    path = tmp_path / "journal.ndjson"
+    entries = [{"run": {"input": "-"}}, entry(1, "ok"), entry(2, "error")]
+    write_journal(path, entries, tail)
+    state = read_journal(str(path))
+    assert state.done == {1: "k"} and state.failures == {(2, "k"): 1}
+    # The torn line is gone, so entries appended by the resumed run start on a line of their own
+    assert path.read_text(encoding="utf-8") == "".join(json.dumps(e) + "\n" for e in entries)
+
+
+def records_input(records):
+    return io.StringIO("".join(json.dumps(r) + "\n" for r in records))
+
+
+def test_resume_after_a_truncated_journal_renders_only_what_is_missing(tmp_path):
+    records = [sample_data(i) for i in range(3)]
+    out_dir = tmp_path / "out"
+    counts = run(records_input(records), str(out_dir), workers=1, max_in_flight=2)
+    assert counts["ok"] == 3
+    pdfs = {r["batch_no"]: (out_dir / output_name(r)).read_bytes() for r in records}
+
+    # The process died while journalling the second record, before the third was written
+    journal = out_dir / "journal.ndjson"
+    lines = journal.read_text(encoding="utf-8").splitlines(keepends=True)
+    by_line = {json.loads(l).get("line"): l for l in lines}
+    journal.write_text(by_line[None] + by_line[1] + by_line[2][:20], encoding="utf-8")
+    os.remove(out_dir / output_name(records[2]))
+
+    counts = run(records_input(records), str(out_dir), workers=1, max_in_flight=2, resume=True)
+    assert counts == {"ok": 1, "skipped": 1, "error": 0, "resumed": 1, "given_up": 0}
+    assert {r["batch_no"]: (out_dir / output_name(r)).read_bytes() for r in records} == pdfs
+    state = read_journal(str(journal))
+    assert state.done == {i + 1: render_key(r) for i, r in enumerate(records)}
+
+
+def test_resume_gives_up_on_invalid_and_repeatedly_failing_records(tmp_path):
+    records = [sample_data(0), sample_data(1)]
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    write_journal(out_dir / "journal.ndjson",
+                  [{"run": {"input": "-"}}, entry(1, "error", render_key(records[0]), permanent=True)]
+                  + [entry(2, "error", render_key(records[1]), attempt=n) for n in (1, 2)])
+    counts = run(records_input(records), str(out_dir), workers=1, max_in_flight=2, resume=True, max_attempts=2)
+    assert counts["given_up"] == 2 and counts["ok"] == 0
@@ -0,0 +1,50 @@
+from html.parser import HTMLParser
+
+from coa_html import preview_html
+from samples import sample_data
+
+
+class ElementText(HTMLParser):
+    """Text inside each element, keyed by tag name."""
+
+    def __init__(self):
+        super().__init__()
+        self.open_tags = []
+        self.text = {}
+
+    def handle_starttag(self, tag, attrs):
+        self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.open_tags:
+            del self.open_tags[len(self.open_tags) - 1 - self.open_tags[::-1].index(tag):]
+
+    def handle_data(self, data):
+        for tag in self.open_tags:
+            self.text.setdefault(tag, []).append(data)
+
+
+def parsed_preview(data):
+    parser = ElementText()
+    parser.feed(preview_html(data))
+    return parser
+
+
+def test_preview_renders_inline_markup_as_elements():
+    data = sample_data(0)
+    data["chemical_name"] = "Withanolides <i>x</i>"
+    data["physical_extra_rows"] = [["Odour", "H<sub>2</sub>O &amp; salt", "Complies", "Organoleptic"]]
+    html = preview_html(data)
+    assert "&lt;i&gt;" not in html and "&amp;amp;" not in html
+    preview = parsed_preview(data)
+    assert "x" in preview.text["i"]
+    assert "2" in preview.text["sub"]
+    assert "O & salt" in preview.text["td"]
+
+
+def test_preview_escapes_text_that_is_not_markup():
+    data = sample_data(0)
+    data["chemical_name"] = "<10 ppm <script>"
+    html = preview_html(data)
+    assert "<script>" not in html
+    assert "&lt;10 ppm" in html
@@ -0,0 +1,141 @@
+import time
+
+import pytest
+
+from coa_outbox import FAILED, PENDING, SENT, Outbox, OutboxDispatcher, SmtpPool
+from smtp_sink import SmtpSink
+
+PDF = b"%PDF-1.4 test"
+
+
+@pytest.fixture
+def sink():
+    sink = SmtpSink().start()
+    yield sink
+    sink.shutdown()
+    sink.server_close()
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return Outbox(str(tmp_path / "outbox.sqlite3"))
+
+
+def dispatcher_for(outbox, sink, **options):
+    return OutboxDispatcher(outbox, SmtpPool("127.0.0.1", sink.port, size=1), **options)
+
+
+def queue(outbox, count, recipients=("qa@customer.example",)):
+    return [outbox.enqueue(PDF, list(recipients), f"COA {i}", "COA attached.", f"{i}.pdf", "coa@truherb.example")
+            for i in range(count)]
+
+
+def rows(outbox):
+    with outbox._connect() as conn:
+        return {row[0]: row[1:] for row in conn.execute(
+            "SELECT id, status, attempts, next_attempt_at, last_error, delivered, refused FROM outbox")}
+
+
+def make_due(outbox):
+    # Skip the backoff wait and any lease
+    with outbox._connect() as conn:
+        conn.execute("UPDATE outbox SET next_attempt_at = 0")
+
+
+def test_temporary_failure_is_retried_with_backoff(outbox, sink):
+    sink.fail_every = 2
+    ids = queue(outbox, 3)
+    dispatcher = dispatcher_for(outbox, sink)
+    start = time.time()
+    assert dispatcher.dispatch_once() == (2, 1)
+    status, attempts, next_attempt_at, error, _, _ = rows(outbox)[ids[1]]
+    assert (status, attempts) == (PENDING, 1) and "451" in error
+    assert next_attempt_at >= start + 15
+    assert dispatcher.dispatch_once() == (0, 0)  # not due yet
+
+    sink.fail_every = 0
+    make_due(outbox)
+    assert dispatcher.dispatch_once() == (1, 0)
+    assert outbox.counts() == {SENT: 3}
+    dispatcher.stop()
+
+
+def test_permanent_failure_is_not_retried(outbox, sink):
+    sink.fail_every, sink.fail_reply = 1, "554 rejected"
+    (msg_id,) = queue(outbox, 1)
+    dispatcher = dispatcher_for(outbox, sink)
+    assert dispatcher.dispatch_once() == (0, 1)
+    status, attempts, _, error, _, _ = rows(outbox)[msg_id]
+    assert (status, attempts) == (FAILED, 1) and "554" in error
+    make_due(outbox)
+    assert dispatcher.dispatch_once() == (0, 0)
+    dispatcher.stop()
+
+
+def test_refused_recipients_are_stored_and_retried_or_failed(outbox, sink):
+    sink.refuse = {"busy@customer.example": "450 mailbox busy", "gone@customer.example": "550 no such user"}
+    (msg_id,) = queue(outbox, 1, ["qa@customer.example", "busy@customer.example", "gone@customer.example"])
+    dispatcher = dispatcher_for(outbox, sink)
+    dispatcher.dispatch_once()
+    status, _, _, _, delivered, refused = rows(outbox)[msg_id]
+    assert status == PENDING  # the 4xx refusal is worth another try
+    assert delivered == '["qa@customer.example"]'
+    assert "busy@customer.example" in refused and "gone@customer.example" in refused
+
+    del sink.refuse["busy@customer.example"]
+    make_due(outbox)
+    dispatcher.dispatch_once()
+    assert sink.deliveries == [["qa@customer.example"], ["busy@customer.example"]]
+    status, _, _, error, delivered, refused = rows(outbox)[msg_id]
+    assert status == FAILED and "gone@customer.example (550" in error
+    assert "busy@customer.example" not in refused
+
+    # A retry goes to the recipient that never got it, not to everyone again
+    sink.refuse = {}
+    assert outbox.retry_failed() == 1
+    dispatcher.dispatch_once()
+    assert sink.deliveries[-1] == ["gone@customer.example"]
+    assert outbox.counts() == {SENT: 1}
+    dispatcher.stop()
+
+
+def test_connection_is_reused_across_batches_and_passes(outbox, sink):
+    queue(outbox, 5)
+    dispatcher = dispatcher_for(outbox, sink, batch_size=2)
+    assert dispatcher.dispatch_once() == (5, 0)
+    queue(outbox, 2)
+    assert dispatcher.dispatch_once() == (2, 0)
+    assert dispatcher.pool.opened == 1 and sink.connections == 1
+    dispatcher.stop()
+
+
+class Crash(BaseException):
+    pass
+
+
+def test_outcomes_survive_a_crash_mid_batch(outbox, sink):
+    queue(outbox, 5)
+    dispatcher = dispatcher_for(outbox, sink)
+    record = outbox.record
+    calls = []
+
+    def crash_on_third(outcomes):
+        calls.append(outcomes)
+        if len(calls) == 3:
+            raise Crash()  # the process dies after sending the third message
+        record(outcomes)
+
+    outbox.record = crash_on_third
+    with pytest.raises(Crash):
+        dispatcher.dispatch_once()
+    dispatcher.stop()
+
+    # A fresh process picks up the queue once the dead dispatcher's lease runs out
+    restarted = Outbox(outbox.path)
+    assert restarted.counts() == {SENT: 2, "sending": 3}
+    make_due(restarted)
+    dispatcher = dispatcher_for(restarted, sink)
+    assert dispatcher.dispatch_once() == (3, 0)
+    assert restarted.counts() == {SENT: 5}
+    assert sink.received == 6  # only the message in flight at the crash went out twice
+    dispatcher.stop()
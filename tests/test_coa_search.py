@@ -0,0 +1,38 @@
+import threading
+import time
+
+from coa_search import CoaSearchIndex
+
+
+class SlowArchive:
+    """Stands in for CoaArchive; yields slowly so concurrent refreshes overlap."""
+
+    def __init__(self, count):
+        self.rows = [(i, "2024-01-01", {"product_name": f"Ashwagandha extract {i}", "batch_no": f"B{i}"})
+                     for i in range(1, count + 1)]
+
+    def iter_certificates(self, after_id=0):
+        for row in self.rows:
+            if row[0] > after_id:
+                time.sleep(0.001)
+                yield row
+
+
+def test_search_ranks_matches():
+    index = CoaSearchIndex(SlowArchive(3))
+    assert index.refresh() == 3
+    hits = index.search("ashwagandha")
+    assert {hit.cert_id for hit in hits} == {1, 2, 3}
+    assert hits[0].cert_id == 3  # newest first among equal scores
+    assert index.search("turmeric") == []
+
+
+def test_concurrent_refreshes_index_each_certificate_once():
+    index = CoaSearchIndex(SlowArchive(50))
+    threads = [threading.Thread(target=index.refresh) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(index) == 50
+    assert index.refresh() == 0
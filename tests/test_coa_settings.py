@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+import coa_settings
+from coa_settings import DEFAULT_LAYOUT, Settings, SettingsError, get_settings, load_settings, make_layout
+
+CONFIG = """
+[settings]
+admin_key = "secret"
+
+[coa]
+spec_table_width = 480
+remarks_text = "Natural product"
+
+[coa.products.ASH-100]
+allergen_statement = "Contains Allergen"
+spec_col_ratios = [0.25, 0.35, 0.2, 0.2]
+"""
+
+
+def write(path, text):
+    path.write_text(text, encoding="utf-8")
+    # A later edit within the same mtime tick must still be seen as a change
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + len(text) * 1_000_000))
+
+
+def test_parses_app_settings_and_layout(tmp_path):
+    path = tmp_path / "config.toml"
+    write(path, CONFIG)
+    settings = load_settings(str(path))
+    assert settings.get("admin_key") == "secret"
+    layout = settings.layout()
+    assert layout.spec_table_width == 480
+    assert layout.remarks_text == "Natural product"
+    assert layout.spec_col_widths == tuple(480 * ratio for ratio in DEFAULT_LAYOUT.spec_col_ratios)
+    assert layout.gmo_status == DEFAULT_LAYOUT.gmo_status
+
+
+def test_missing_file_gives_defaults(tmp_path):
+    assert load_settings(str(tmp_path / "missing.toml")).layout() == DEFAULT_LAYOUT
+
+
+def test_product_overrides_apply_on_top_of_coa(tmp_path):
+    path = tmp_path / "config.toml"
+    write(path, CONFIG)
+    settings = load_settings(str(path))
+    product = settings.layout(" ASH-100 ")
+    assert product.allergen_statement == "Contains Allergen"
+    assert product.spec_col_widths == tuple(480 * ratio for ratio in (0.25, 0.35, 0.2, 0.2))
+    assert product.remarks_text == "Natural product"  # inherited from [coa]
+    assert settings.layout("OTHER") == settings.layout()
+
+
+def test_layout_digest_follows_the_products_layout(monkeypatch):
+    settings = Settings({"coa": {"products": {"ASH-100": {"remarks_text": "Other"}}}})
+    monkeypatch.setattr(coa_settings, "get_settings", lambda: settings)
+    digest = coa_settings.layout_digest({"product_code": "ASH-100"})
+    assert digest != coa_settings.layout_digest({"product_code": "OTHER"})
+    assert digest == coa_settings.layout_digest({"product_code": "ASH-100", "batch_no": "B1"})
+
+
+@pytest.mark.parametrize("values, message", [
+    ({"allergen_statement": "May contain nuts"}, "allergen_statement must be one of"),
+    ({"spec_col_ratios": [0.5, 0.5]}, "list of 4 positive numbers"),
+    ({"remarks_text": 3}, "remarks_text must be a str"),
+    ({"footer_text": "x"}, "unknown [coa] setting"),
+])
+def test_bad_values_are_rejected(values, message):
+    with pytest.raises(SettingsError, match=message.replace("[", r"\[")):
+        make_layout(values)
+
+
+def test_bad_edit_keeps_the_last_good_settings(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(coa_settings, "CHECK_SECONDS", 0)
+    path = tmp_path / "config.toml"
+    write(path, CONFIG)
+    assert get_settings(str(path)).layout().spec_table_width == 480
+
+    write(path, CONFIG.replace('"Contains Allergen"', '"Contains nuts"'))
+    assert get_settings(str(path)).layout("ASH-100").allergen_statement == "Contains Allergen"
+    assert "keeping the previous settings" in capsys.readouterr().err
+
+    write(path, "[coa\nbroken")
+    assert get_settings(str(path)).layout().spec_table_width == 480
+
+    write(path, CONFIG.replace("480", "460"))
+    assert get_settings(str(path)).layout().spec_table_width == 460
@@ -0,0 +1,44 @@
+import pytest
+
+from compliance import FAIL, NOT_EVALUATED, PASS, evaluate
+
+
+@pytest.mark.parametrize("spec, result, status", [
+    ("NMT 10 ppm", "3.2 ppm", PASS),
+    ("NMT 10 ppm", "12 ppm", FAIL),
+    ("NLT 95%", "96.1%", PASS),
+    ("NLT 95%", "94%", FAIL),
+    ("Between 0.3g/ml to 0.6g/ml", "0.45 g/ml", PASS),
+    ("NMT 10 ppm", "8000 ppb", PASS),
+    ("Absent/10g", "Absent", PASS),
+    ("Absent/10g", "Present", FAIL),
+    ("Absent/10g", "<10 cfu/g", NOT_EVALUATED),
+    ("To comply by TLC", "Complies", NOT_EVALUATED),
+])
+def test_evaluate(spec, result, status):
+    assert evaluate([spec], [result]).tolist() == [status]
+
+
+# A "<" result only bounds the value from above
+@pytest.mark.parametrize("spec, result, status", [
+    ("<10 cfu/g", "<10 cfu/g", PASS),
+    ("Less than 10 cfu/g", "<10 cfu/g", PASS),
+    ("NMT 10 cfu/g", "<10 cfu/g", PASS),
+    ("NMT 1 ppm", "<0.05 ppm (LOQ)", PASS),
+    ("<1 ppm", "<0.05 ppm (LOQ)", PASS),
+    ("NMT 1 ppm", "<LOQ", NOT_EVALUATED),
+    ("<1 ppm", "<LOQ", NOT_EVALUATED),
+    ("NMT 10 cfu/g", "<100 cfu/g", NOT_EVALUATED),
+    ("NMT 10 ppm", "<5000 ppb", PASS),
+    ("NLT 95%", "<99%", NOT_EVALUATED),
+    ("Between 5 to 10", "<8", NOT_EVALUATED),
+])
+def test_below_results(spec, result, status):
+    assert evaluate([spec], [result]).tolist() == [status]
+
+
+def test_evaluate_is_elementwise():
+    specs = ["NMT 10", "<10", "NLT 5"]
+    results = ["<10", "12", "<3"]
+    assert evaluate(specs, results).tolist() == [PASS, FAIL, NOT_EVALUATED]
+    assert evaluate([], []).tolist() == []
@@ -0,0 +1,67 @@
+import fitz
+import numpy as np
+import pytest
+
+from compliance import FAIL, evaluate_batch
+from fast_render import FastRenderUnsupported, layout_blocks, render_fast
+from pdf_generator import generate_pdf
+from samples import sample_data
+
+DPI = 100
+
+
+def pages(buffer):
+    return fitz.open(stream=buffer.getvalue(), filetype="pdf")
+
+
+def words(page):
+    """Every word on the page with its position, to a tenth of a point."""
+    return [(round(x0, 1), round(y0, 1), text) for x0, y0, _, _, text, *_ in page.get_text("words")]
+
+
+def pixels(page):
+    pixmap = page.get_pixmap(dpi=DPI)
+    return np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.h, pixmap.w, pixmap.n).astype(int)
+
+
+def assert_same_pages(fast, reference):
+    fast, reference = pages(fast), pages(reference)
+    assert len(fast) == len(reference)
+    for fast_page, reference_page in zip(fast, reference):
+        assert words(fast_page) == words(reference_page)
+        # Anti-aliasing of a few grid line edges may differ by a subpixel; nothing else
+        diff = np.abs(pixels(fast_page) - pixels(reference_page))
+        assert (diff > 32).mean() < 1e-4
+
+
+@pytest.mark.parametrize("i", range(6))
+def test_fast_path_matches_generate_pdf(i):
+    data = sample_data(i)
+    layout_blocks(data)  # takes the fast path
+    assert_same_pages(render_fast(data, deterministic=True), generate_pdf(data, deterministic=True))
+
+
+def test_failing_rows_match_generate_pdf():
+    data = sample_data(0)
+    assert (evaluate_batch([data]).status == FAIL).any()
+    assert_same_pages(render_fast(data, deterministic=True), generate_pdf(data, deterministic=True))
+
+
+def fallback_cases():
+    markup = sample_data(1)
+    markup["chemical_name"] = "Withanolides <i>(HPLC)</i>"
+    long_name = sample_data(2)
+    long_name["product_name"] = "Ashwagandha Root Extract Standardized To Withanolides By HPLC " * 2
+    # One word wider than its cell: the fixed layout cannot split it as platypus would
+    wide_row = sample_data(3)
+    wide_row["physical_extra_rows"] = [["Particle size", "Passes" * 20, "Complies", "Sieve"]]
+    return [("markup", markup), ("long product name", long_name), ("row too wide to wrap", wide_row)]
+
+
+@pytest.mark.parametrize("case, data", fallback_cases(), ids=[case for case, _ in fallback_cases()])
+def test_fallback_renders_through_generate_pdf(case, data):
+    with pytest.raises(FastRenderUnsupported):
+        layout_blocks(data)
+    fast = render_fast(data, deterministic=True)
+    assert fast.getvalue() == generate_pdf(data, deterministic=True).getvalue()
+    assert words(pages(fast)[0])
@@ -0,0 +1,120 @@
+import pytest
+
+import render_queue
+from render_queue import BULK, DONE, INTERACTIVE, NORMAL, URGENT_SECONDS, RenderQueue
+from samples import sample_data
+
+
+@pytest.fixture
+def queue():
+    # No workers: jobs stay queued and the test takes them off with _pick
+    queue = RenderQueue(max_workers=0)
+    yield queue
+    queue.shutdown()
+
+
+def submit(queue, i, **options):
+    return queue.get(queue.submit(sample_data(i), **options))
+
+
+def pick_order(queue):
+    """Batch numbers of the queued jobs in the order the workers would start them."""
+    order = []
+    with queue._lock:
+        while (job := queue._pick()) is not None:
+            order.append(job.data["batch_no"])
+    return order
+
+
+def batch(i):
+    return sample_data(i)["batch_no"]
+
+
+def test_priority_classes_start_in_order(queue):
+    submit(queue, 0, priority=BULK, owner="batch")
+    submit(queue, 1, priority=NORMAL, owner="a")
+    submit(queue, 2, priority=INTERACTIVE, owner="b")
+    submit(queue, 3, priority=NORMAL, owner="a")
+    assert pick_order(queue) == [batch(2), batch(1), batch(3), batch(0)]
+
+
+def test_deadlines_order_their_class_and_urgent_ones_jump_classes(queue):
+    submit(queue, 0, priority=INTERACTIVE, owner="a")
+    submit(queue, 1, priority=NORMAL, owner="a")
+    submit(queue, 2, priority=NORMAL, owner="a", deadline=3600)
+    submit(queue, 3, priority=NORMAL, owner="a", deadline=1800)
+    submit(queue, 4, priority=NORMAL, owner="a", deadline=URGENT_SECONDS / 2)
+    # Urgent first; then the interactive class; then normal jobs by deadline, then the rest
+    assert pick_order(queue) == [batch(4), batch(0), batch(3), batch(2), batch(1)]
+
+
+def test_bulk_deadlines_never_go_ahead_of_interactive_work(queue):
+    submit(queue, 0, priority=BULK, owner="batch", deadline=1)
+    submit(queue, 1, priority=INTERACTIVE, owner="a")
+    assert pick_order(queue) == [batch(1), batch(0)]
+
+
+def test_bulk_jobs_wait_while_the_bulk_workers_are_busy(queue):
+    submit(queue, 0, priority=BULK, owner="batch")
+    with queue._lock:
+        queue._running[BULK] = queue.bulk_limit
+        assert queue._pick() is None
+        queue._running[BULK] = 0
+    assert pick_order(queue) == [batch(0)]
+
+
+def test_least_served_owner_goes_first_fifo_within_an_owner(queue):
+    for i in range(3):
+        submit(queue, i, owner="busy")
+    for i in range(3, 5):
+        submit(queue, i, owner="quiet")
+    queue._served.update(busy=10.0, quiet=0.0)
+    assert pick_order(queue) == [batch(3), batch(4), batch(0), batch(1), batch(2)]
+
+
+def test_resubmitting_a_queued_job_moves_it_up(queue):
+    first = submit(queue, 0, priority=BULK, owner="batch")
+    submit(queue, 1, priority=NORMAL, owner="a")
+    again = submit(queue, 0, priority=INTERACTIVE, owner="b")
+    assert again is first and first.priority == INTERACTIVE
+    assert pick_order(queue) == [batch(0), batch(1)]  # the stale bulk entry is skipped
+
+
+@pytest.fixture
+def counted_renders(monkeypatch):
+    calls = []
+
+    def render(data, backend):
+        calls.append(data["batch_no"])
+        return f"PDF {data['batch_no']}".encode() * 100
+
+    monkeypatch.setitem(render_queue.RENDERERS, "pdf", render)
+    return calls
+
+
+def finished_job(queue, i):
+    job = submit(queue, i)
+    with queue._lock:
+        queue._pick()
+    queue._run(job, job.data, job.backend)
+    assert job.state == DONE
+    return job
+
+
+@pytest.mark.parametrize("spill", [True, False], ids=["spilled", "dropped"])
+def test_evicted_results_come_back(queue, counted_renders, tmp_path, spill):
+    queue.spill_dir = str(tmp_path) if spill else None
+    job = finished_job(queue, 0)
+    expected = job.result
+    assert queue.evict(job.job_id) == len(expected)
+    assert not job.in_memory and queue.memory_bytes() == 0
+    assert queue.evict(job.job_id) == 0  # nothing left to free
+    assert job.result == expected
+    # A spilled result is read back from disk; a dropped one is rendered again
+    assert counted_renders == ([batch(0)] if spill else [batch(0), batch(0)])
+
+
+def test_evict_ignores_unfinished_jobs(queue):
+    job = submit(queue, 0)
+    assert queue.evict(job.job_id) == 0
+    assert queue.evict("no-such-job") == 0
@@ -0,0 +1,31 @@
+import unicodedata
+from collections import Counter
+
+import fitz
+import pytest
+
+from renderers import BACKENDS
+from samples import sample_data
+
+
+def printed_words(pdf_bytes):
+    """Every word on the first page, ligatures expanded, in no particular order."""
+    page = fitz.open(stream=pdf_bytes, filetype="pdf")[0]
+    return Counter(unicodedata.normalize("NFKC", word[4]) for word in page.get_text("words"))
+
+
+def markup_record():
+    data = sample_data(24)
+    assert data["chemical_name"] == "Withanolides <i>(HPLC)</i>"
+    data["product_name"] = "Ashwagandha &amp; Tulsi"
+    data["physical_extra_rows"] = [["Odour <b>and</b> taste", "Characteristic<br/>mild", "Complies", "Organoleptic"]]
+    return data
+
+
+@pytest.mark.parametrize("name", [name for name in BACKENDS if name != "reportlab"])
+def test_backends_print_the_same_text_for_markup(name):
+    data = markup_record()
+    reference = printed_words(BACKENDS["reportlab"].render(data, deterministic=True))
+    assert reference["(HPLC)"] == 1 and reference["&"] >= 1
+    assert not any(word.startswith(("<i>", "<b>", "&amp;")) or "<br" in word for word in reference)
+    assert printed_words(BACKENDS[name].render(data, deterministic=True)) == reference